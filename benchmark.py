@@ -0,0 +1,191 @@
+import argparse
+import json
+import multiprocessing
+import platform
+import random
+import statistics
+import sys
+import time
+import tracemalloc
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+
+from stepik_pandas import DataManager, Film, User, Genres, RecommendationService
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+# Бенчмарк стратегий на синтетических данных.
+# Пример: python benchmark.py --films 1000 100000 --users 1000 --output bench.json --compare old.json
+
+
+def generate_data(films, users, ratings_per_user=20, genre_skew=1.0, popularity_skew=2.0,
+                  rating_mean=7.0, rating_std=1.5, seed=0):
+    # genre_skew - насколько неравномерны жанры (0 - равномерно), popularity_skew - насколько
+    # оценки сосредоточены на первых фильмах каталога (1 - равномерно)
+    rnd = random.Random(seed)
+    genres = list(Genres)
+    genre_weights = [1 / (i + 1) ** genre_skew for i in range(len(genres))]
+    clip = lambda value: min(10.0, max(0.0, round(value, 1)))
+
+    dm = DataManager()
+    for film_id in range(1, films + 1):
+        film_genres = list(dict.fromkeys(rnd.choices(genres, genre_weights, k=rnd.randint(1, 3))))
+        dm.add_film(Film(film_id, f"Film {film_id}", film_genres, f"Director {film_id % 5000}",
+                         rnd.randint(1920, 2024), clip(rnd.gauss(rating_mean, rating_std))))
+    catalog = dm._films
+    for user_id in range(1, users + 1):
+        preferred = list(dict.fromkeys(rnd.choices(genres, genre_weights, k=rnd.randint(1, 3))))
+        user = User(user_id, f"user{user_id}", preferred_genres=preferred)
+        dm.add_user(user)
+        for _ in range(ratings_per_user):
+            film = catalog[1 + int(films * rnd.random() ** popularity_skew)]
+            user.add_watched_film(film, clip(rnd.gauss(film.rating, rating_std)))
+    return dm
+
+
+def percentile(sorted_values, p):
+    if not sorted_values:
+        return 0.0
+    k = (len(sorted_values) - 1) * p / 100
+    low = int(k)
+    high = min(low + 1, len(sorted_values) - 1)
+    return sorted_values[low] + (sorted_values[high] - sorted_values[low]) * (k - low)
+
+
+def peak_rss_mb():
+    # Пик за всю жизнь процесса, поэтому каждый масштаб меряется в своём процессе (run_scale_isolated)
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 1024 / 1024 if sys.platform == "darwin" else peak / 1024
+
+
+def measure(call, users):
+    latencies = []
+    started = time.perf_counter()
+    for user in users:
+        t = time.perf_counter()
+        call(user)
+        latencies.append((time.perf_counter() - t) * 1000)
+    total = time.perf_counter() - started
+    latencies.sort()
+    return {
+        "requests": len(latencies),
+        "mean_ms": statistics.fmean(latencies),
+        "p50_ms": percentile(latencies, 50),
+        "p95_ms": percentile(latencies, 95),
+        "p99_ms": percentile(latencies, 99),
+        "max_ms": latencies[-1],
+        "throughput_rps": len(latencies) / total if total else 0.0,
+    }
+
+
+def run_scale(films, users, args):
+    if args.trace_memory:
+        tracemalloc.start()
+    started = time.perf_counter()
+    dm = generate_data(films, users, args.ratings_per_user, args.genre_skew, args.popularity_skew,
+                       args.rating_mean, args.rating_std, args.seed)
+    build_seconds = time.perf_counter() - started
+    dataset_mb = None
+    if args.trace_memory:
+        dataset_mb = tracemalloc.get_traced_memory()[0] / 1024 / 1024
+        tracemalloc.stop()
+
+    started = time.perf_counter()
+    dm.train_factors(iterations=args.als_iterations, processes=args.processes)  # иначе обучение попадёт в прогрев als
+    factors_seconds = time.perf_counter() - started
+
+    service = RecommendationService(cache_size=0)  # меряем сами стратегии, а не кэш
+    rnd = random.Random(args.seed + 1)
+    sample = [dm._users[rnd.randint(1, users)] for _ in range(args.requests)]
+    calls = {name: (lambda user, strategy=service[name]: strategy(dm, user)) for name in service.available_strategies}
+    calls["all"] = lambda user: service.get_all_recommendations(dm, user)
+
+    results = []
+    for name, call in calls.items():
+        for user in sample[:args.warmup]:
+            call(user)
+        row = {"films": films, "users": users, "strategy": name, "build_s": build_seconds,
+               "factors_s": factors_seconds, "dataset_mb": dataset_mb}
+        row.update(measure(call, sample))
+        row["peak_rss_mb"] = peak_rss_mb()
+        results.append(row)
+        print(f"{films:>8} фильмов {users:>7} польз. {name:>8}: p50 {row['p50_ms']:8.2f} мс  "
+              f"p95 {row['p95_ms']:8.2f} мс  p99 {row['p99_ms']:8.2f} мс  {row['throughput_rps']:9.1f} зап/с",
+              file=sys.stderr)
+    return results
+
+
+def run_scale_isolated(films, users, args):
+    # Новый процесс (spawn, без копии памяти родителя) на масштаб: иначе после самого большого
+    # масштаба peak_rss_mb показывал бы его пик для всех следующих
+    with ProcessPoolExecutor(1, mp_context=multiprocessing.get_context("spawn")) as pool:
+        return pool.submit(run_scale, films, users, args).result()
+
+
+def compare(results, baseline_path, threshold):
+    # Сравнивает p50/p95 с прошлым запуском; регрессия - замедление больше чем в threshold раз
+    with open(baseline_path, encoding="utf-8") as f:
+        baseline = {(r["films"], r["users"], r["strategy"]): r for r in json.load(f)["results"]}
+    regressions = []
+    for row in results:
+        old = baseline.get((row["films"], row["users"], row["strategy"]))
+        if old is None:
+            continue
+        for metric in ("p50_ms", "p95_ms"):
+            if old[metric] > 0 and row[metric] / old[metric] > threshold:
+                regressions.append((row["films"], row["users"], row["strategy"], metric, old[metric], row[metric]))
+    for films, users, name, metric, old, new in regressions:
+        print(f"РЕГРЕССИЯ {films} фильмов / {users} польз. / {name}: {metric} {old:.2f} -> {new:.2f} мс",
+              file=sys.stderr)
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Бенчмарк стратегий рекомендаций на синтетических данных")
+    parser.add_argument("--films", type=int, nargs="+", default=[1000, 100000, 1000000])
+    parser.add_argument("--users", type=int, nargs="+", default=[1000, 100000])
+    parser.add_argument("--ratings-per-user", type=int, default=20)
+    parser.add_argument("--genre-skew", type=float, default=1.0)
+    parser.add_argument("--popularity-skew", type=float, default=2.0)
+    parser.add_argument("--rating-mean", type=float, default=7.0)
+    parser.add_argument("--rating-std", type=float, default=1.5)
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--warmup", type=int, default=10)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--als-iterations", type=int, default=5)
+    parser.add_argument("--processes", type=int, help="процессов для обучения ALS (по умолчанию - все ядра)")
+    parser.add_argument("--trace-memory", action="store_true", help="мерить память данных через tracemalloc (медленнее)")
+    parser.add_argument("--output", help="куда записать результаты в JSON")
+    parser.add_argument("--compare", help="JSON прошлого запуска для сравнения")
+    parser.add_argument("--threshold", type=float, default=1.2)
+    args = parser.parse_args(argv)
+
+    results = []
+    for films in args.films:
+        for users in args.users:
+            results.extend(run_scale_isolated(films, users, args))
+    report = {
+        "meta": {
+            "timestamp": datetime.now().isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "args": vars(args),
+        },
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+    else:
+        print(json.dumps(report, ensure_ascii=False, indent=2))
+    if args.compare and compare(results, args.compare, args.threshold):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
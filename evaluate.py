@@ -0,0 +1,205 @@
+import argparse
+import json
+import math
+import random
+import statistics
+import sys
+import time
+from collections import defaultdict
+from datetime import datetime
+from itertools import islice
+
+from benchmark import generate_data, percentile
+from loader import BulkLoader, UNKNOWN_DIRECTOR
+from stepik_pandas import DataManager, Film, User, RecommendationService, _run_forked
+
+# Офлайн-оценка качества стратегий: оценки DataManager делятся на обучающие и проверочные,
+# стратегии считаются на обучающих для всех проверочных пользователей в пуле процессов,
+# и рядом с задержкой печатаются precision@k, recall@k, NDCG@k и покрытие каталога.
+# Пример: python evaluate.py --films-file movies.csv --ratings-file ratings.csv --rating-scale 2 --split time
+#         python evaluate.py --synthetic-films 10000 --synthetic-users 5000 --strategies genre knn als
+
+
+def split_ratings(data_manager, method="leave-k-out", holdout=5, min_train=1, max_users=None, seed=0,
+                  timestamps=None):
+    # -> (DataManager с обучающими оценками, {user_id: {film_id: оценка}} отложенных оценок).
+    # time - отложены последние по времени holdout оценок пользователя; время берётся из timestamps
+    # ({(user_id, film_id): время}, BulkLoader(keep_timestamps=True)), оценки без времени считаются
+    # самыми ранними. leave-k-out - случайные holdout оценок. Пользователи, у которых после отбора
+    # останется меньше min_train оценок, целиком идут в обучение.
+    if method not in ("time", "leave-k-out"):
+        raise ValueError("method должен быть 'time' или 'leave-k-out'")
+    if method == "time" and not timestamps:
+        # Порядок добавления оценок - не время: в MovieLens ratings.csv он по movieId
+        raise ValueError("Для разбиения по времени нужно время оценок (timestamps)")
+    rnd = random.Random(seed)
+    candidates = [user_id for user_id, user in data_manager._users.items()
+                  if len(user.watched_films) >= holdout + min_train]
+    if max_users is not None and len(candidates) > max_users:
+        candidates = rnd.sample(candidates, max_users)
+    candidates = set(candidates)
+
+    train = DataManager()
+    for film in data_manager._films.values():
+        train.add_film(Film(film.movie_id, film.title, film.genres, film.director, film.year, film.rating))
+    films = train._films
+    test = {}
+    for user_id, user in data_manager._users.items():
+        ratings = [(film.movie_id, rating) for film, rating in user.watched_films.items()]
+        if user_id in candidates:
+            if method == "time":
+                ratings.sort(key=lambda item: timestamps.get((user_id, item[0]), -math.inf))
+                held = set(range(len(ratings) - holdout, len(ratings)))
+            else:
+                held = set(rnd.sample(range(len(ratings)), holdout))
+            test[user_id] = {film_id: rating for i, (film_id, rating) in enumerate(ratings) if i in held}
+            ratings = [item for i, item in enumerate(ratings) if i not in held]
+        watched = {films[film_id]: rating for film_id, rating in ratings}
+        train.add_user(User(user_id, user.user_name, watched, list(user.preferred_genres)))
+    return train, test
+
+
+def ranking_metrics(recommended, relevant, k):
+    # (precision@k, recall@k, NDCG@k) с бинарной релевантностью
+    hits = [i for i, film_id in enumerate(recommended[:k]) if film_id in relevant]
+    dcg = sum(1 / math.log2(i + 2) for i in hits)
+    idcg = sum(1 / math.log2(i + 2) for i in range(min(k, len(relevant))))
+    return len(hits) / k, len(hits) / len(relevant), dcg / idcg
+
+
+def _evaluate_chunk(context, user_ids):
+    # context - (train, сервис, стратегии), воркеры получают его через fork, как в recommend_batch.
+    # -> [(стратегия, user_id, [film_id], секунды)]
+    train, service, strategy_names = context
+    results = []
+    with train.reading():
+        for user_id in user_ids:
+            user = train._users[user_id]
+            for name in strategy_names:
+                started = time.perf_counter()
+                films = service[name](train, user)
+                results.append((name, user_id, [film.movie_id for film in films], time.perf_counter() - started))
+    return results
+
+
+def evaluate(train, test, strategy_names, k=10, threshold=7.0, processes=None, chunk_size=64):
+    # Сводка по стратегиям: {стратегия: {precision, recall, ndcg, coverage, задержки}}.
+    # Релевантны отложенные оценки не ниже threshold; пользователи без таких оценок не учитываются.
+    service = RecommendationService(cache_size=0)  # задержка самих стратегий, а не кэша
+    for name in strategy_names:
+        if name not in service.available_strategies:
+            raise ValueError(f"Стратегия '{name}' не найдена. Доступны: {service.available_strategies}")
+        service[name].recommendation_count = k
+    relevant = {user_id: {film_id for film_id, rating in ratings.items() if rating >= threshold}
+                for user_id, ratings in test.items()}
+    user_ids = iter([user_id for user_id in test if relevant[user_id]])
+    chunks = iter(lambda: list(islice(user_ids, chunk_size)), [])
+    scores = defaultdict(lambda: defaultdict(list))
+    recommended = defaultdict(set)
+    for chunk in _run_forked(_evaluate_chunk, (train, service, strategy_names), chunks, processes, train):
+        for name, user_id, film_ids, seconds in chunk:
+            precision, recall, ndcg = ranking_metrics(film_ids, relevant[user_id], k)
+            scores[name]["precision"].append(precision)
+            scores[name]["recall"].append(recall)
+            scores[name]["ndcg"].append(ndcg)
+            scores[name]["latency"].append(seconds * 1000)
+            recommended[name].update(film_ids)
+
+    report = {}
+    for name in strategy_names:
+        latencies = sorted(scores[name]["latency"])
+        report[name] = {
+            "users": len(latencies),
+            f"precision@{k}": statistics.fmean(scores[name]["precision"]) if latencies else 0.0,
+            f"recall@{k}": statistics.fmean(scores[name]["recall"]) if latencies else 0.0,
+            f"ndcg@{k}": statistics.fmean(scores[name]["ndcg"]) if latencies else 0.0,
+            "coverage": len(recommended[name]) / len(train._films) if len(train._films) else 0.0,
+            "mean_ms": statistics.fmean(latencies) if latencies else 0.0,
+            "p50_ms": percentile(latencies, 50),
+            "p95_ms": percentile(latencies, 95),
+            "p99_ms": percentile(latencies, 99),
+        }
+    return report
+
+
+def prepare(train, strategy_names, processes):
+    # Ленивые модели строятся до fork: иначе каждый воркер строил бы их сам, а время попало бы в задержку
+    if "als" in strategy_names:
+        train.train_factors(processes=processes)
+    if "item" in strategy_names:
+        train.build_film_neighbours(processes)
+    if "knn" in strategy_names or "hybrid" in strategy_names:
+        train._neighbours.build()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Офлайн-оценка качества и скорости стратегий рекомендаций")
+    parser.add_argument("--snapshot", help="снимок DataManager с оценками")
+    parser.add_argument("--films-file", help="каталог в стиле MovieLens (вместе с --ratings-file)")
+    parser.add_argument("--ratings-file")
+    parser.add_argument("--rating-scale", type=float, default=1.0)
+    parser.add_argument("--synthetic-films", type=int, default=5000, help="без файлов - синтетические данные")
+    parser.add_argument("--synthetic-users", type=int, default=2000)
+    parser.add_argument("--ratings-per-user", type=int, default=30)
+    parser.add_argument("--split", choices=["time", "leave-k-out"], default="leave-k-out")
+    parser.add_argument("--holdout", type=int, default=5, help="сколько оценок пользователя откладывается")
+    parser.add_argument("--min-train", type=int, default=1)
+    parser.add_argument("--max-users", type=int, help="проверять не больше стольких пользователей")
+    parser.add_argument("--strategies", nargs="+", help="по умолчанию - все зарегистрированные")
+    parser.add_argument("-k", type=int, default=10)
+    parser.add_argument("--threshold", type=float, default=7.0, help="оценка, с которой фильм считается релевантным")
+    parser.add_argument("--processes", type=int, help="процессов (по умолчанию - все ядра, 1 - без пула)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="куда записать отчёт в JSON")
+    args = parser.parse_args(argv)
+
+    if args.split == "time" and (args.snapshot or not args.ratings_file):
+        parser.error("--split time работает только с --ratings-file, где есть колонка timestamp")
+
+    started = time.perf_counter()
+    timestamps = None
+    if args.snapshot:
+        data_manager = DataManager.open_snapshot(args.snapshot)
+    elif args.films_file:
+        data_manager = DataManager()
+        # Режиссёр в оценке качества не участвует, а в MovieLens его колонки нет
+        loader = BulkLoader(data_manager, rating_scale=args.rating_scale, keep_timestamps=args.split == "time",
+                            default_director=UNKNOWN_DIRECTOR)
+        loader.load(args.films_file, args.ratings_file)
+        timestamps = loader.timestamps
+        if args.split == "time" and not timestamps:
+            parser.error(f"в {args.ratings_file} нет колонки timestamp, --split time невозможен")
+    else:
+        data_manager = generate_data(args.synthetic_films, args.synthetic_users, args.ratings_per_user, seed=args.seed)
+    train, test = split_ratings(data_manager, args.split, args.holdout, args.min_train, args.max_users, args.seed,
+                                timestamps)
+    data_manager = None
+    strategy_names = args.strategies or RecommendationService().available_strategies
+    prepare(train, strategy_names, args.processes)
+    prepare_seconds = time.perf_counter() - started
+
+    report = evaluate(train, test, strategy_names, args.k, args.threshold, args.processes)
+    k = args.k
+    for name, row in report.items():
+        print(f"{name:>10}: P@{k} {row[f'precision@{k}']:.4f}  R@{k} {row[f'recall@{k}']:.4f}  "
+              f"NDCG@{k} {row[f'ndcg@{k}']:.4f}  покрытие {row['coverage']:.3f}  "
+              f"p50 {row['p50_ms']:.2f} мс  p95 {row['p95_ms']:.2f} мс  ({row['users']} польз.)", file=sys.stderr)
+    output = {
+        "meta": {
+            "timestamp": datetime.now().isoformat(timespec="seconds"),
+            "args": vars(args),
+            "films": len(train._films),
+            "test_users": len(test),
+            "prepare_s": prepare_seconds,
+        },
+        "results": report,
+    }
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(output, f, ensure_ascii=False, indent=2)
+    else:
+        print(json.dumps(output, ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()
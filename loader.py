@@ -0,0 +1,304 @@
+import argparse
+import csv
+import os
+import re
+import sys
+import time
+from collections import Counter
+from dataclasses import dataclass, field
+from itertools import islice
+from typing import List, Optional
+
+from stepik_pandas import DataManager, Film, User, Genres
+
+# Потоковая загрузка каталога и оценок из файлов в стиле MovieLens (CSV, TSV, ::-разделённые .dat).
+# Файлы читаются пачками по chunk_size строк, поэтому память не зависит от размера файла.
+# Каждая пачка добавляется под одной блокировкой записи DataManager.
+
+GENRE_NAMES = {genre.value.lower(): genre for genre in Genres}
+GENRE_NAMES.update({
+    "children": Genres.FAMILY,
+    "children's": Genres.FAMILY,
+    "film-noir": Genres.CRIME,
+    "war": Genres.HISTORY,
+    "science fiction": Genres.SCI_FI,
+    "music": Genres.MUSICAL,
+})
+SKIPPED_GENRES = {"(no genres listed)", "imax"}
+
+# Возможные названия колонок в заголовке -> поле; без заголовка колонки берутся по порядку
+FILM_COLUMNS = {
+    "id": ("movieid", "movie_id", "film_id", "id"),
+    "title": ("title", "name"),
+    "genres": ("genres", "genre"),
+    "director": ("director",),
+    "year": ("year",),
+    "rating": ("rating", "imdb_rating"),
+}
+USER_COLUMNS = {
+    "id": ("userid", "user_id", "id"),
+    "name": ("name", "user_name", "username"),
+}
+RATING_COLUMNS = {
+    "user_id": ("userid", "user_id"),
+    "film_id": ("movieid", "movie_id", "film_id", "itemid"),
+    "rating": ("rating", "score"),
+    "timestamp": ("timestamp", "time", "ts"),
+}
+
+TITLE_YEAR = re.compile(r"\s*\((\d{4})\)\s*$")
+MAX_BAD_ROW_SAMPLES = 20
+UNKNOWN_DIRECTOR = "Неизвестен"  # для каталогов без колонки director, например movies.csv MovieLens
+
+
+def parse_genres(text: str):
+    # "Adventure|Children|Fantasy" -> ([Genres...], [нераспознанные названия])
+    genres, unknown = [], []
+    for name in re.split(r"[|,]", text):
+        name = name.strip()
+        if not name or name.lower() in SKIPPED_GENRES:
+            continue
+        genre = GENRE_NAMES.get(name.lower())
+        if genre is None:
+            unknown.append(name)
+        elif genre not in genres:
+            genres.append(genre)
+    return genres, unknown
+
+
+def validate_film(film: Film):
+    # Конструктор Film поля не проверяет, поэтому значения присваиваются заново через сеттеры:
+    # строка проходит те же правила (год 1800-2100, непустые название и режиссёр, рейтинг 0-10),
+    # что и правка фильма в приложении. Ошибка - ValueError или TypeError из сеттера
+    film.title, film.director, film.year, film.rating = film.title, film.director, film.year, film.rating
+
+
+def read_rows(path: str, encoding="utf-8"):
+    with open(path, encoding=encoding, errors="replace", newline="") as f:
+        if path.endswith(".dat"):
+            for line in f:
+                yield line.rstrip("\r\n").split("::")
+        else:
+            delimiter = "\t" if path.endswith((".tsv", ".tab")) else ","
+            yield from csv.reader(f, delimiter=delimiter)
+
+
+@dataclass
+class LoadReport:
+    films_loaded: int = 0
+    users_loaded: int = 0
+    ratings_loaded: int = 0
+    ratings_overwritten: int = 0
+    duplicate_films: int = 0
+    duplicate_users: int = 0
+    bad_rows: int = 0
+    bad_row_samples: List[tuple] = field(default_factory=list)  # (файл, номер строки, причина)
+    unknown_genres: Counter = field(default_factory=Counter)
+    ratings_seconds: float = 0.0
+    total_seconds: float = 0.0
+
+    @property
+    def ratings_per_second(self):
+        return self.ratings_loaded / self.ratings_seconds if self.ratings_seconds else 0.0
+
+    def add_bad_row(self, path, line_no, reason):
+        self.bad_rows += 1
+        if len(self.bad_row_samples) < MAX_BAD_ROW_SAMPLES:
+            self.bad_row_samples.append((os.path.basename(path), line_no, reason))
+
+    def __str__(self):
+        lines = [
+            f"Фильмов загружено: {self.films_loaded} (дубликатов: {self.duplicate_films})",
+            f"Пользователей загружено: {self.users_loaded} (дубликатов: {self.duplicate_users})",
+            f"Оценок загружено: {self.ratings_loaded} (перезаписано: {self.ratings_overwritten}), "
+            f"{self.ratings_per_second:,.0f} оценок/с",
+            f"Ошибочных строк: {self.bad_rows}",
+        ]
+        for name, line_no, reason in self.bad_row_samples:
+            lines.append(f"  {name}:{line_no}: {reason}")
+        if self.unknown_genres:
+            genres = ", ".join(f"{g} ({n})" for g, n in self.unknown_genres.most_common())
+            lines.append(f"Нераспознанные жанры: {genres}")
+        lines.append(f"Общее время: {self.total_seconds:.1f} с")
+        return "\n".join(lines)
+
+
+class BulkLoader:
+    def __init__(self, data_manager: DataManager, chunk_size=50000, rating_scale=1.0, encoding="utf-8", progress=None,
+                 keep_timestamps=False, default_director=None):
+        if chunk_size < 1:
+            raise ValueError("Размер пачки должен быть положительным")
+        self._data_manager = data_manager
+        self._chunk_size = chunk_size
+        self._rating_scale = rating_scale  # например 2.0 для шкалы MovieLens 0.5-5 -> 1-10
+        self._encoding = encoding
+        # progress: None - молча, True - печатать в stderr, иначе функция (файл, строк, секунд)
+        self._progress = progress
+        # Режиссёр фильмов без колонки director; None - такие строки считаются ошибочными
+        self._default_director = default_director
+        self.report = LoadReport()
+        # (user_id, film_id) -> время оценки из колонки timestamp; DataManager время не хранит,
+        # поэтому оно собирается только по запросу (например, для разбиения по времени в evaluate.py)
+        self.timestamps = {} if keep_timestamps else None
+
+    def _report_progress(self, path, rows, started):
+        if not self._progress:
+            return
+        elapsed = time.perf_counter() - started
+        if callable(self._progress):
+            self._progress(path, rows, elapsed)
+        else:
+            rate = rows / elapsed if elapsed else 0.0
+            print(f"{os.path.basename(path)}: {rows:,} строк ({rate:,.0f} строк/с)", file=sys.stderr)
+
+    def _chunks(self, path, columns):
+        # Отдаёт пачки (номер строки, {поле: значение}) и сам разбирается с заголовком
+        rows = enumerate(read_rows(path, self._encoding), 1)
+        first = next(rows, None)
+        if first is None:
+            return
+        line_no, row = first
+        header = [cell.strip().lower() for cell in row]
+        if header and not header[0].lstrip("-").isdigit():
+            index = {}
+            for name, aliases in columns.items():
+                for alias in aliases:
+                    if alias in header:
+                        index[name] = header.index(alias)
+                        break
+            pending = []
+        else:
+            index = {name: i for i, name in enumerate(columns)}
+            pending = [first]
+        while True:
+            chunk = pending + list(islice(rows, self._chunk_size - len(pending)))
+            pending = []
+            if not chunk:
+                return
+            parsed = []
+            for line_no, row in chunk:
+                parsed.append((line_no, {name: row[i].strip() for name, i in index.items() if i < len(row)}))
+            yield parsed
+
+    def load_films(self, path: str):
+        films = self._data_manager._films
+        started, rows = time.perf_counter(), 0
+        for chunk in self._chunks(path, FILM_COLUMNS):
+            with self._data_manager.writing():  # читатели проходят между пачками
+                for line_no, row in chunk:
+                    try:
+                        film_id = int(row["id"])
+                        title = row["title"]
+                        year = int(row["year"]) if row.get("year") else None
+                        if year is None:
+                            match = TITLE_YEAR.search(title)
+                            year = int(match.group(1)) if match else None
+                            title = TITLE_YEAR.sub("", title) if match else title
+                        rating = float(row["rating"]) if row.get("rating") else 0.0
+                    except (KeyError, ValueError) as e:
+                        self.report.add_bad_row(path, line_no, f"не удалось разобрать фильм: {e!r}")
+                        continue
+                    genres, unknown = parse_genres(row.get("genres", ""))
+                    film = Film(film_id, title, genres, row.get("director") or self._default_director, year, rating)
+                    try:
+                        validate_film(film)
+                    except (TypeError, ValueError) as e:
+                        self.report.add_bad_row(path, line_no, f"фильм {film_id} не прошёл проверку Film: {e}")
+                        continue
+                    if film_id in films:
+                        self.report.duplicate_films += 1
+                        continue
+                    self.report.unknown_genres.update(unknown)
+                    self._data_manager.add_film(film)
+                    self.report.films_loaded += 1
+            rows += len(chunk)
+            self._report_progress(path, rows, started)
+
+    def load_users(self, path: str):
+        users = self._data_manager._users
+        started, rows = time.perf_counter(), 0
+        for chunk in self._chunks(path, USER_COLUMNS):
+            with self._data_manager.writing():  # читатели проходят между пачками
+                for line_no, row in chunk:
+                    try:
+                        user_id = int(row["id"])
+                    except (KeyError, ValueError) as e:
+                        self.report.add_bad_row(path, line_no, f"не удалось разобрать пользователя: {e!r}")
+                        continue
+                    if user_id in users:
+                        self.report.duplicate_users += 1
+                        continue
+                    self._data_manager.add_user(User(user_id, row.get("name") or f"user{user_id}"))
+                    self.report.users_loaded += 1
+            rows += len(chunk)
+            self._report_progress(path, rows, started)
+
+    def load_ratings(self, path: str):
+        films, users = self._data_manager._films, self._data_manager._users
+        started, rows = time.perf_counter(), 0
+        for chunk in self._chunks(path, RATING_COLUMNS):
+            with self._data_manager.writing():  # читатели проходят между пачками
+                for line_no, row in chunk:
+                    try:
+                        user_id = int(row["user_id"])
+                        film_id = int(row["film_id"])
+                        rating = float(row["rating"]) * self._rating_scale
+                        timestamp = int(row["timestamp"]) if self.timestamps is not None and row.get("timestamp") else None
+                    except (KeyError, ValueError) as e:
+                        self.report.add_bad_row(path, line_no, f"не удалось разобрать оценку: {e!r}")
+                        continue
+                    if not (0 <= rating <= 10):
+                        self.report.add_bad_row(path, line_no, f"оценка {rating} вне 0-10")
+                        continue
+                    if film_id not in films:
+                        self.report.add_bad_row(path, line_no, f"неизвестный фильм {film_id}")
+                        continue
+                    user = users.get(user_id)
+                    if user is None:
+                        user = User(user_id, f"user{user_id}")
+                        self._data_manager.add_user(user)
+                        self.report.users_loaded += 1
+                    film = films[film_id]
+                    if film in user.watched_films:
+                        self.report.ratings_overwritten += 1
+                    user.add_watched_film(film, rating)
+                    if timestamp is not None:
+                        self.timestamps[user_id, film_id] = timestamp
+                    self.report.ratings_loaded += 1
+            rows += len(chunk)
+            self._report_progress(path, rows, started)
+        self.report.ratings_seconds += time.perf_counter() - started
+
+    def load(self, films_path: str, ratings_path: Optional[str] = None, users_path: Optional[str] = None):
+        started = time.perf_counter()
+        self.load_films(films_path)
+        if users_path:
+            self.load_users(users_path)
+        if ratings_path:
+            self.load_ratings(ratings_path)
+        self.report.total_seconds += time.perf_counter() - started
+        return self.report
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Загрузка каталога и оценок в DataManager")
+    parser.add_argument("films")
+    parser.add_argument("ratings", nargs="?")
+    parser.add_argument("--users")
+    parser.add_argument("--chunk-size", type=int, default=50000)
+    parser.add_argument("--rating-scale", type=float, default=1.0)
+    parser.add_argument("--encoding", default="utf-8")
+    parser.add_argument("--default-director", help=f"режиссёр для каталога без колонки director "
+                                                   f"(для MovieLens - например '{UNKNOWN_DIRECTOR}')")
+    parser.add_argument("--snapshot", help="сохранить загруженные данные в снимок DataManager")
+    args = parser.parse_args(argv)
+    data_manager = DataManager()
+    loader = BulkLoader(data_manager, args.chunk_size, args.rating_scale, args.encoding, progress=True,
+                        default_director=args.default_director)
+    print(loader.load(args.films, args.ratings, args.users))
+    if args.snapshot:
+        data_manager.save_snapshot(args.snapshot)
+
+
+if __name__ == "__main__":
+    main()
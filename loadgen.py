@@ -0,0 +1,148 @@
+import argparse
+import asyncio
+import json
+import random
+import sys
+import time
+from collections import defaultdict
+
+from benchmark import percentile
+from stepik_pandas import Genres
+
+# Нагрузочный клиент для сервера рекомендаций (GUI(END PART) --serve).
+# Каждое соединение входит под своим пользователем и шлёт запросы по кругу до конца времени,
+# в конце печатаются запросы в секунду и хвосты задержек по операциям.
+# Пример: python loadgen.py --port 8765 --connections 64 --duration 10 --shared-users 8
+
+
+class Client:
+    def __init__(self, reader, writer):
+        self._reader = reader
+        self._writer = writer
+        self._next_id = 0
+
+    async def call(self, op, **params):
+        self._next_id += 1
+        self._writer.write(json.dumps({"id": self._next_id, "op": op, **params}, ensure_ascii=False).encode("utf-8") + b"\n")
+        await self._writer.drain()
+        line = await self._reader.readline()
+        if not line:
+            raise ConnectionError("Сервер закрыл соединение")
+        return json.loads(line)
+
+    def close(self):
+        self._writer.close()
+
+
+async def connect(args):
+    if args.unix:
+        reader, writer = await asyncio.open_unix_connection(args.unix)
+    else:
+        reader, writer = await asyncio.open_connection(args.host, args.port)
+    return Client(reader, writer)
+
+
+def parse_mix(text):
+    # "recommend=8,rate=1,films=1" -> ([операции], [веса])
+    ops, weights = [], []
+    for part in text.split(","):
+        op, _, weight = part.partition("=")
+        if op.strip() not in ("recommend", "rate", "films"):
+            raise ValueError(f"Неизвестная операция в --mix: {op!r}")
+        ops.append(op.strip())
+        weights.append(float(weight or 1))
+    return ops, weights
+
+
+async def run_connection(n, args, deadline, latencies, counters):
+    rnd = random.Random(args.seed + n)
+    client = await connect(args)
+    try:
+        user_name = f"{args.user_prefix}{n % args.shared_users if args.shared_users else n}"
+        response = await client.call("login", user_name=user_name)
+        if not response["ok"]:
+            genres = [genre.value for genre in rnd.sample(list(Genres), 2)]
+            response = await client.call("register", user_name=user_name, genres=genres)
+            if not response["ok"]:  # пользователя успело зарегистрировать соседнее соединение
+                response = await client.call("login", user_name=user_name)
+        listing = await client.call("films", limit=100, sort="id")
+        film_ids = [film["id"] for film in listing["result"]["films"]]
+        ops, weights = parse_mix(args.mix)
+        while time.perf_counter() < deadline:
+            op = rnd.choices(ops, weights)[0]
+            if op == "recommend":
+                params = {"strategy": rnd.choice(args.strategies)}
+                if rnd.random() < args.filtered:
+                    params.update(min_rating=7.0, min_year=1990, max_year=2020)
+                request = ("recommend", params)
+            elif op == "rate":
+                request = ("rate_film", {"film_id": rnd.choice(film_ids), "rating": rnd.randint(1, 10)})
+            else:
+                request = ("films", {"offset": rnd.randrange(max(1, listing["result"]["total"] - 20)), "limit": 20})
+            started = time.perf_counter()
+            response = await client.call(request[0], **request[1])
+            latencies[op].append((time.perf_counter() - started) * 1000)
+            counters["errors" if not response["ok"] else "ok"] += 1
+    finally:
+        client.close()
+
+
+def summarize(latencies, counters, seconds):
+    report = {"seconds": seconds, "requests": sum(len(v) for v in latencies.values()), "errors": counters["errors"]}
+    report["requests_per_second"] = report["requests"] / seconds if seconds else 0.0
+    everything = sorted(value for values in latencies.values() for value in values)
+    for name, values in [("all", everything)] + sorted(latencies.items()):
+        values = sorted(values)
+        report[name] = {
+            "requests": len(values),
+            "p50_ms": percentile(values, 50),
+            "p95_ms": percentile(values, 95),
+            "p99_ms": percentile(values, 99),
+            "max_ms": values[-1] if values else 0.0,
+        }
+    return report
+
+
+async def run(args):
+    latencies, counters = defaultdict(list), defaultdict(int)
+    started = time.perf_counter()
+    deadline = started + args.duration
+    await asyncio.gather(*(run_connection(n, args, deadline, latencies, counters) for n in range(args.connections)))
+    report = summarize(latencies, counters, time.perf_counter() - started)
+    client = await connect(args)
+    report["server"] = (await client.call("stats"))["result"]
+    client.close()
+    return report
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Нагрузочный клиент для сервера рекомендаций")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--unix", help="путь к Unix-сокету вместо TCP")
+    parser.add_argument("--connections", type=int, default=32)
+    parser.add_argument("--duration", type=float, default=10.0)
+    parser.add_argument("--mix", default="recommend=8,rate=1,films=1")
+    parser.add_argument("--strategies", nargs="+", default=["genre", "rating", "similar", "knn", "all"])
+    parser.add_argument("--filtered", type=float, default=0.3, help="доля запросов рекомендаций с фильтрами")
+    parser.add_argument("--shared-users", type=int, default=0,
+                        help="сколько пользователей делят соединения (0 - у каждого свой); так видно склейку запросов")
+    parser.add_argument("--user-prefix", default="load")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="куда записать отчёт в JSON")
+    args = parser.parse_args(argv)
+
+    report = asyncio.run(run(args))
+    all_ = report["all"]
+    print(f"{report['requests']} запросов за {report['seconds']:.1f} с: {report['requests_per_second']:.0f} зап/с, "
+          f"p50 {all_['p50_ms']:.2f} мс, p95 {all_['p95_ms']:.2f} мс, p99 {all_['p99_ms']:.2f} мс, "
+          f"ошибок {report['errors']}", file=sys.stderr)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+    else:
+        print(json.dumps(report, ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,8 +1,36 @@
 from typing import List, Dict, Optional
 from abc import ABC, abstractmethod
 from enum import Enum
-from collections import defaultdict
+from collections import defaultdict, OrderedDict, deque
+from collections.abc import Mapping, ValuesView
+from contextlib import nullcontext
+from functools import partial
+from operator import mul
+from array import array
+import sys
+import atexit
+import os
+import mmap
+import struct
+import heapq
+import math
+import bisect
+from itertools import islice
+import multiprocessing
+import multiprocessing.pool
+import threading
+import weakref
+import re
+import zlib
+import time
 import statistics
+import random
+import secrets
+import json
+import io
+import cProfile
+import pstats
+import tracemalloc
 from dataclasses import dataclass
 
 class Genres(Enum):
@@ -25,40 +53,74 @@ class Genres(Enum):
     WESTERN = "Western"
     DOCUMENTARY = "Documentary"
 
+GENRE_BITS = {genre: 1 << i for i, genre in enumerate(Genres)}  # жанр -> бит в маске
+
+def genres_to_mask(genres):
+    mask = 0
+    for genre in genres:
+        mask |= GENRE_BITS[genre]
+    return mask
+
+def mask_to_genres(mask):
+    return [genre for genre, bit in GENRE_BITS.items() if mask & bit]
+
 class Film:
+    # Пока фильм не добавлен в каталог, поля хранятся в самом объекте (_detached).
+    # После DataManager.add_film объект становится лёгким представлением строки FilmCatalog.
+    __slots__ = ("_id", "_detached", "_catalog", "_row", "_data_manager")
+
     def __init__(self, movie_id: int, title: str, genres: List[Genres], director: str, year: int, rating: float):
         self._id = movie_id
-        self._title = title
-        self._genres = genres
-        self._director = director
-        self._year = year
-        self._rating = rating
+        self._detached = [title, genres, director, year, rating]
+        self._catalog = None
+        self._row = -1
+        self._data_manager = None  # заполняется в DataManager.add_film
+
+    def _writing(self):
+        # Фильм из каталога меняется под блокировкой записи своего DataManager
+        return self._data_manager.writing() if self._data_manager is not None else nullcontext()
 
     def __str__(self):
-        return f"{self._title} ({self._year}) - рейтинг: {self._rating}"
+        return f"{self.title} ({self.year}) - рейтинг: {self.rating}"
     @property
     def movie_id(self):
         return self._id
 
     @property
     def title(self):
-        return self._title
+        if self._catalog is None:
+            return self._detached[0]
+        return self._catalog._titles[self._row]
 
     @property
     def genres(self):
-        return self._genres
+        if self._catalog is None:
+            return self._detached[1]
+        return mask_to_genres(self._catalog._genre_masks[self._row])
+
+    @property
+    def genre_mask(self):
+        if self._catalog is None:
+            return genres_to_mask(self._detached[1])
+        return self._catalog._genre_masks[self._row]
 
     @property
     def director(self):
-        return self._director
+        if self._catalog is None:
+            return self._detached[2]
+        return self._catalog._directors[self._row]
 
     @property
     def year(self):
-        return self._year
+        if self._catalog is None:
+            return self._detached[3]
+        return self._catalog._years[self._row]
 
     @property
     def rating(self):
-        return self._rating
+        if self._catalog is None:
+            return self._detached[4]
+        return self._catalog._ratings[self._row]
 
     @title.setter
     def title(self, value):
@@ -67,7 +129,14 @@ class Film:
         value = value.strip()
         if not isinstance(value, str):
             raise TypeError("Название должно быть строкой")
-        self._title = value
+        with self._writing():
+            old_title = self.title
+            if self._catalog is None:
+                self._detached[0] = value
+            else:
+                self._catalog._titles[self._row] = sys.intern(value)
+            if self._data_manager is not None:
+                self._data_manager._reindex_text(self, "title", old_title, value)
 
     @genres.setter
     def genres(self, value):
@@ -77,7 +146,14 @@ class Film:
             raise TypeError("Каждый элемент genres должен быть элементом перечисления Genres")
         if not value:
             raise ValueError("Поле не может быть пустым")
-        self._genres = value
+        with self._writing():
+            old_genres = self.genres
+            if self._catalog is None:
+                self._detached[1] = value
+            else:
+                self._catalog._genre_masks[self._row] = genres_to_mask(value)
+            if self._data_manager is not None:
+                self._data_manager._reindex_genres(self, old_genres)
 
     @director.setter
     def director(self, value):
@@ -85,7 +161,14 @@ class Film:
             raise ValueError("Поле не может быть пустым")
         if not isinstance(value, str):
             raise TypeError("Название должно быть строкой")
-        self._director = value
+        with self._writing():
+            old_director = self.director
+            if self._catalog is None:
+                self._detached[2] = value
+            else:
+                self._catalog._directors[self._row] = sys.intern(value)
+            if self._data_manager is not None:
+                self._data_manager._reindex_text(self, "director", old_director, value)
 
     @year.setter
     def year(self, value):
@@ -93,13 +176,27 @@ class Film:
             raise ValueError("Поле не может быть пустым")
         if not (1800 <= value <= 2100):
             raise ValueError("Год фильма должен быть в диапазоне 1800–2100")
-        self._year = value
+        with self._writing():
+            if self._catalog is None:
+                self._detached[3] = value
+            else:
+                self._catalog._years[self._row] = value
+            if self._data_manager is not None:
+                self._data_manager._catalog_version += 1
 
     @rating.setter
     def rating(self, value):
         if not (0 <= value <= 10):
             raise ValueError("Рейтинг должен быть от 0 до 10")
-        self._rating = float(value)
+        with self._writing():
+            old_rating = self.rating
+            if self._catalog is None:
+                self._detached[4] = float(value)
+            else:
+                self._catalog._ratings[self._row] = float(value)
+            if self._data_manager is not None:
+                self._data_manager._reindex_rating(self, old_rating)
+
 
 class User:
     def __init__(self, user_id, user_name, watched_films=None, preferred_genres=None):
@@ -113,6 +210,12 @@ class User:
             self._preferred_genres = preferred_genres
         else:
             self._preferred_genres = []
+        self._data_manager = None  # заполняется в DataManager.add_user
+        self._version = 0  # растёт при каждом изменении оценок или предпочтений
+        self._watched_rows = None  # RowSet строк каталога просмотренных фильмов; None - ещё не собран
+
+    def _writing(self):
+        return self._data_manager.writing() if self._data_manager is not None else nullcontext()
 
     @property
     def user_id(self):
@@ -137,17 +240,47 @@ class User:
         value = value.strip()
         if not value:
             raise ValueError("user_name не может быть пустым")
-        self._name = value
+        with self._writing():
+            if self._data_manager is not None:
+                self._data_manager._log_event("name", self._id, value)
+            old_name, self._name = self._name, value
+            if self._data_manager is not None:
+                self._data_manager._rename_user(self, old_name)
 
     @property
     def watched_films(self):
+        if self._watched_films is None:
+            # Пользователь из снимка: оценки подгружаются из RatingMatrix при первом обращении
+            with self._data_manager._lazy_lock:
+                if self._watched_films is None:
+                    self._watched_films = self._data_manager._load_watched_films(self)
         return self._watched_films
 
     @watched_films.setter
     def watched_films(self, value):
         if not isinstance(value, dict):
             raise TypeError("watched_films должен быть словарём")
-        self._watched_films = value
+        with self._writing():
+            if self._data_manager is not None:
+                self._data_manager._log_event("ratings", self._id, [[film._id, r] for film, r in value.items()])
+            self._watched_films = value
+            self._watched_rows = None
+            self._version += 1
+            if self._data_manager is not None:
+                self._data_manager._reindex_user_ratings(self)
+
+    @property
+    def watched_rows(self):
+        # Номера строк каталога просмотренных фильмов; фильмы, ещё не добавленные в каталог, не попадают
+        if self._watched_rows is None:
+            with self._data_manager._lazy_lock if self._data_manager is not None else nullcontext():
+                if self._watched_rows is None:
+                    self._watched_rows = RowSet(film._row for film in self.watched_films if film._row >= 0)
+        return self._watched_rows
+
+    @property
+    def version(self):
+        return self._version
 
     @property
     def preferred_genres(self):
@@ -157,33 +290,2087 @@ class User:
     def preferred_genres(self, value):
         if not isinstance(value, list):
             raise TypeError("preferred_genres должен быть списком")
-        self._preferred_genres = value
+        with self._writing():
+            if self._data_manager is not None:
+                self._data_manager._log_event("genres", self._id, [genre.value for genre in value])
+            self._preferred_genres = value
+            self._version += 1
 
     def add_watched_film(self, film: Film, rating: float):
-        self._watched_films[film] = rating
+        with self._writing():
+            if self._data_manager is not None:
+                self._data_manager._log_event("rate", self._id, film._id, rating)
+            self.watched_films[film] = rating
+            if self._watched_rows is not None and film._row >= 0:
+                self._watched_rows.add(film._row)
+            self._version += 1
+            if self._data_manager is not None:
+                self._data_manager._on_rating(self, film, rating)
 
     def get_rating(self, film: Film):
-        return self._watched_films.get(film, None)
+        return self.watched_films.get(film, None)
+
+
+
+
+class RatingMatrix:
+    # Разреженная матрица оценок пользователь x фильм с плотными номерами строк и столбцов.
+    # Хранится и по строкам (пользователи), и по столбцам (фильмы), поэтому обновление
+    # оценки стоит O(1), а сходство с остальными считается одним проходом по столбцам.
+    def __init__(self):
+        self._user_rows = {}  # user_id -> номер строки
+        self._row_users = []  # номер строки -> user_id
+        self._film_cols = {}  # film_id -> номер столбца
+        self._col_films = []  # номер столбца -> film_id
+        self._rows = []  # строка: {столбец: оценка}
+        self._cols = []  # столбец: {строка: оценка}
+
+    def __len__(self):
+        return len(self._row_users)
+
+    def _row(self, user_id):
+        row = self._user_rows.get(user_id)
+        if row is None:
+            row = len(self._row_users)
+            self._user_rows[user_id] = row
+            self._row_users.append(user_id)
+            self._rows.append({})
+        return row
+
+    def _col(self, film_id):
+        col = self._film_cols.get(film_id)
+        if col is None:
+            col = len(self._col_films)
+            self._film_cols[film_id] = col
+            self._col_films.append(film_id)
+            self._cols.append({})
+        return col
+
+    def set_rating(self, user_id, film_id, rating):
+        # Возвращает прежнюю оценку или None
+        row, col = self._row(user_id), self._col(film_id)
+        old = self._rows[row].get(col)
+        self._rows[row][col] = rating
+        self._cols[col][row] = rating
+        return old
+
+    def set_user_ratings(self, user_id, ratings: Dict[int, float]):
+        row = self._row(user_id)
+        for col in self._rows[row]:
+            del self._cols[col][row]
+        self._rows[row] = {}
+        for film_id, rating in ratings.items():
+            self.set_rating(user_id, film_id, rating)
+
+    def get_user_ratings(self, user_id):
+        row = self._user_rows.get(user_id)
+        if row is None:
+            return {}
+        return {self._col_films[col]: rating for col, rating in self._rows[row].items()}
+
+    def similarity(self, user_id, other_id):
+        # Сходство одной пары: 1 / (1 + средняя абсолютная разница оценок на общих фильмах)
+        row1 = self._rows[self._user_rows[user_id]]
+        row2 = self._rows[self._user_rows[other_id]]
+        if len(row1) > len(row2):
+            row1, row2 = row2, row1
+        diffs = [abs(rating - row2[col]) for col, rating in row1.items() if col in row2]
+        if not diffs:
+            return 0.0
+        return 1.0 / (1.0 + sum(diffs) / len(diffs))
+
+    def similarities(self, ratings: Dict[int, float], exclude_user_id=None, exact_compat=False):
+        # Сходство пользователя с оценками ratings со всеми, у кого есть общие фильмы.
+        # exact_compat повторяет старую формулу abs(r1 or 0 - r2) вместе с её приоритетом операторов.
+        diffs = defaultdict(list) if exact_compat else None
+        sums = defaultdict(float)
+        counts = defaultdict(int)
+        for film_id, r1 in ratings.items():
+            col = self._film_cols.get(film_id)
+            if col is None:
+                continue
+            for row, r2 in self._cols[col].items():
+                if exact_compat:
+                    diffs[row].append(abs(r1 or 0 - r2))
+                else:
+                    sums[row] += abs(r1 - r2)
+                    counts[row] += 1
+        exclude_row = self._user_rows.get(exclude_user_id)
+        result = []
+        for row in sorted(diffs if exact_compat else counts):
+            if row == exclude_row:
+                continue
+            mean_diff = statistics.mean(diffs[row]) if exact_compat else sums[row] / counts[row]
+            result.append((self._row_users[row], 1.0 / (1.0 + mean_diff)))
+        return result
+
+
+class CommunityRatings:
+    # Сводка оценок пользователей по фильмам: число, сумма и сумма квадратов, правятся за O(1)
+    # на каждую оценку или её замену. Поверх неё - оценённые фильмы по убыванию байесовского
+    # среднего (prior_weight воображаемых оценок, равных prior_mean), поэтому топ читается
+    # с начала и не зависит от числа пользователей и оценок. Запись порядок не трогает, а только
+    # помечает фильм; помеченные переставляются при чтении (sync). Порядок хранится блоками
+    # не длиннее 2 * BLOCK_SIZE, поэтому перестановка фильма правит один блок, а не весь каталог.
+    # Если prior_mean не задан, берётся общее среднее всех оценок на момент построения порядка;
+    # когда оно уходит дальше чем на mean_tolerance, порядок пересобирается.
+    BLOCK_SIZE = 512
+
+    def __init__(self, prior_weight=10.0, prior_mean=None, mean_tolerance=0.05):
+        self._stats = {}  # film_id -> [число, сумма, сумма квадратов]
+        self.count = 0
+        self.total = 0.0
+        self.prior_weight = prior_weight
+        self._fixed_mean = prior_mean
+        self._mean_tolerance = mean_tolerance
+        self._prior_mean = prior_mean if prior_mean is not None else 0.0  # с каким средним построен порядок
+        self._blocks = []  # отсортированные блоки (-байесовское среднее, film_id), по возрастанию
+        self._maxes = []  # последний элемент каждого блока
+        self._ranked = {}  # film_id -> его элемент в блоках
+        self._dirty = set()  # фильмы, чья сводка изменилась после последней sync
+
+    @classmethod
+    def from_matrix(cls, matrix: 'RatingMatrix', **kwargs):
+        community = cls(**kwargs)
+        cols = matrix._cols
+        for col, film_id in enumerate(matrix._col_films):
+            values = cols.values_at(col) if isinstance(cols, LazyRows) else cols[col].values()
+            if len(values):
+                total = sum(values)
+                community._stats[film_id] = [len(values), total, sum(v * v for v in values)]
+                community.count += len(values)
+                community.total += total
+        community._rebuild()
+        return community
+
+    def __contains__(self, film_id):
+        return film_id in self._stats
+
+    def __len__(self):
+        return len(self._stats)
+
+    @property
+    def mean(self):
+        return self.total / self.count if self.count else 0.0
+
+    def _score(self, stats):
+        return (self.prior_weight * self._prior_mean + stats[1]) / (self.prior_weight + stats[0])
+
+    def _rebuild(self):
+        if self._fixed_mean is None:
+            self._prior_mean = self.mean
+        self._sort()
+
+    def _sort(self):
+        ranking = sorted((-self._score(stats), film_id) for film_id, stats in self._stats.items())
+        size = self.BLOCK_SIZE
+        self._blocks = [ranking[i:i + size] for i in range(0, len(ranking), size)]
+        self._maxes = [block[-1] for block in self._blocks]
+        self._ranked = {entry[1]: entry for entry in ranking}
+        self._dirty.clear()
+
+    def _insert(self, entry):
+        blocks, maxes = self._blocks, self._maxes
+        if not blocks:
+            blocks.append([entry])
+            maxes.append(entry)
+            return
+        i = min(bisect.bisect_left(maxes, entry), len(blocks) - 1)
+        block = blocks[i]
+        bisect.insort(block, entry)
+        maxes[i] = block[-1]
+        if len(block) > 2 * self.BLOCK_SIZE:
+            blocks[i:i + 1] = block[:self.BLOCK_SIZE], block[self.BLOCK_SIZE:]
+            maxes[i:i + 1] = blocks[i][-1], blocks[i + 1][-1]
+
+    def _remove(self, entry):
+        i = bisect.bisect_left(self._maxes, entry)
+        block = self._blocks[i]
+        del block[bisect.bisect_left(block, entry)]
+        if block:
+            self._maxes[i] = block[-1]
+        else:
+            del self._blocks[i], self._maxes[i]
+
+    def update(self, film_id, old_rating, new_rating):
+        # old_rating None - новая оценка, new_rating None - оценку убрали
+        stats = self._stats.get(film_id)
+        if stats is None:
+            stats = self._stats[film_id] = [0, 0.0, 0.0]
+        if old_rating is not None:
+            stats[0] -= 1
+            stats[1] -= old_rating
+            stats[2] -= old_rating * old_rating
+            self.count -= 1
+            self.total -= old_rating
+        if new_rating is not None:
+            stats[0] += 1
+            stats[1] += new_rating
+            stats[2] += new_rating * new_rating
+            self.count += 1
+            self.total += new_rating
+        if not stats[0]:
+            del self._stats[film_id]
+        self._dirty.add(film_id)
+
+    def get(self, film_id):
+        # (число оценок, среднее, стандартное отклонение, байесовское среднее) или None
+        stats = self._stats.get(film_id)
+        if stats is None:
+            return None
+        count, total, squares = stats
+        mean = total / count
+        return count, mean, max(0.0, squares / count - mean * mean) ** 0.5, self._score(stats)
+
+    def needs_rebuild(self):
+        return self._fixed_mean is None and abs(self.mean - self._prior_mean) > self._mean_tolerance
+
+    def needs_sync(self):
+        return bool(self._dirty) or self.needs_rebuild()
+
+    def sync(self):
+        # Переставляет помеченные фильмы; если их много (пакетная загрузка), дешевле пересобрать всё
+        if self.needs_rebuild():
+            self._rebuild()
+            return
+        if len(self._dirty) > len(self._stats) // 16:
+            self._sort()
+            return
+        ranked, stats = self._ranked, self._stats
+        for film_id in self._dirty:
+            entry = ranked.pop(film_id, None)
+            if entry is not None:
+                self._remove(entry)
+            if film_id in stats:
+                entry = ranked[film_id] = (-self._score(stats[film_id]), film_id)
+                self._insert(entry)
+        self._dirty.clear()
+
+    def iter_ranking(self):
+        # (film_id, число оценок, байесовское среднее) по убыванию среднего; порядок - на момент sync
+        stats = self._stats
+        for block in self._blocks:
+            for score, film_id in block:
+                yield film_id, stats[film_id][0], -score
+
+
+def _neighbour_order(item):
+    # Ключ порядка в списках соседей (id, сходство): равные сходства - по меньшему id. Один и тот же
+    # для сборки, точечной правки и шардов, иначе поправленный список расходился бы со свежим
+    return item[1], -item[0]
+
+
+class NeighbourTable:
+    # Таблица K ближайших соседей каждого пользователя поверх RatingMatrix.
+    # Списки строятся при первом обращении (или все сразу через build) и затем
+    # правятся точечно: новая оценка фильма меняет сходство только с теми, кто его тоже оценил.
+    # Запись лишь отмечает такие пары, а сходства пересчитываются при следующем чтении списка,
+    # поэтому оценка популярного фильма не считает сходства под блокировкой записи.
+    def __init__(self, ratings: RatingMatrix, size=20):
+        self._ratings = ratings
+        self._size = size
+        self._table = {}  # user_id -> [(user_id, сходство)] по убыванию сходства
+        self._holders = defaultdict(set)  # user_id -> чьи списки его содержат
+        self._stale = defaultdict(set)  # user_id -> с кем сходство изменилось после сборки списка
+
+    @property
+    def size(self):
+        return self._size
+
+    def neighbours(self, user_id, similarities=None):
+        # similarities - уже посчитанные сходства пользователя, чтобы не считать их второй раз
+        stale = self._stale.pop(user_id, None)
+        if stale and user_id in self._table and similarities is None:
+            for other_id in sorted(stale):
+                self._patch(user_id, other_id, self._ratings.similarity(user_id, other_id))
+                if user_id not in self._table:
+                    break
+        elif stale:
+            self._drop(user_id)  # свежие сходства уже переданы: список проще собрать заново
+        if user_id not in self._table:
+            self._rebuild(user_id, similarities)
+        return self._table[user_id]
+
+    def build(self):
+        for user_id in self._ratings._row_users:
+            if user_id not in self._table:
+                self._rebuild(user_id)
+
+    def _rebuild(self, user_id, similarities=None):
+        if similarities is None:
+            ratings = self._ratings.get_user_ratings(user_id)
+            similarities = self._ratings.similarities(ratings, user_id)
+        self._set(user_id, heapq.nlargest(self._size, similarities, key=_neighbour_order))
+
+    def _set(self, user_id, neighbours):
+        self._drop(user_id)
+        self._table[user_id] = neighbours
+        for other_id, _ in neighbours:
+            self._holders[other_id].add(user_id)
+
+    def _drop(self, user_id):
+        for other_id, _ in self._table.pop(user_id, ()):
+            self._holders[other_id].discard(user_id)
+        self._stale.pop(user_id, None)
+
+    def _patch(self, owner_id, other_id, similarity):
+        neighbours = self._table[owner_id]
+        old = next((s for uid, s in neighbours if uid == other_id), None)
+        if old is not None and similarity < old and len(neighbours) == self._size:
+            # Сосед подешевел в полном списке: его место мог занять кто-то снаружи
+            self._drop(owner_id)
+            return
+        if old is None and len(neighbours) == self._size and \
+                _neighbour_order((other_id, similarity)) < _neighbour_order(neighbours[-1]):
+            return
+        neighbours = [(uid, s) for uid, s in neighbours if uid != other_id]
+        neighbours.append((other_id, similarity))
+        neighbours.sort(key=_neighbour_order, reverse=True)
+        self._set(owner_id, neighbours[:self._size])
+
+    def on_rating(self, user_id, film_id):
+        if not self._table:
+            return
+        col = self._ratings._film_cols[film_id]
+        table, stale = self._table, self._stale
+        own = stale[user_id] if user_id in table else None
+        for row in self._ratings._cols[col]:
+            other_id = self._ratings._row_users[row]
+            if other_id == user_id:
+                continue
+            if other_id in table:
+                stale[other_id].add(user_id)
+            if own is not None:
+                own.add(other_id)
+
+    def on_user_ratings_replaced(self, user_id, film_ids):
+        # Оценки заменены целиком: сбрасываем списки всех, кто пересекался с пользователем
+        if not self._table:
+            return
+        self._drop(user_id)
+        for film_id in film_ids:
+            col = self._ratings._film_cols.get(film_id)
+            if col is None:
+                continue
+            for row in self._ratings._cols[col]:
+                self._drop(self._ratings._row_users[row])
+        for holder_id in list(self._holders.get(user_id, ())):
+            self._drop(holder_id)
+
+
+class FilmNeighbourTable(NeighbourTable):
+    # Списки N самых похожих фильмов. Сходство пары - как у пользователей, 1 / (1 + средняя разница
+    # оценок) по тем, кто оценил оба фильма, со сжатием n / (n + shrinkage) для малого числа n таких
+    # пользователей. Сходство зависит только от общих оценок, поэтому новая оценка меняет его лишь
+    # с остальными фильмами того же пользователя, и списки правятся точно.
+    # Все списки сразу строит DataManager.build_film_neighbours в пуле процессов.
+    def __init__(self, ratings: RatingMatrix, size=30, shrinkage=10.0):
+        super().__init__(ratings, size)
+        self._shrinkage = shrinkage
+        self._dirty = None  # фильмы, чьи оценки менялись во время пакетной сборки
+
+    def _score(self, diff_sum, count):
+        return count / (count + self._shrinkage) / (1.0 + diff_sum / count)
+
+    def build(self):
+        for film_id in self._ratings._col_films:
+            if film_id not in self._table:
+                self._rebuild(film_id)
+
+    def _rebuild(self, film_id, similarities=None):
+        if similarities is None:
+            similarities = self.similarities(film_id)
+        self._set(film_id, heapq.nlargest(self._size, similarities, key=_neighbour_order))
+
+    def similarities(self, film_id):
+        # [(film_id, сходство)] со всеми фильмами, у которых есть общие оценившие
+        ratings = self._ratings
+        col = ratings._film_cols.get(film_id)
+        if col is None:
+            return []
+        sums = defaultdict(float)
+        counts = defaultdict(int)
+        rows = ratings._rows
+        for row, r1 in ratings._cols[col].items():
+            for other, r2 in rows[row].items():
+                sums[other] += abs(r1 - r2)
+                counts[other] += 1
+        counts.pop(col, None)
+        col_films = ratings._col_films
+        return [(col_films[other], self._score(sums[other], count)) for other, count in counts.items()]
+
+    def similarity(self, film_id, other_id):
+        cols = self._ratings._cols
+        col1, col2 = cols[self._ratings._film_cols[film_id]], cols[self._ratings._film_cols[other_id]]
+        if len(col1) > len(col2):
+            col1, col2 = col2, col1
+        diffs = [abs(rating - col2[row]) for row, rating in col1.items() if row in col2]
+        return self._score(sum(diffs), len(diffs)) if diffs else 0.0
+
+    def on_rating(self, user_id, film_id):
+        ratings = self._ratings
+        user_cols = ratings._rows[ratings._user_rows[user_id]]
+        if self._dirty is not None:
+            self._dirty.update(ratings._col_films[col] for col in user_cols)
+        if not self._table:
+            return
+        for col in user_cols:
+            other_id = ratings._col_films[col]
+            if other_id == film_id:
+                continue
+            similarity = self.similarity(film_id, other_id)
+            if other_id in self._table:
+                self._patch(other_id, film_id, similarity)
+            if film_id in self._table:
+                self._patch(film_id, other_id, similarity)
+
+    def on_user_ratings_replaced(self, user_id, film_ids):
+        # Меняются только сходства пар фильмов из film_ids, их списки строятся заново при обращении
+        if self._dirty is not None:
+            self._dirty.update(film_ids)
+        for film_id in film_ids:
+            self._drop(film_id)
+
+
+# Контекст пула в процессе-воркере. Передаётся инициализатору пула (при fork - без pickle, копией
+# страниц памяти), а не глобальной переменной вызывающего процесса: одновременные запуски не мешают друг другу.
+_worker_context = None
+
+def _init_worker(context):
+    global _worker_context
+    _worker_context = context
+
+def _call_with_context(fn, items):
+    return fn(_worker_context, items)
+
+def _run_forked(fn, context, chunks, processes=None, data_manager=None):
+    # Раздаёт пачки пулу процессов и отдаёт fn(context, пачка) в порядке готовности.
+    # Воркеры создаются через fork под блокировкой чтения data_manager, поэтому получают
+    # согласованную копию данных; блокировки остальных потоков сбрасываются в дочернем процессе
+    # (_register_fork_reset). processes=1 или платформа без fork - всё считается в этом процессе.
+    if processes == 1 or "fork" not in multiprocessing.get_all_start_methods():
+        for chunk in chunks:
+            yield fn(context, chunk)
+        return
+    pool = None
+    try:
+        with data_manager.reading() if data_manager is not None else nullcontext():
+            pool = multiprocessing.get_context("fork").Pool(processes, _init_worker, (context,))
+        yield from pool.imap_unordered(partial(_call_with_context, fn), chunks)
+    finally:
+        if pool is not None:
+            pool.terminate()
+
+
+def _film_neighbours_chunk(context, film_ids):
+    # context - (data_manager, таблица FilmNeighbourTable)
+    data_manager, table = context
+    with data_manager.reading():
+        return [(film_id, heapq.nlargest(table.size, table.similarities(film_id), key=_neighbour_order))
+                for film_id in film_ids]
+
+def _solve_spd(matrix, vector):
+    # Решение системы с симметричной положительно определённой матрицей через разложение Холецкого
+    n = len(vector)
+    lower = [[0.0] * n for _ in range(n)]
+    for i in range(n):
+        row = lower[i]
+        for j in range(i + 1):
+            s = matrix[i][j] - sum(map(mul, row[:j], lower[j][:j]))
+            row[j] = math.sqrt(s) if i == j else s / lower[j][j]
+    y = [0.0] * n
+    for i in range(n):
+        y[i] = (vector[i] - sum(map(mul, lower[i][:i], y[:i]))) / lower[i][i]
+    x = [0.0] * n
+    for i in reversed(range(n)):
+        x[i] = (y[i] - sum(lower[j][i] * x[j] for j in range(i + 1, n))) / lower[i][i]
+    return x
+
+def _als_solve(line, fixed, mean, regularization):
+    # Гребневая регрессия для одной строки (или столбца) матрицы оценок при зафиксированной другой стороне:
+    # признаки - (факторы, 1), цель - оценка минус среднее и смещение другой стороны.
+    # Возвращает (факторы..., смещение) или None, если оценок с известными векторами нет.
+    vectors, ratings = [], []
+    for j, rating in line.items():
+        vector = fixed[j] if j < len(fixed) else None
+        if vector is not None:
+            vectors.append(vector)
+            ratings.append(rating)
+    if not vectors:
+        return None
+    # Суммы по столбцам признаков считаются через sum(map(mul, ...)), без цикла по оценкам в Python
+    columns = list(zip(*vectors))
+    targets = [rating - mean - bias for rating, bias in zip(ratings, columns[-1])]
+    columns[-1] = (1.0,) * len(vectors)
+    dims = len(columns)
+    matrix = [[0.0] * dims for _ in range(dims)]
+    for a in range(dims):
+        for b in range(a, dims):
+            matrix[a][b] = matrix[b][a] = sum(map(mul, columns[a], columns[b]))
+        matrix[a][a] += regularization * len(vectors)
+    return tuple(_solve_spd(matrix, [sum(map(mul, column, targets)) for column in columns]))
+
+def _als_solve_chunk(context, indices):
+    # context - (data_manager, строки, зафиксированные векторы, среднее, регуляризация)
+    data_manager, lines, fixed, mean, regularization = context
+    with data_manager.reading():  # в процессе-воркере блокировка своя, в основном - писатели проходят между пачками
+        return [(i, _als_solve(lines[i], fixed, mean, regularization)) for i in indices]
+
+
+class FactorModel:
+    # Матричная факторизация оценок методом чередующихся наименьших квадратов (ALS):
+    # оценка ~ среднее + смещение пользователя + смещение фильма + <факторы пользователя, факторы фильма>.
+    # Векторы хранятся по номерам строк и столбцов RatingMatrix. На каждом шаге строки решаются
+    # независимо друг от друга, поэтому раздаются пулу процессов. Повторное обучение продолжает
+    # с уже найденных векторов, новые пользователи и фильмы начинают со случайных.
+    # Вектор пользователя для запроса пересчитывается по его текущим оценкам (при смене версии),
+    # поэтому новые оценки пользователя учитываются сразу, а новые фильмы - после дообучения.
+    def __init__(self, factors=16, regularization=0.1, seed=0):
+        if factors < 1:
+            raise ValueError("Число факторов должно быть положительным")
+        if regularization <= 0:
+            raise ValueError("Регуляризация должна быть положительной")
+        self.factors = factors
+        self.regularization = regularization
+        self.mean = 0.0
+        self.iterations = 0  # сколько итераций пройдено всего, с учётом дообучений
+        self._random = random.Random(seed)
+        self._user_vectors = []  # номер строки -> (факторы..., смещение) или None
+        self._film_vectors = []  # номер столбца -> (факторы..., смещение) или None
+        self._ranking = ([], [], [])  # (нормы, столбцы, векторы) фильмов по убыванию нормы вектора
+        self._folded = {}  # user_id -> (версия пользователя, вектор по его текущим оценкам)
+
+    def _extend(self, vectors, count):
+        while len(vectors) < count:
+            vectors.append(tuple(self._random.gauss(0.0, 0.1) for _ in range(self.factors)) + (0.0,))
+
+    def train(self, data_manager, iterations=10, processes=None, chunk_size=1024, stop=None):
+        # stop - threading.Event; если он выставлен, обучение прерывается и возвращается None
+        ratings = data_manager._ratings
+        with data_manager.reading():
+            mean = data_manager._get_community().mean
+            rows, cols = len(ratings._rows), len(ratings._cols)
+        users, films = list(self._user_vectors), list(self._film_vectors)
+        self._extend(users, rows)
+        self._extend(films, cols)
+        for _ in range(iterations):
+            users = self._half_step(data_manager, ratings._rows, rows, films, mean, processes, chunk_size, stop)
+            if users is None:
+                return None
+            films = self._half_step(data_manager, ratings._cols, cols, users, mean, processes, chunk_size, stop)
+            if films is None:
+                return None
+            self.iterations += 1
+        entries = sorted(((math.sqrt(sum(map(mul, vector, vector))), col)
+                          for col, vector in enumerate(films) if vector is not None), reverse=True)
+        self.mean, self._user_vectors, self._film_vectors = mean, users, films
+        self._ranking = ([norm for norm, _ in entries], [col for _, col in entries], [films[col] for _, col in entries])
+        self._folded = {}
+        return self
+
+    def _half_step(self, data_manager, lines, count, fixed, mean, processes, chunk_size, stop=None):
+        chunks = [range(start, min(start + chunk_size, count)) for start in range(0, count, chunk_size)]
+        solved = [None] * count
+        context = (data_manager, lines, fixed, mean, self.regularization)
+        results = _run_forked(_als_solve_chunk, context, chunks, processes, data_manager)
+        try:
+            for chunk in results:
+                if stop is not None and stop.is_set():
+                    return None
+                for i, vector in chunk:
+                    solved[i] = vector
+        finally:
+            results.close()  # пул закрывается сразу, а не при сборке мусора
+        return solved
+
+    def user_vector(self, data_manager, user):
+        folded = self._folded.get(user._id)
+        if folded is not None and folded[0] == user.version:
+            return folded[1]
+        film_cols = data_manager._ratings._film_cols
+        line = {film_cols[film._id]: rating for film, rating in user.watched_films.items() if film._id in film_cols}
+        vector = _als_solve(line, self._film_vectors, self.mean, self.regularization)
+        self._folded[user._id] = (user.version, vector)
+        return vector
+
+    def top(self, vector, count, exclude=(), accept=None):
+        # Лучшие столбцы по <(факторы пользователя, 1), (факторы фильма, смещение)>: [(столбец, оценка)]
+        # и число просмотренных фильмов. Фильмы идут по убыванию нормы вектора, и перебор
+        # останавливается, как только верхняя граница |запрос| * |фильм| не выше худшего из найденных.
+        # Без вектора пользователя (нет оценок) фильмы ранжируются по одному смещению.
+        query = (vector[:-1] if vector is not None else (0.0,) * self.factors) + (1.0,)
+        query_norm = math.sqrt(sum(map(mul, query, query)))
+        norms, cols, vectors = self._ranking
+        best = []
+        scanned = 0
+        for scanned, (norm, col, film_vector) in enumerate(zip(norms, cols, vectors), 1):
+            if len(best) == count and query_norm * norm <= best[0][0]:
+                break
+            if col in exclude:
+                continue
+            score = sum(map(mul, query, film_vector))
+            if len(best) < count:
+                if accept is None or accept(col):
+                    heapq.heappush(best, (score, col))
+            elif score > best[0][0] and (accept is None or accept(col)):
+                heapq.heapreplace(best, (score, col))
+        return [(col, self.mean + score) for score, col in sorted(best, reverse=True)], scanned
+
+    def predict(self, data_manager, user, film):
+        # Ожидаемая оценка пользователя фильму или None, если фильм не участвовал в обучении
+        col = data_manager._ratings._film_cols.get(film._id)
+        film_vector = self._film_vectors[col] if col is not None and col < len(self._film_vectors) else None
+        if film_vector is None:
+            return None
+        vector = self.user_vector(data_manager, user)
+        if vector is None:
+            return self.mean + film_vector[-1]
+        return self.mean + vector[-1] + film_vector[-1] + sum(map(mul, vector[:-1], film_vector[:-1]))
+
+
+class _FilmValues(ValuesView):
+    def __iter__(self):
+        catalog = self._mapping
+        if catalog._sorted_ids is None:
+            return iter(catalog._films)
+        return (catalog._film_at(row) for row in range(len(catalog._films)))
+
+class StringColumn:
+    # Колонка строк из снимка: смещения + байты UTF-8, строка декодируется при обращении.
+    # Изменённые и добавленные после открытия строки хранятся поверх.
+    def __init__(self, offsets, data):
+        self._offsets = offsets
+        self._data = data
+        self._size = len(offsets) - 1
+        self._changed = {}
+        self._extra = []
+
+    def __len__(self):
+        return self._size + len(self._extra)
+
+    def __getitem__(self, i):
+        if i >= self._size:
+            return self._extra[i - self._size]
+        value = self._changed.get(i)
+        if value is None:
+            value = str(self._data[self._offsets[i]:self._offsets[i + 1]], "utf-8")
+        return value
+
+    def __setitem__(self, i, value):
+        if i >= self._size:
+            self._extra[i - self._size] = value
+        else:
+            self._changed[i] = value
+
+    def __iter__(self):
+        return (self[i] for i in range(len(self)))
 
+    def append(self, value):
+        self._extra.append(value)
+
+class FilmCatalog(Mapping):
+    # Колоночное хранилище каталога: по типизированному массиву на числовое поле,
+    # интернированные строки и 18-битная маска жанров на фильм.
+    # Снаружи ведёт себя как словарь film_id -> Film.
+    # После DataManager.open_snapshot колонки - это memoryview над mmap, а объекты Film
+    # создаются только для тех строк, к которым обратились.
+    def __init__(self):
+        self._rows = {}  # film_id -> номер строки (кроме фильмов из снимка)
+        self._films = []  # номер строки -> Film или None, если ещё не создан
+        self._ids = array("q")
+        self._years = array("i")
+        self._ratings = array("d")
+        self._genre_masks = array("i")
+        self._titles = []
+        self._directors = []
+        self._sorted_ids = None  # id фильмов снимка по возрастанию
+        self._sorted_rows = None  # номера строк для _sorted_ids
+        self._data_manager = None
+
+    def _find_row(self, film_id):
+        row = self._rows.get(film_id)
+        if row is None and self._sorted_ids is not None:
+            i = bisect.bisect_left(self._sorted_ids, film_id)
+            if i < len(self._sorted_ids) and self._sorted_ids[i] == film_id:
+                row = self._sorted_rows[i]
+        return row
+
+    def _film_at(self, row):
+        film = self._films[row]
+        if film is None:
+            # Фильмы сравниваются по объекту, поэтому два читателя не должны создать по своему
+            with self._data_manager._lazy_lock:
+                film = self._films[row]
+                if film is None:
+                    film = Film.__new__(Film)
+                    film._id = self._ids[row]
+                    film._detached = None
+                    film._catalog = self
+                    film._row = row
+                    film._data_manager = self._data_manager
+                    self._films[row] = film
+        return film
+
+    def __getitem__(self, film_id):
+        row = self._find_row(film_id)
+        if row is None:
+            raise KeyError(film_id)
+        return self._film_at(row)
+
+    def __contains__(self, film_id):
+        return self._find_row(film_id) is not None
+
+    def __iter__(self):
+        return iter(self._ids)
+
+    def __len__(self):
+        return len(self._films)
+
+    def values(self):
+        return _FilmValues(self)
+
+    def _thaw(self):
+        # Колонки из снимка копируются в обычные массивы перед первым добавлением фильма
+        for name in ("_ids", "_years", "_ratings", "_genre_masks"):
+            column = getattr(self, name)
+            if not isinstance(column, array):
+                thawed = array(column.format)
+                thawed.frombytes(column.cast("B"))
+                setattr(self, name, thawed)
+
+    def add(self, film: Film):
+        # Переносит поля фильма в колонки; сам объект остаётся тем же, меняется только хранилище
+        title, genres, director, year, rating = film._detached
+        self._thaw()
+        row = len(self._films)
+        self._ids.append(film._id)
+        self._years.append(year)
+        self._ratings.append(float(rating))
+        self._genre_masks.append(genres_to_mask(genres))
+        self._titles.append(sys.intern(title))
+        self._directors.append(sys.intern(director))
+        self._rows[film._id] = row
+        self._films.append(film)
+        film._catalog = self
+        film._row = row
+        film._detached = None
+        return row
+
+    def row_of(self, film_id):
+        row = self._find_row(film_id)
+        if row is None:
+            raise KeyError(film_id)
+        return row
+
+
+class GenreRows:
+    # Жанр -> множество номеров строк каталога с этим жанром. Запрос по жанрам перебирает только
+    # строки своих жанров, поэтому его цена зависит от числа кандидатов, а не от размера каталога.
+    def __init__(self):
+        self._rows = {genre: set() for genre in Genres}
+
+    @classmethod
+    def from_masks(cls, genre_masks):
+        table = cls()
+        by_bit = {GENRE_BITS[genre]: table._rows[genre] for genre in Genres}
+        for row, mask in enumerate(genre_masks):
+            while mask:
+                bit = mask & -mask
+                by_bit[bit].add(row)
+                mask ^= bit
+        return table
+
+    def set(self, genre, row, present):
+        if present:
+            self._rows[genre].add(row)
+        else:
+            self._rows[genre].discard(row)
+
+    def rows(self, genre):
+        return self._rows[genre]
+
+class RowSet:
+    # Сжатое множество номеров строк каталога в духе roaring: строки делятся на блоки по 2**16,
+    # редкий блок - множество младших 16 бит, плотный - битовая маска int на 8 КБ.
+    # Пересечение считается по общим блокам: множества - через &, маски - через AND и bit_count.
+    SPARSE_LIMIT = 4096  # больше строк в блоке - маска компактнее множества
+
+    def __init__(self, rows=()):
+        self._chunks = {}  # номер блока -> set младших бит или int-маска
+        self._len = 0
+        for row in rows:
+            self.add(row)
+
+    def __len__(self):
+        return self._len
+
+    def __contains__(self, row):
+        chunk = self._chunks.get(row >> 16)
+        if chunk is None:
+            return False
+        if isinstance(chunk, set):
+            return row & 0xFFFF in chunk
+        return chunk >> (row & 0xFFFF) & 1 == 1
+
+    def add(self, row):
+        high, low = row >> 16, row & 0xFFFF
+        chunk = self._chunks.get(high)
+        if chunk is None:
+            self._chunks[high] = {low}
+        elif isinstance(chunk, set):
+            if low in chunk:
+                return
+            chunk.add(low)
+            if len(chunk) > self.SPARSE_LIMIT:
+                self._chunks[high] = self._chunk_mask(chunk)
+        else:
+            if chunk >> low & 1:
+                return
+            self._chunks[high] = chunk | 1 << low
+        self._len += 1
+
+    @staticmethod
+    def _chunk_mask(chunk):
+        if not isinstance(chunk, set):
+            return chunk
+        bits = bytearray(8192)
+        for low in chunk:
+            bits[low >> 3] |= 1 << (low & 7)
+        return int.from_bytes(bits, "little")
+
+    def overlap(self, other):
+        # Сколько строк есть в обоих множествах
+        if len(self._chunks) > len(other._chunks):
+            self, other = other, self
+        count = 0
+        for high, chunk in self._chunks.items():
+            other_chunk = other._chunks.get(high)
+            if other_chunk is None:
+                continue
+            if isinstance(chunk, set) and isinstance(other_chunk, set):
+                count += len(chunk & other_chunk)
+            else:
+                count += (self._chunk_mask(chunk) & self._chunk_mask(other_chunk)).bit_count()
+        return count
+
+def _trigrams(text, prefix=False):
+    # Триграммы слов текста с отступами по краям: "нолан" -> "  н", " но", "нол", "ола", "лан", "ан ".
+    # prefix - без конечного отступа у последнего слова, чтобы недописанное слово находило продолжения
+    words = re.findall(r"\w+", text.casefold())
+    grams = set()
+    for i, word in enumerate(words):
+        padded = "  " + word + ("" if prefix and i == len(words) - 1 else " ")
+        grams.update(padded[j:j + 3] for j in range(len(padded) - 2))
+    return grams
+
+class TrigramIndex:
+    # Триграмма -> номера строк FilmCatalog, в тексте поля которых она есть
+    def __init__(self):
+        self._postings = defaultdict(set)
+        self._sizes = {}  # номер строки -> число триграмм текста
+
+    def __len__(self):
+        return len(self._sizes)
+
+    def add(self, row, text):
+        grams = _trigrams(text)
+        for gram in grams:
+            self._postings[gram].add(row)
+        self._sizes[row] = len(grams)
+
+    def remove(self, row, text):
+        for gram in _trigrams(text):
+            rows = self._postings.get(gram)
+            if rows is not None:
+                rows.discard(row)
+                if not rows:
+                    del self._postings[gram]
+        self._sizes.pop(row, None)
+
+    def match(self, grams, threshold):
+        # {строка: (доля триграмм запроса в тексте, сходство Жаккара)} для строк, где доля не ниже threshold.
+        # Кандидаты берутся только из самых редких триграмм запроса: строка, которой нет ни в одной
+        # из них, не наберёт нужную долю, поэтому частые триграммы ("the") только проверяются.
+        if not grams:
+            return {}
+        need = max(1, math.ceil(threshold * len(grams)))
+        postings = sorted((self._postings.get(gram, ()) for gram in grams), key=len)
+        candidates = set()
+        for rows in postings[:len(grams) - need + 1]:
+            candidates.update(rows)
+        result = {}
+        for row in candidates:
+            shared = sum(1 for rows in postings if row in rows)
+            if shared >= need:
+                result[row] = (shared / len(grams), shared / (len(grams) + self._sizes[row] - shared))
+        return result
+
+class FilmSearchIndex:
+    # Нечёткий поиск фильмов по названию и режиссёру поверх триграммных индексов полей.
+    # Совпадение по режиссёру весит чуть меньше, чем по названию.
+    FIELDS = {"title": 1.0, "director": 0.9}
+
+    def __init__(self):
+        self._fields = {name: TrigramIndex() for name in self.FIELDS}
+
+    @classmethod
+    def from_catalog(cls, catalog: 'FilmCatalog'):
+        index = cls()
+        titles, directors = index._fields["title"], index._fields["director"]
+        for row in range(len(catalog)):
+            titles.add(row, catalog._titles[row])
+            directors.add(row, catalog._directors[row])
+        return index
+
+    def add(self, row, title, director):
+        self._fields["title"].add(row, title)
+        self._fields["director"].add(row, director)
+
+    def update(self, row, field, old_text, new_text):
+        self._fields[field].remove(row, old_text)
+        self._fields[field].add(row, new_text)
+
+    def search(self, query, fields=("title", "director"), threshold=0.5):
+        # {строка: (оценка, сходство Жаккара)}; по каждой строке - лучшее из полей
+        grams = _trigrams(query, prefix=True)
+        found = {}
+        for field in fields:
+            weight = self.FIELDS[field]
+            for row, (share, jaccard) in self._fields[field].match(grams, threshold).items():
+                score = (weight * share, jaccard)
+                if score > found.get(row, (0.0, 0.0)):
+                    found[row] = score
+        return found
+
+class LazyRows:
+    # Строки (или столбцы) RatingMatrix из снимка в формате CSR/CSC:
+    # словарь {индекс: оценка} собирается из memoryview при первом обращении
+    def __init__(self, offsets, indices, values):
+        self._offsets = offsets
+        self._indices = indices
+        self._values = values
+        self._loaded = [None] * (len(offsets) - 1)
+
+    def __len__(self):
+        return len(self._loaded)
+
+    def __getitem__(self, i):
+        row = self._loaded[i]
+        if row is None:
+            start, end = self._offsets[i], self._offsets[i + 1]
+            row = self._loaded[i] = dict(zip(self._indices[start:end], self._values[start:end]))
+        return row
+
+    def __setitem__(self, i, row):
+        self._loaded[i] = row
+
+    def __iter__(self):
+        return (self[i] for i in range(len(self)))
+
+    def append(self, row):
+        self._loaded.append(row)
+
+    def values_at(self, i):
+        # Оценки строки без сборки словаря
+        row = self._loaded[i]
+        if row is not None:
+            return row.values()
+        return self._values[self._offsets[i]:self._offsets[i + 1]]
+
+class SnapshotUsers(Mapping):
+    # Пользователи из снимка: объект User создаётся при первом обращении,
+    # его watched_films - при первом чтении оценок. Порядок совпадает со строками RatingMatrix.
+    def __init__(self, data_manager, names: StringColumn, genre_offsets, genre_items):
+        self._data_manager = data_manager
+        self._count = len(names)
+        self._names = names
+        self._genre_offsets = genre_offsets
+        self._genre_items = genre_items
+        self._loaded = {}
+
+    def _row(self, user_id):
+        row = self._data_manager._ratings._user_rows.get(user_id)
+        return row if row is not None and row < self._count else None
+
+    def __getitem__(self, user_id):
+        user = self._loaded.get(user_id)
+        if user is None:
+            row = self._row(user_id)
+            if row is None:
+                raise KeyError(user_id)
+            with self._data_manager._lazy_lock:
+                user = self._loaded.get(user_id)
+                if user is None:
+                    genres = list(Genres)
+                    start, end = self._genre_offsets[row], self._genre_offsets[row + 1]
+                    user = User(user_id, self._names[row], preferred_genres=[genres[i] for i in self._genre_items[start:end]])
+                    user._watched_films = None
+                    user._data_manager = self._data_manager
+                    self._loaded[user_id] = user
+        return user
+
+    def __setitem__(self, user_id, user):
+        self._loaded[user_id] = user
+
+    def __contains__(self, user_id):
+        return user_id in self._loaded or self._row(user_id) is not None
+
+    def __iter__(self):
+        return iter(self._data_manager._ratings._row_users)
+
+    def __len__(self):
+        return len(self._data_manager._ratings._row_users)
+
+class UserDirectory:
+    # Справочник пользователей для входа и регистрации: нормализованное имя (без учёта регистра
+    # и лишних пробелов) -> user_id за O(1), выдача новых id без перебора пользователей и
+    # отсортированный список имён для автодополнения. Новые имена копятся в буфере и вливаются
+    # в список при следующем поиске по префиксу, как записи индекса рейтинга.
+    def __init__(self):
+        self._ids = {}  # нормализованное имя -> user_id
+        self._sorted = []  # (нормализованное имя, user_id) по возрастанию
+        self._pending = []  # добавленные, но ещё не влитые в _sorted
+        self._next_id = 1
+
+    @staticmethod
+    def normalize(name):
+        return " ".join(name.split()).casefold()
+
+    def __len__(self):
+        return len(self._ids)
+
+    def get(self, name):
+        return self._ids.get(self.normalize(name))
+
+    def add(self, name, user_id):
+        # Имя, уже занятое другим пользователем, остаётся за первым
+        if user_id >= self._next_id:
+            self._next_id = user_id + 1
+        key = self.normalize(name)
+        if key not in self._ids:
+            self._ids[key] = user_id
+            self._pending.append((key, user_id))
+
+    def remove(self, name, user_id):
+        key = self.normalize(name)
+        if self._ids.get(key) != user_id:
+            return
+        del self._ids[key]
+        entry = (key, user_id)
+        i = bisect.bisect_left(self._sorted, entry)
+        if i < len(self._sorted) and self._sorted[i] == entry:
+            del self._sorted[i]
+        else:
+            self._pending.remove(entry)
+
+    def allocate_id(self):
+        # id растут монотонно и не выдаются повторно
+        user_id = self._next_id
+        self._next_id += 1
+        return user_id
+
+    def complete(self, prefix, limit=10):
+        # user_id пользователей, чьи имена начинаются с prefix, по алфавиту
+        if self._pending:
+            if len(self._pending) < 64:
+                for entry in self._pending:
+                    bisect.insort(self._sorted, entry)
+            else:
+                self._sorted.extend(self._pending)
+                self._sorted.sort()
+            self._pending.clear()
+        prefix = self.normalize(prefix)
+        names = self._sorted
+        i = bisect.bisect_left(names, (prefix,))
+        result = []
+        while i < len(names) and len(result) < limit and names[i][0].startswith(prefix):
+            result.append(names[i][1])
+            i += 1
+        return result
+
+
+# Формат снимка: заголовок, таблица секций (имя, смещение, длина), затем секции,
+# выровненные по 8 байт. Числа пишутся в порядке байт машины, он записан в заголовке.
+SNAPSHOT_MAGIC = b"SOFSNAP\0"
+SNAPSHOT_VERSION = 1
+SNAPSHOT_BYTEORDER = 1 if sys.byteorder == "little" else 2
+SNAPSHOT_HEADER = struct.Struct("=8sIII")
+SNAPSHOT_SECTION = struct.Struct("=32sQQ")
+
+def _string_column(values):
+    offsets, data = array("q", [0]), bytearray()
+    for value in values:
+        data += value.encode("utf-8")
+        offsets.append(len(data))
+    return offsets, data
+
+def _csr(rows):
+    offsets, indices, values = array("q", [0]), array("q"), array("d")
+    for row in rows:
+        indices.extend(row.keys())
+        values.extend(row.values())
+        offsets.append(len(indices))
+    return offsets, indices, values
+
+# Журнал изменений: сегменты wal-<номер>.log, в начале каждого WAL_MAGIC, дальше записи
+# (длина, crc32) + событие в JSON. Новый сегмент начинается при каждом открытии журнала.
+WAL_MAGIC = b"SOFWAL1\n"
+WAL_RECORD = struct.Struct("=II")
+WAL_SEGMENT = re.compile(r"^wal-(\d{8})\.log$")
+
+def _wal_segments(directory):
+    if not os.path.isdir(directory):
+        return []
+    return sorted(int(m.group(1)) for m in map(WAL_SEGMENT.match, os.listdir(directory)) if m)
+
+def _wal_path(directory, segment):
+    return os.path.join(directory, f"wal-{segment:08d}.log")
+
+def read_event_log(directory, position=(0, 0)):
+    # События журнала после позиции (сегмент, смещение). Оборванная последняя запись последнего
+    # сегмента (сбой посреди записи) отбрасывается; повреждение в середине журнала - ошибка.
+    segments = [n for n in _wal_segments(directory) if n >= position[0]]
+    for i, segment in enumerate(segments):
+        last = i == len(segments) - 1
+        with open(_wal_path(directory, segment), "rb") as f:
+            data = f.read()
+        if not data.startswith(WAL_MAGIC):
+            if last and len(data) < len(WAL_MAGIC):
+                return
+            raise ValueError(f"{_wal_path(directory, segment)} не является сегментом журнала")
+        offset = position[1] if segment == position[0] and position[1] else len(WAL_MAGIC)
+        while offset < len(data):
+            end = offset + WAL_RECORD.size
+            if end <= len(data):
+                length, checksum = WAL_RECORD.unpack_from(data, offset)
+                payload = data[end:end + length]
+                if len(payload) == length and zlib.crc32(payload) == checksum:
+                    yield json.loads(payload)
+                    offset = end + length
+                    continue
+            if last:
+                return
+            raise ValueError(f"Журнал повреждён: {_wal_path(directory, segment)}, смещение {offset}")
+
+class EventLog:
+    # Запись журнала изменений. append кладёт запись в буфер, фоновый поток пишет буфер
+    # в файл пачками - все записи, накопившиеся за время предыдущего fsync, уходят одним fsync.
+    # fsync: "always" - изменение возвращается после fsync своей пачки,
+    # "interval" - fsync не реже раза в sync_interval секунд (при сбое теряется не больше),
+    # "never" - только запись в ОС.
+    def __init__(self, directory, fsync="always", sync_interval=1.0, segment_size=64 << 20):
+        if fsync not in ("always", "interval", "never"):
+            raise ValueError("fsync должен быть 'always', 'interval' или 'never'")
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.fsync = fsync
+        self._sync_interval = sync_interval
+        self._segment_size = segment_size
+        self._cond = threading.Condition()
+        self._buffer = []  # байты записей; None - переход на следующий сегмент
+        self.last_lsn = 0  # номер последней добавленной записи
+        self._written_lsn = 0
+        self._durable_lsn = 0
+        self._force_sync = False
+        self._closed = False
+        self._error = None
+        self._segment = (_wal_segments(directory) or [0])[-1] + 1
+        self._offset = len(WAL_MAGIC)  # с учётом ещё не записанного буфера
+        self._file = None
+        self._open_segment(self._segment)
+        self._last_sync = time.monotonic()
+        self._thread = threading.Thread(target=self._run, name="event-log", daemon=True)
+        self._thread.start()
+
+    def _open_segment(self, segment):
+        if self._file is not None:
+            if self.fsync != "never":
+                os.fsync(self._file.fileno())
+            self._file.close()
+        self._file = open(_wal_path(self.directory, segment), "ab")
+        self._file_segment = segment
+        self._file.write(WAL_MAGIC)
+        self._file.flush()
+        if self.fsync != "never":
+            os.fsync(self._file.fileno())
+            if hasattr(os, "O_DIRECTORY"):
+                fd = os.open(self.directory, os.O_RDONLY | os.O_DIRECTORY)
+                try:
+                    os.fsync(fd)
+                finally:
+                    os.close(fd)
+
+    def append(self, *event):
+        payload = json.dumps(event, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+        record = WAL_RECORD.pack(len(payload), zlib.crc32(payload)) + payload
+        with self._cond:
+            if self._error is not None:
+                raise self._error
+            if self._closed:
+                raise ValueError("Журнал закрыт")
+            self._buffer.append(record)
+            self.last_lsn += 1
+            self._offset += len(record)
+            if self._offset >= self._segment_size:
+                self._next_segment()
+            self._cond.notify_all()
+            return self.last_lsn
+
+    def _next_segment(self):
+        self._buffer.append(None)
+        self._segment += 1
+        self._offset = len(WAL_MAGIC)
+
+    def position(self):
+        # (сегмент, смещение) сразу после последней добавленной записи
+        with self._cond:
+            return self._segment, self._offset
+
+    def rotate(self):
+        # Дальше пишем в новый сегмент; возвращает его начало
+        with self._cond:
+            if self._offset > len(WAL_MAGIC):
+                self._next_segment()
+                self._cond.notify_all()
+            return self._segment, self._offset
+
+    def wait(self, lsn):
+        if self.fsync == "always":
+            self._wait_durable(lsn)
+
+    def sync(self):
+        # Дожидается fsync всего добавленного при любой политике
+        with self._cond:
+            self._force_sync = True
+            self._cond.notify_all()
+        self._wait_durable(self.last_lsn)
+
+    def _wait_durable(self, lsn):
+        with self._cond:
+            while self._durable_lsn < lsn and self._error is None:
+                self._cond.wait()
+            if self._error is not None:
+                raise self._error
+
+    def _sync_due(self):
+        return (self._force_sync or self.fsync == "interval" and self._written_lsn > self._durable_lsn
+                and time.monotonic() - self._last_sync >= self._sync_interval)
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._buffer and not self._closed and not self._sync_due():
+                    timeout = None
+                    if self.fsync == "interval" and self._written_lsn > self._durable_lsn:
+                        timeout = max(0.0, self._last_sync + self._sync_interval - time.monotonic())
+                    self._cond.wait(timeout)
+                batch, self._buffer = self._buffer, []
+                target = self.last_lsn
+                closing = self._closed
+                sync = self.fsync == "always" or closing or self._force_sync or (
+                    self.fsync == "interval" and time.monotonic() - self._last_sync >= self._sync_interval)
+                self._force_sync = False
+            error = None
+            try:
+                for record in batch:
+                    if record is None:
+                        self._file.flush()
+                        self._open_segment(self._file_segment + 1)
+                    else:
+                        self._file.write(record)
+                self._file.flush()
+                if sync:
+                    os.fsync(self._file.fileno())
+            except OSError as e:
+                error = e
+            with self._cond:
+                if error is not None:
+                    self._error = error
+                self._written_lsn = target
+                if sync:
+                    self._durable_lsn = target
+                    self._last_sync = time.monotonic()
+                self._cond.notify_all()
+            if closing or error is not None:
+                self._file.close()
+                return
+
+    def remove_segments_before(self, segment):
+        for n in _wal_segments(self.directory):
+            if n < segment:
+                os.remove(_wal_path(self.directory, n))
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        self._thread.join()
+
+class _LockGuard:
+    # Контекстный менеджер без генератора: блокировки берутся на каждую запись и каждый запрос
+    __slots__ = ("_acquire", "_release")
+
+    def __init__(self, acquire, release):
+        self._acquire = acquire
+        self._release = release
+
+    def __enter__(self):
+        self._acquire()
+
+    def __exit__(self, *exc_info):
+        self._release()
+
+class ReadWriteLock:
+    # Много читателей или один писатель, с очерёдностью по фазам: пока писатель ждёт, новые
+    # читатели не входят, а все читатели, дождавшиеся конца записи, входят раньше следующего
+    # писателя. Так не голодают ни записи, ни чтения. Повторный вход в том же потоке разрешён,
+    # писатель может и читать; начать запись, удерживая чтение, нельзя - это взаимная блокировка.
+    def __init__(self):
+        self._reset()
+        _register_fork_reset(self)
 
+    def _reset(self):
+        self._cond = threading.Condition(threading.Lock())
+        self._readers = 0
+        self._writer = None  # ident пишущего потока
+        self._write_depth = 0
+        self._waiting_writers = 0
+        self._waiting_readers = 0
+        self._generation = 0  # растёт, когда ждущих читателей пропускают разом
+        self._local = threading.local()  # глубина чтения в текущем потоке
+        self._read_guard = _LockGuard(self.acquire_read, self.release_read)
+        self._write_guard = _LockGuard(self.acquire_write, self.release_write)
+
+    def _admit_readers(self):
+        if self._waiting_readers:
+            self._readers += self._waiting_readers
+            self._waiting_readers = 0
+            self._generation += 1
+        self._cond.notify_all()
+
+    def acquire_read(self):
+        local = self._local
+        depth = getattr(local, "depth", 0)
+        if depth or self._writer == threading.get_ident():
+            local.depth = depth + 1
+            local.counted = getattr(local, "counted", False) and depth > 0
+            return
+        with self._cond:
+            if self._writer is None and not self._waiting_writers:
+                self._readers += 1
+            else:
+                # Ждём, пока писатель не пропустит всех ждущих читателей (он же их и посчитает)
+                generation = self._generation
+                self._waiting_readers += 1
+                while self._generation == generation:
+                    self._cond.wait()
+        local.depth = 1
+        local.counted = True
+
+    def release_read(self):
+        local = self._local
+        local.depth -= 1
+        if local.depth or not local.counted:
+            return
+        with self._cond:
+            self._readers -= 1
+            if not self._readers:
+                self._cond.notify_all()
+
+    def acquire_write(self):
+        me = threading.get_ident()
+        if self._writer == me:
+            self._write_depth += 1
+            return
+        if getattr(self._local, "depth", 0):
+            raise RuntimeError("Нельзя менять данные, удерживая в этом же потоке блокировку чтения")
+        with self._cond:
+            self._waiting_writers += 1
+            try:
+                while self._writer is not None or self._readers:
+                    self._cond.wait()
+            except BaseException:
+                self._waiting_writers -= 1
+                if not self._waiting_writers and self._writer is None:
+                    self._admit_readers()
+                raise
+            self._waiting_writers -= 1
+            self._writer = me
+            self._write_depth = 1
+
+    def release_write(self):
+        self._write_depth -= 1
+        if self._write_depth:
+            return
+        with self._cond:
+            self._writer = None
+            self._admit_readers()
+
+    def reading(self):
+        return self._read_guard
+
+    def writing(self):
+        return self._write_guard
+
+    def _after_fork(self):
+        self._reset()
+
+def _register_fork_reset(obj):
+    # В дочернем процессе после fork остаётся один поток: блокировки, которые в момент fork держали
+    # другие потоки родителя (журнал, фоновое обновление, пул сервера), там никто не отпустит.
+    # Поэтому объект с блокировками заменяет их в дочернем процессе новыми (метод _after_fork).
+    if hasattr(os, "register_at_fork"):
+        os.register_at_fork(after_in_child=partial(_reset_after_fork, weakref.ref(obj)))
+
+def _reset_after_fork(ref):
+    obj = ref()
+    if obj is not None:
+        obj._after_fork()
+
+_training_managers = weakref.WeakSet()  # DataManager, у которых запускалось фоновое обучение факторов
+
+def _stop_factor_training():
+    # Пул, оставшийся от потока-демона, завис бы в финализаторе multiprocessing при выходе,
+    # поэтому фоновое обучение останавливается раньше. atexit вызывает обработчики в обратном
+    # порядке, а этот регистрируется после импорта multiprocessing.pool.
+    for data_manager in list(_training_managers):
+        data_manager.stop_factor_training()
+
+atexit.register(_stop_factor_training)
 
 
 class DataManager:
     def __init__(self):
-        self._films = {}
+        self._films = FilmCatalog()
+        self._films._data_manager = self
         self._users = {}
+        self._genre_rows = None  # GenreRows; строится при первом запросе по жанрам, дальше поддерживается
+        self._rating_index = []  # (-рейтинг, id), отсортировано по убыванию рейтинга
+        self._rating_pending = []  # добавленные, но ещё не вставленные в _rating_index записи
+        self._rating_order = None  # номера строк каталога по убыванию рейтинга из снимка
+        self._snapshot = None  # mmap открытого снимка
+        self._ratings = RatingMatrix()  # оценки пользователей
+        self._neighbours = NeighbourTable(self._ratings)
+        self._film_neighbours = FilmNeighbourTable(self._ratings)
+        self._community = CommunityRatings()  # сводка оценок по фильмам; None - ещё не собрана из снимка
+        self._factor_model = None  # FactorModel; обучается через train_factors или в фоне после первого запроса
+        self._factor_thread = None  # поток фонового обучения (start_factor_training)
+        self._factor_stop = threading.Event()  # просьба фоновому обучению остановиться
+        self._directory = UserDirectory()  # имена и выдача id; None - ещё не собран из снимка
+        self._search_index = None  # FilmSearchIndex; строится при первом поиске, дальше поддерживается
+        self._search_cache = ResultCache(256, ttl=None)  # строки недавних поисков по версии каталога
+        self._year_order = None  # (версия каталога, номера строк по убыванию года)
+        self._id_order = None  # (размер каталога, номера строк по возрастанию id); id фильмов не меняются
+        self._catalog_version = 0  # растёт при добавлении и изменении фильмов
+        self._ratings_version = 0  # растёт при любой новой оценке любого пользователя
+        # Читатели (стратегии) работают под reading(), изменения идут под writing() и публикуются
+        # вместе с версиями целиком. Ленивые структуры, которые достраиваются при чтении
+        # (индекс рейтинга, таблица соседей, объекты из снимка), защищены отдельным _lazy_lock.
+        self._lock = ReadWriteLock()
+        self._write_guard = _LockGuard(self._lock.acquire_write, self._release_write)
+        self._lazy_lock = threading.RLock()
+        self._event_log = None  # EventLog, если включён журнал изменений (open_log)
+        _register_fork_reset(self)
+        self._rating_listeners = []  # вызываются с user_id после изменения оценок (под блокировкой записи)
+        self._log_position = (0, 0)  # (сегмент, смещение) журнала, до которого изменения уже в данных
+
+    def reading(self):
+        return self._lock.reading()
+
+    def writing(self):
+        return self._write_guard
+
+    def _after_fork(self):
+        # Поток записи журнала остался в родителе: дочерний процесс журнал не пишет и fsync не ждёт
+        self._lazy_lock = threading.RLock()
+        self._event_log = None
+
+    def _release_write(self):
+        # Снятие внешней блокировки записи дожидается fsync всех изменений, сделанных под ней:
+        # вложенные writing() (сервер, пакетная загрузка) не подтверждают изменения раньше диска
+        lock = self._lock
+        lock.release_write()
+        if lock._writer != threading.get_ident():
+            self._commit_log()
 
     def add_film(self, film: Film):
-        if film._id in self._films:
-            print(f"Фильм с ID {film._id} уже существует.")
+        with self.writing():
+            if film._id in self._films:
+                print(f"Фильм с ID {film._id} уже существует.")
+            else:
+                self._log_event("film", film._id, film.title, [genre.value for genre in film.genres],
+                                film.director, film.year, film.rating)
+                row = self._films.add(film)
+                film._data_manager = self
+                if self._search_index is not None:
+                    self._search_index.add(row, film.title, film.director)
+                self._catalog_version += 1
+                for genre in film.genres:
+                    if self._genre_rows is not None:
+                        self._genre_rows.set(genre, row, True)
+                self._rating_pending.append((-film.rating, film._id))
+
+    def _reindex_genres(self, film: Film, old_genres):
+        for genre in old_genres:
+            if self._genre_rows is not None:
+                self._genre_rows.set(genre, film._row, False)
+        for genre in film.genres:
+            if self._genre_rows is not None:
+                self._genre_rows.set(genre, film._row, True)
+        self._catalog_version += 1
+
+    def _reindex_text(self, film: Film, field, old_text, new_text):
+        if self._search_index is not None:
+            self._search_index.update(film._row, field, old_text, new_text)
+        self._catalog_version += 1
+
+    def _get_search_index(self):
+        index = self._search_index
+        if index is None:
+            with self._lazy_lock:
+                if self._search_index is None:
+                    self._search_index = FilmSearchIndex.from_catalog(self._films)
+                index = self._search_index
+        return index
+
+    def search_films(self, query, offset=0, limit=20, fields=("title", "director"), threshold=0.5):
+        # Нечёткий поиск по названию и режиссёру (опечатки, недописанные слова, любой регистр).
+        # Возвращает (сколько найдено, фильмы страницы) по убыванию совпадения, затем рейтинга.
+        # Весь ранжированный список кэшируется до изменения каталога, так что страницы дешёвые.
+        key = (" ".join(query.casefold().split()), tuple(fields), threshold)
+        with self.reading():
+            versions = (self._catalog_version,)
+            rows = self._search_cache.get(key, versions)
+            if rows is None:
+                found = self._get_search_index().search(query, fields, threshold)
+                films = self._films
+                rows = sorted(found, key=lambda row: (-found[row][0], -found[row][1], -films._ratings[row], films._ids[row]))
+                self._search_cache.put(key, versions, rows)
+            return len(rows), [self._films._film_at(row) for row in rows[offset:offset + limit]]
+
+    def get_films_page_by_year(self, offset=0, limit=20):
+        # (всего фильмов, фильмы страницы) от новых к старым; порядок строится один раз на версию каталога
+        with self.reading():
+            order = self._year_order
+            if order is None or order[0] != self._catalog_version:
+                with self._lazy_lock:
+                    order = self._year_order
+                    if order is None or order[0] != self._catalog_version:
+                        years = self._films._years
+                        order = self._year_order = (self._catalog_version,
+                                                    sorted(range(len(years)), key=years.__getitem__, reverse=True))
+            rows = order[1]
+            return len(rows), [self._films._film_at(row) for row in rows[offset:offset + limit]]
+
+    def get_films_page(self, offset=0, limit=20, order="rating"):
+        # (всего фильмов, фильмы страницы) по убыванию рейтинга или по возрастанию id. Страница
+        # вырезается из готового порядка строк, Film создаётся только для фильмов страницы
+        with self.reading():
+            films = self._films
+            if order == "rating":
+                if self._rating_index is None and not self._rating_pending:
+                    rows = self._rating_order[offset:offset + limit]
+                else:
+                    rows = [films._find_row(film_id) for _, film_id in self._get_rating_index()[offset:offset + limit]]
+            elif order == "id":
+                rows = self._get_id_order()[offset:offset + limit]
+            else:
+                raise ValueError("order должен быть 'rating' или 'id'")
+            return len(films), [films._film_at(row) for row in rows]
+
+    def _get_id_order(self):
+        order = self._id_order
+        if order is None or order[0] != len(self._films):
+            with self._lazy_lock:
+                order = self._id_order
+                if order is None or order[0] != len(self._films):
+                    ids = self._films._ids
+                    order = self._id_order = (len(ids), sorted(range(len(ids)), key=ids.__getitem__))
+        return order[1]
+
+    def _get_rating_index(self):
+        if self._rating_index is not None and not self._rating_pending:
+            return self._rating_index
+        with self._lazy_lock:
+            if self._rating_index is None:
+                # Первое изменение после открытия снимка: строим список из сохранённого порядка
+                films = self._films
+                self._rating_index = [(-films._ratings[row], films._ids[row]) for row in self._rating_order]
+                self._rating_order = None
+            if self._rating_pending:
+                # Одиночные добавления вставляем по месту, пачку (массовая загрузка) - одной сортировкой
+                if len(self._rating_pending) < 64:
+                    for entry in self._rating_pending:
+                        bisect.insort(self._rating_index, entry)
+                else:
+                    self._rating_index.extend(self._rating_pending)
+                    self._rating_index.sort()
+                self._rating_pending.clear()
+            return self._rating_index
+
+    def _reindex_rating(self, film: Film, old_rating):
+        index = self._get_rating_index()
+        i = bisect.bisect_left(index, (-old_rating, film._id))
+        if i < len(index) and index[i] == (-old_rating, film._id):
+            del index[i]
         else:
-            self._films[film._id] = film
+            # Фильм из снимка: в колонке уже новый рейтинг, поэтому старую запись ищем перебором
+            index.remove((-film.rating, film._id))
+        bisect.insort(index, (-film.rating, film._id))
+        self._catalog_version += 1
+
+    def iter_rows_by_rating(self):
+        # Строки каталога от самого высокого рейтинга к самому низкому, без сортировки на каждый запрос
+        if self._rating_index is None and not self._rating_pending:
+            yield from self._rating_order
+            return
+        find_row = self._films._find_row
+        for _, film_id in self._get_rating_index():
+            yield find_row(film_id)
+
+    def iter_films_by_rating(self):
+        film_at = self._films._film_at
+        for row in self.iter_rows_by_rating():
+            yield film_at(row)
+
+    def _get_genre_rows(self):
+        rows = self._genre_rows
+        if rows is None:
+            with self._lazy_lock:
+                if self._genre_rows is None:
+                    self._genre_rows = GenreRows.from_masks(self._films._genre_masks)
+                rows = self._genre_rows
+        return rows
+
+    def match_genre_tiers(self, genres, exclude_rows=()):
+        # (число совпавших жанров, строки каталога) от большего числа к меньшему, лениво: нижние
+        # ряды не собираются, если рекомендации набрались из верхних. Перебираются только строки
+        # жанров из genres и exclude_rows (например, просмотренные), а не весь каталог.
+        index = self._get_genre_rows()
+        postings = [index.rows(genre) for genre in set(genres)]
+        exclude = set(exclude_rows)
+        # Множества "не меньше c жанров" копятся объединением и пересечением строк жанров
+        at_least = [set() for _ in range(len(postings) + 2)]
+        for rows in postings:
+            for count in range(len(postings), 1, -1):
+                at_least[count] |= at_least[count - 1] & rows
+            at_least[1] |= rows
+        for count in range(len(postings), 0, -1):
+            tier = at_least[count] - at_least[count + 1] - exclude
+            if tier:
+                yield count, list(tier)
 
     def add_user(self, user: User):
-        if user._id in self._users:
-            print(f"Пользователь с ID {user._id} уже существует")
+        with self.writing():
+            if user._id in self._users:
+                print(f"Пользователь с ID {user._id} уже существует")
+            else:
+                self._log_event("user", user._id, user.user_name, [genre.value for genre in user.preferred_genres],
+                                [[film._id, r] for film, r in user.watched_films.items()])
+                self._users[user._id] = user
+                user._data_manager = self
+                if self._directory is not None:
+                    self._directory.add(user.user_name, user._id)
+                self._reindex_user_ratings(user)
+
+    def _on_rating(self, user: User, film: Film, rating):
+        old_rating = self._ratings.set_rating(user._id, film._id, rating)
+        if self._community is not None:
+            self._community.update(film._id, old_rating, rating)
+        self._neighbours.on_rating(user._id, film._id)
+        self._film_neighbours.on_rating(user._id, film._id)
+        self._ratings_version += 1
+        for callback in self._rating_listeners:
+            callback(user._id)
+
+    def _reindex_user_ratings(self, user: User):
+        ratings = {film._id: r for film, r in user.watched_films.items()}
+        old_ratings = self._ratings.get_user_ratings(user._id)
+        old_film_ids = old_ratings.keys()
+        self._ratings.set_user_ratings(user._id, ratings)
+        if self._community is not None:
+            for film_id, rating in old_ratings.items():
+                self._community.update(film_id, rating, None)
+            for film_id, rating in ratings.items():
+                self._community.update(film_id, None, rating)
+        self._neighbours.on_user_ratings_replaced(user._id, old_film_ids | ratings.keys())
+        self._film_neighbours.on_user_ratings_replaced(user._id, old_film_ids | ratings.keys())
+        self._ratings_version += 1
+        for callback in self._rating_listeners:
+            callback(user._id)
+
+    def add_rating_listener(self, callback):
+        self._rating_listeners.append(callback)
+
+    def remove_rating_listener(self, callback):
+        self._rating_listeners.remove(callback)
+
+    def _load_watched_films(self, user: User):
+        films = self._films
+        return {films[film_id]: rating for film_id, rating in self._ratings.get_user_ratings(user._id).items()
+                if film_id in films}
+
+    def get_neighbours(self, user: User, similarities=None):
+        # K самых похожих пользователей из поддерживаемой таблицы: [(user_id, сходство)]
+        with self._lazy_lock:
+            return self._neighbours.neighbours(user._id, similarities)
+
+    def get_similar_films(self, film: Film):
+        # N самых похожих по оценкам пользователей фильмов: [(film_id, сходство)]
+        with self._lazy_lock:
+            return self._film_neighbours.neighbours(film._id)
+
+    def build_film_neighbours(self, processes=None, chunk_size=256):
+        # Строит списки похожих фильмов для всего каталога в пуле процессов. Списки фильмов, чьи
+        # оценки изменились во время сборки, не записываются - они построятся при обращении.
+        table = self._film_neighbours
+        film_ids = iter(list(self._ratings._col_films))
+        chunks = iter(lambda: list(islice(film_ids, chunk_size)), [])
+        with self.writing():
+            table._dirty = set()
+        built = []
+        try:
+            for chunk in _run_forked(_film_neighbours_chunk, (self, table), chunks, processes, self):
+                built.extend(chunk)
+        finally:
+            with self.writing():
+                dirty, table._dirty = table._dirty, None
+                with self._lazy_lock:
+                    for film_id, neighbours in built:
+                        if film_id not in dirty:
+                            table._set(film_id, neighbours)
+        return len(built) - len(dirty & {film_id for film_id, _ in built})
+
+    def _get_community(self):
+        community = self._community
+        if community is None or community.needs_sync():
+            with self._lazy_lock:
+                if self._community is None:
+                    # Снимок: сводку собираем из столбцов матрицы оценок при первом обращении
+                    self._community = CommunityRatings.from_matrix(self._ratings)
+                elif self._community.needs_sync():
+                    self._community.sync()
+                community = self._community
+        return community
+
+    def get_film_community_stats(self, film: Film):
+        # (число оценок, среднее, стандартное отклонение, байесовское среднее) или None, если оценок нет
+        return self._get_community().get(film._id)
+
+    def iter_rows_by_community(self, min_count=1):
+        # Строки каталога по убыванию байесовского среднего оценок пользователей; без оценок не попадают
+        find_row = self._films._find_row
+        for film_id, count, _ in self._get_community().iter_ranking():
+            if count >= min_count:
+                row = find_row(film_id)
+                if row is not None:
+                    yield row
+
+    def iter_films_by_community(self, min_count=1):
+        film_at = self._films._film_at
+        for row in self.iter_rows_by_community(min_count):
+            yield film_at(row)
+
+    def train_factors(self, factors=16, iterations=10, regularization=0.1, processes=None, warm_start=True):
+        # Обучает (или дообучает с текущих векторов) модель скрытых факторов. Обучение идёт без
+        # блокировки записи, запросы работают со старой моделью, пока новая не готова.
+        model = self._factor_model
+        if model is None or not warm_start or model.factors != factors:
+            model = FactorModel(factors, regularization)
+        model.regularization = regularization
+        if model.train(self, iterations, processes, stop=self._factor_stop) is None:
+            return None  # остановлено (stop_factor_training), старая модель остаётся
+        with self.writing():
+            # Готовые результаты als посчитаны по старой модели: сдвиг версии оценок сбрасывает их кэш
+            self._factor_model = model
+            self._ratings_version += 1
+        return model
+
+    def start_factor_training(self, factors=16, iterations=10, regularization=0.1, processes=2):
+        # Обучение в фоновом потоке (по первому запросу als); если оно уже идёт, возвращает тот же
+        # поток. По умолчанию берёт два процесса, чтобы не занимать все ядра, пока идут запросы
+        with self._lazy_lock:
+            thread = self._factor_thread
+            if thread is None or not thread.is_alive():
+                thread = self._factor_thread = threading.Thread(
+                    target=self.train_factors, args=(factors, iterations, regularization, processes),
+                    name="factor-training", daemon=True)
+                _training_managers.add(self)
+                thread.start()
+        return thread
+
+    def stop_factor_training(self):
+        # Прерывает фоновое обучение между пачками и ждёт, пока поток закроет пул процессов
+        thread = self._factor_thread
+        if thread is None or not thread.is_alive():
+            return
+        self._factor_stop.set()
+        thread.join()
+        self._factor_stop.clear()
+
+    def get_factor_model(self, factors=16, iterations=10, regularization=0.1):
+        # Модель для запросов или None, если её ещё нет. Тогда обучение запускается в фоне, а запрос
+        # его не ждёт: обучение под блокировкой чтения остановило бы всех писателей
+        model = self._factor_model
+        if model is None:
+            self.start_factor_training(factors, iterations, regularization)
+        return model
+
+    def get_user_similarities(self, user: User, exact_compat=False):
+        # [(user_id, сходство)] для всех пользователей с общими фильмами, в порядке добавления
+        ratings = {film._id: r for film, r in user.watched_films.items()}
+        return self._ratings.similarities(ratings, user._id, exact_compat)
+
+    def _get_directory(self):
+        directory = self._directory
+        if directory is None:
+            with self._lazy_lock:
+                if self._directory is None:
+                    self._directory = self._build_directory()
+                directory = self._directory
+        return directory
+
+    def _build_directory(self):
+        # Снимок: имена берутся из колонки снимка, объекты User для этого не создаются
+        directory = UserDirectory()
+        users = self._users
+        if isinstance(users, SnapshotUsers):
+            for row, user_id in enumerate(self._ratings._row_users):
+                user = users._loaded.get(user_id)
+                if user is not None:
+                    directory.add(user.user_name, user_id)
+                elif row < users._count:
+                    directory.add(users._names[row], user_id)
         else:
-            self._users[user._id] = user
+            for user_id, user in users.items():
+                directory.add(user.user_name, user_id)
+        return directory
+
+    def _rename_user(self, user: User, old_name):
+        if self._directory is not None:
+            self._directory.remove(old_name, user._id)
+            self._directory.add(user.user_name, user._id)
+
+    def get_user_by_name(self, user_name: str):
+        # Без учёта регистра и лишних пробелов
+        with self.reading():
+            user_id = self._get_directory().get(user_name)
+            return self._users[user_id] if user_id is not None else None
+
+    def allocate_user_id(self):
+        with self.writing():
+            return self._get_directory().allocate_id()
+
+    def complete_user_names(self, prefix, limit=10):
+        # Имена пользователей, начинающиеся с prefix, по алфавиту - для автодополнения
+        # Справочник меняется под блокировкой записи; сам complete() вливает буфер новых имён,
+        # поэтому параллельные читатели дополнительно разделены _lazy_lock
+        with self.reading():
+            directory = self._get_directory()
+            with self._lazy_lock:
+                user_ids = directory.complete(prefix, limit)
+            return [self._users[user_id].user_name for user_id in user_ids]
+
+    def _log_event(self, *event):
+        # Вызывается под блокировкой записи до изменения данных
+        if self._event_log is not None:
+            self._event_log.append(*event)
+
+    def _commit_log(self):
+        # Вызывается после снятия блокировки записи, чтобы писатели делили один fsync
+        log = self._event_log
+        if log is not None:
+            log.wait(log.last_lsn)
+
+    def sync_log(self):
+        if self._event_log is not None:
+            self._event_log.sync()
+
+    def open_log(self, directory, fsync="always", sync_interval=1.0, segment_size=64 << 20):
+        # Восстановление после перезапуска: докатывает журнал из directory поверх текущих данных
+        # (снимка или начальной загрузки), затем пишет в него новые изменения. Возвращает число
+        # применённых событий.
+        if self._event_log is not None:
+            raise ValueError("Журнал уже открыт")
+        replayed = 0
+        with self.writing():
+            for event in read_event_log(directory, self._log_position):
+                self._apply_event(event)
+                replayed += 1
+            self._event_log = EventLog(directory, fsync, sync_interval, segment_size)
+        return replayed
+
+    def close_log(self):
+        if self._event_log is not None:
+            self._event_log.close()
+            self._log_position = self._event_log.position()
+            self._event_log = None
+
+    def _apply_event(self, event):
+        kind, key = event[0], event[1]
+        films, users = self._films, self._users
+        if kind == "film":
+            if key not in films:
+                _, film_id, title, genres, director, year, rating = event
+                self.add_film(Film(film_id, title, [Genres(g) for g in genres], director, year, rating))
+        elif kind == "user":
+            if key not in users:
+                _, user_id, user_name, genres, ratings = event
+                watched = {films[film_id]: r for film_id, r in ratings if film_id in films}
+                self.add_user(User(user_id, user_name, watched, [Genres(g) for g in genres]))
+        elif key in users:
+            user = users[key]
+            if kind == "genres":
+                user.preferred_genres = [Genres(g) for g in event[2]]
+            elif kind == "name":
+                user.user_name = event[2]
+            elif kind == "rate":
+                if event[2] in films:
+                    user.add_watched_film(films[event[2]], event[3])
+            elif kind == "ratings":
+                user.watched_films = {films[film_id]: r for film_id, r in event[2] if film_id in films}
+            else:
+                raise ValueError(f"Неизвестное событие журнала: {kind!r}")
+
+    def compact(self, snapshot_path):
+        # Сворачивает журнал в новый снимок и удаляет сегменты, которые в него вошли.
+        # Пока пишется снимок, изменения ждут (снимок читается под блокировкой чтения).
+        log = self._event_log
+        if log is None:
+            raise ValueError("Журнал не открыт")
+        with self.reading():
+            position = log.rotate()
+            self._save_snapshot(snapshot_path, position)
+        log.sync()
+        log.remove_segments_before(position[0])
+        return position
+
+    def start_compaction(self, snapshot_path):
+        thread = threading.Thread(target=self.compact, args=(snapshot_path,), name="compaction", daemon=True)
+        thread.start()
+        return thread
+
+    def save_snapshot(self, path):
+        with self.reading():
+            position = self._event_log.position() if self._event_log is not None else self._log_position
+            self._save_snapshot(path, position)
+
+    def _save_snapshot(self, path, log_position=(0, 0)):
+        # Пишет каталог, индексы, пользователей и оценки в бинарный снимок (через временный файл)
+        films, ratings = self._films, self._ratings
+        genres = list(Genres)
+        sorted_rows = sorted(range(len(films)), key=films._ids.__getitem__)
+        if self._rating_index is None and not self._rating_pending:
+            rating_order = self._rating_order
+        else:
+            rating_order = array("q", (films.row_of(film_id) for _, film_id in self._get_rating_index()))
+        users = [self._users[user_id] for user_id in ratings._row_users]
+        user_genre_offsets, user_genres = array("q", [0]), array("b")
+        for user in users:
+            user_genres.extend(genres.index(genre) for genre in user.preferred_genres)
+            user_genre_offsets.append(len(user_genres))
+        title_offsets, title_data = _string_column(films._titles)
+        director_offsets, director_data = _string_column(films._directors)
+        name_offsets, name_data = _string_column(user.user_name for user in users)
+        row_offsets, row_cols, row_values = _csr(ratings._rows)
+        col_offsets, col_rows, col_values = _csr(ratings._cols)
+        sections = {
+            "film_ids": films._ids,
+            "film_years": films._years,
+            "film_ratings": films._ratings,
+            "film_genres": films._genre_masks,
+            "title_offsets": title_offsets,
+            "title_data": title_data,
+            "director_offsets": director_offsets,
+            "director_data": director_data,
+            "sorted_ids": array("q", (films._ids[row] for row in sorted_rows)),
+            "sorted_rows": array("q", sorted_rows),
+            "rating_order": rating_order,
+            "user_ids": array("q", ratings._row_users),
+            "name_offsets": name_offsets,
+            "name_data": name_data,
+            "user_genre_offsets": user_genre_offsets,
+            "user_genres": user_genres,
+            "col_films": array("q", ratings._col_films),
+            "row_offsets": row_offsets,
+            "row_cols": row_cols,
+            "row_values": row_values,
+            "col_offsets": col_offsets,
+            "col_rows": col_rows,
+            "col_values": col_values,
+            "wal_position": array("q", log_position),
+        }
+        offset = SNAPSHOT_HEADER.size + SNAPSHOT_SECTION.size * len(sections)
+        table, blobs = [], []
+        for name, data in sections.items():
+            data = memoryview(data).cast("B")
+            offset += -offset % 8
+            table.append(SNAPSHOT_SECTION.pack(name.encode(), offset, len(data)))
+            blobs.append((offset, data))
+            offset += len(data)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(SNAPSHOT_HEADER.pack(SNAPSHOT_MAGIC, SNAPSHOT_VERSION, SNAPSHOT_BYTEORDER, len(sections)))
+            f.write(b"".join(table))
+            for offset, data in blobs:
+                f.write(b"\0" * (offset - f.tell()))
+                f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def open_snapshot(cls, path):
+        # Открывает снимок через mmap: колонки и оценки читаются прямо из отображённых страниц,
+        # Python-объекты создаются только по мере обращения. Изменения в файл не попадают.
+        with open(path, "rb") as f:
+            snapshot = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_COPY)
+        magic, version, byteorder, count = SNAPSHOT_HEADER.unpack_from(snapshot, 0)
+        if magic != SNAPSHOT_MAGIC:
+            raise ValueError(f"{path} не является снимком DataManager")
+        if version != SNAPSHOT_VERSION:
+            raise ValueError(f"Неподдерживаемая версия снимка: {version}")
+        if byteorder != SNAPSHOT_BYTEORDER:
+            raise ValueError("Снимок записан на машине с другим порядком байт")
+        view = memoryview(snapshot)
+        sections = {}
+        for i in range(count):
+            name, offset, size = SNAPSHOT_SECTION.unpack_from(snapshot, SNAPSHOT_HEADER.size + i * SNAPSHOT_SECTION.size)
+            sections[name.rstrip(b"\0").decode()] = view[offset:offset + size]
+        column = lambda name, typecode: sections[name].cast(typecode)
+
+        dm = cls()
+        dm._snapshot = snapshot
+        films = dm._films
+        films._ids = column("film_ids", "q")
+        films._years = column("film_years", "i")
+        films._ratings = column("film_ratings", "d")
+        films._genre_masks = column("film_genres", "i")
+        films._titles = StringColumn(column("title_offsets", "q"), sections["title_data"])
+        films._directors = StringColumn(column("director_offsets", "q"), sections["director_data"])
+        films._sorted_ids = column("sorted_ids", "q")
+        films._sorted_rows = column("sorted_rows", "q")
+        films._films = [None] * len(films._ids)
+
+        dm._rating_index = None
+        dm._rating_order = column("rating_order", "q")
+
+        ratings = dm._ratings
+        ratings._row_users = list(column("user_ids", "q"))
+        ratings._user_rows = dict(zip(ratings._row_users, range(len(ratings._row_users))))
+        ratings._col_films = list(column("col_films", "q"))
+        ratings._film_cols = dict(zip(ratings._col_films, range(len(ratings._col_films))))
+        ratings._rows = LazyRows(column("row_offsets", "q"), column("row_cols", "q"), column("row_values", "d"))
+        ratings._cols = LazyRows(column("col_offsets", "q"), column("col_rows", "q"), column("col_values", "d"))
+        dm._users = SnapshotUsers(
+            dm, StringColumn(column("name_offsets", "q"), sections["name_data"]),
+            column("user_genre_offsets", "q"), column("user_genres", "b"),
+        )
+        dm._community = None
+        dm._directory = None
+        if "wal_position" in sections:
+            dm._log_position = tuple(column("wal_position", "q"))
+        return dm
 
     def load_sample_data(self):
         sample_films = [
@@ -238,7 +2425,11 @@ class DataManager:
 # 2  
 
 
-class RecommendationStrategy(ABC):  
+class RecommendationStrategy(ABC):
+    # True, если результат зависит от оценок всех пользователей, а не только от каталога и самого пользователя
+    uses_all_ratings = False
+    _probes = threading.local()  # CallProbe текущих вызовов по потокам, если в сервисе включены метрики
+  
     def __init__(self, name: str):
         self._name = name  
         self._recommendation_count = 5  
@@ -268,32 +2459,385 @@ class RecommendationStrategy(ABC):
     @abstractmethod
     def get_description(self):
         pass
+    def iter_films(self, data_manager, user):
+        # Ленивый поток рекомендаций в порядке __call__, без ограничения recommendation_count
+        # (для постраничной выдачи). По умолчанию - только то, что вернул __call__.
+        return iter(self(data_manager, user))
+    @property
+    def _probe(self):
+        return self._probes.__dict__.get(id(self))
+    @_probe.setter
+    def _probe(self, probe):
+        if probe is None:
+            self._probes.__dict__.pop(id(self), None)
+        else:
+            self._probes.__dict__[id(self)] = probe
+
+class ResultCache:
+    # LRU-кэш результатов рекомендаций с ограниченным временем жизни записей.
+    # Вместе с результатом хранятся версии данных, на которых он посчитан:
+    # если хоть одна версия сменилась, запись считается устаревшей.
+    def __init__(self, max_size=1024, ttl=300.0):
+        if max_size < 1:
+            raise ValueError("Размер кэша должен быть положительным")
+        self._max_size = max_size
+        self._ttl = ttl  # секунды, None - без ограничения
+        self._entries = OrderedDict()  # ключ -> (версии, результат, момент истечения)
+        self._lock = threading.Lock()
+        _register_fork_reset(self)
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def _after_fork(self):
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key, versions):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            entry_versions, result, expires_at = entry
+            if entry_versions != versions or (expires_at is not None and time.monotonic() >= expires_at):
+                del self._entries[key]
+                self.invalidations += 1
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return result
+
+    def put(self, key, versions, result):
+        expires_at = time.monotonic() + self._ttl if self._ttl is not None else None
+        with self._lock:
+            self._entries[key] = (versions, result, expires_at)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self._max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    @property
+    def stats(self):
+        requests = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "max_size": self._max_size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations,
+            "hit_rate": self.hits / requests if requests else 0.0,
+        }
+
+@dataclass
+class _PageCursor:
+    key: tuple  # (стратегия, id(data_manager), user_id, фильтры)
+    versions: tuple  # версии данных, на которых открыт поток
+    films: object  # итератор оставшихся фильмов
+    pending: list  # фильм, прочитанный наперёд, чтобы знать, есть ли следующая страница
+    served: set  # уже выданные фильмы
+
+class CursorStore:
+    # Открытые курсоры постраничной выдачи по непрозрачным токенам. Каждая страница получает
+    # новый токен, а прежний гаснет, поэтому один поток никогда не читается из двух потоков сразу.
+    # Курсор, который не запрашивали ttl секунд, удаляется; сверх max_cursors удаляются самые старые.
+    def __init__(self, ttl=120.0, max_cursors=10000):
+        self._ttl = ttl
+        self._max_cursors = max_cursors
+        self._cursors = OrderedDict()  # токен -> (момент истечения, _PageCursor), по возрастанию срока
+        self._lock = threading.Lock()
+        _register_fork_reset(self)
+        self.opened = 0
+        self.expired = 0
+
+    def _after_fork(self):
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._cursors)
+
+    def _purge(self, now):
+        cursors = self._cursors
+        while cursors:
+            token, (expires_at, _) = next(iter(cursors.items()))
+            if expires_at > now and len(cursors) <= self._max_cursors:
+                break
+            del cursors[token]
+            self.expired += 1
+
+    def put(self, cursor: _PageCursor):
+        token = secrets.token_urlsafe(16)
+        with self._lock:
+            now = time.monotonic()
+            self._cursors[token] = (now + self._ttl, cursor)
+            self.opened += 1
+            self._purge(now)
+        return token
+
+    def take(self, token):
+        with self._lock:
+            self._purge(time.monotonic())
+            entry = self._cursors.pop(token, None)
+        return entry[1] if entry is not None else None
+
+    @property
+    def stats(self):
+        return {"open": len(self._cursors), "opened": self.opened, "expired": self.expired, "ttl": self._ttl}
+
+class CallProbe:
+    # Замеры одного вызова стратегии: время фаз и число просмотренных кандидатов.
+    # Стратегия видит его в self._probe только при включённых метриках.
+    __slots__ = ("phases", "scanned", "_last")
+
+    def __init__(self):
+        self.phases = {}
+        self.scanned = 0
+        self._last = time.perf_counter()
+
+    def phase(self, name):
+        # Закрывает фазу name: всё время с конца предыдущей фазы
+        now = time.perf_counter()
+        self.phases[name] = self.phases.get(name, 0.0) + (now - self._last) * 1000
+        self._last = now
+
+    def scan(self, count):
+        self.scanned += count
+
+class LatencyHistogram:
+    BUCKETS_MS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
+
+    def __init__(self):
+        self.counts = [0] * (len(self.BUCKETS_MS) + 1)  # последний - больше всех границ
+        self.count = 0
+        self.total_ms = 0.0
+
+    def observe(self, value_ms):
+        self.counts[bisect.bisect_left(self.BUCKETS_MS, value_ms)] += 1
+        self.count += 1
+        self.total_ms += value_ms
+
+    def quantile(self, q):
+        # Оценка сверху: граница корзины, в которую попадает q-я доля вызовов
+        if not self.count:
+            return 0.0
+        rank, seen = q * self.count, 0
+        for i, n in enumerate(self.counts):
+            seen += n
+            if seen >= rank:
+                return self.BUCKETS_MS[i] if i < len(self.BUCKETS_MS) else float("inf")
+        return float("inf")
+
+class MemorySink:
+    def __init__(self, max_events=10000):
+        self.events = deque(maxlen=max_events)
+
+    def emit(self, event, metrics):
+        self.events.append(event)
+
+class JsonLinesSink:
+    def __init__(self, path):
+        self._file = open(path, "a", encoding="utf-8")
+
+    def emit(self, event, metrics):
+        self._file.write(json.dumps(event, ensure_ascii=False) + "\n")
+        self._file.flush()
+
+    def close(self):
+        self._file.close()
+
+class PrometheusFileSink:
+    # Переписывает файл в текстовом формате Prometheus (для textfile collector) не чаще раза в interval секунд
+    def __init__(self, path, interval=5.0):
+        self._path = path
+        self._interval = interval
+        self._written_at = 0.0
+
+    def emit(self, event, metrics):
+        now = time.monotonic()
+        if now - self._written_at < self._interval:
+            return
+        self._written_at = now
+        tmp_path = f"{self._path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(metrics.to_prometheus())
+        os.replace(tmp_path, self._path)
+
+class Metrics:
+    # Метрики RecommendationService: гистограммы задержек и счётчики кандидатов по стратегиям,
+    # события вызовов уходят в sink. Для доли profile_rate вызовов снимается cProfile
+    # (и пик памяти через tracemalloc, если trace_memory). Профилировщик и tracemalloc общие
+    # на процесс, поэтому одновременно профилируется не больше одного вызова: выпавший в выборку,
+    # пока идёт другой профилируемый, считается без профиля.
+    def __init__(self, sink=None, profile_rate=0.0, trace_memory=False, profile_top=15):
+        self.sink = sink
+        self.profile_rate = profile_rate
+        self.trace_memory = trace_memory
+        self.profile_top = profile_top
+        self.histograms = defaultdict(LatencyHistogram)
+        self.phase_totals_ms = defaultdict(lambda: defaultdict(float))
+        self.counters = defaultdict(lambda: {"calls": 0, "scanned": 0, "returned": 0, "profiled": 0})
+        self._lock = threading.Lock()
+        self._profile_lock = threading.Lock()  # занят на время профилируемого вызова
+        _register_fork_reset(self)
+
+    def _after_fork(self):
+        self._lock = threading.Lock()
+        self._profile_lock = threading.Lock()
+
+    def observe(self, strategy_name, strategy, call, count=len):
+        # count - сколько фильмов в результате call (для режима all результат - словарь списков)
+        probe = CallProbe()
+        profiler = None
+        tracing = False
+        if self.profile_rate and random.random() < self.profile_rate and self._profile_lock.acquire(blocking=False):
+            profiler = cProfile.Profile()
+            if self.trace_memory and not tracemalloc.is_tracing():
+                tracemalloc.start()
+                tracing = True
+            profiler.enable()
+        strategy._probe = probe
+        started = time.perf_counter()
+        try:
+            films = call()
+        finally:
+            elapsed_ms = (time.perf_counter() - started) * 1000
+            strategy._probe = None
+            if profiler is not None:
+                profiler.disable()
+                memory_peak = tracemalloc.get_traced_memory()[1] if tracing else None
+                if tracing:
+                    tracemalloc.stop()
+                self._profile_lock.release()
+        with self._lock:
+            counters = self.counters[strategy_name]
+            counters["calls"] += 1
+            counters["scanned"] += probe.scanned
+            returned = count(films)
+            counters["returned"] += returned
+            if profiler is not None:
+                counters["profiled"] += 1
+            self.histograms[strategy_name].observe(elapsed_ms)
+            for phase, ms in probe.phases.items():
+                self.phase_totals_ms[strategy_name][phase] += ms
+        event = {
+            "time": time.time(),
+            "strategy": strategy_name,
+            "latency_ms": elapsed_ms,
+            "phases_ms": probe.phases,
+            "scanned": probe.scanned,
+            "returned": returned,
+        }
+        if profiler is not None:
+            out = io.StringIO()
+            pstats.Stats(profiler, stream=out).sort_stats("cumulative").print_stats(self.profile_top)
+            event["profile"] = out.getvalue()
+            if memory_peak is not None:
+                event["memory_peak_kb"] = memory_peak / 1024
+        if self.sink is not None:
+            with self._lock:
+                self.sink.emit(event, self)
+        return films
+
+    def summary(self):
+        return {
+            name: {
+                **self.counters[name],
+                "p50_ms": histogram.quantile(0.5),
+                "p95_ms": histogram.quantile(0.95),
+                "p99_ms": histogram.quantile(0.99),
+                "mean_ms": histogram.total_ms / histogram.count if histogram.count else 0.0,
+                "phases_ms": dict(self.phase_totals_ms[name]),
+            }
+            for name, histogram in self.histograms.items()
+        }
+
+    def to_prometheus(self):
+        lines = [
+            "# HELP recommendation_latency_ms Время вызова стратегии, мс",
+            "# TYPE recommendation_latency_ms histogram",
+        ]
+        for name, histogram in self.histograms.items():
+            cumulative = 0
+            for bound, n in zip(histogram.BUCKETS_MS + ("+Inf",), histogram.counts):
+                cumulative += n
+                lines.append(f'recommendation_latency_ms_bucket{{strategy="{name}",le="{bound}"}} {cumulative}')
+            lines.append(f'recommendation_latency_ms_sum{{strategy="{name}"}} {histogram.total_ms}')
+            lines.append(f'recommendation_latency_ms_count{{strategy="{name}"}} {histogram.count}')
+        for counter in ("scanned", "returned"):
+            lines.append(f"# TYPE recommendation_candidates_{counter}_total counter")
+            for name, counters in self.counters.items():
+                lines.append(f'recommendation_candidates_{counter}_total{{strategy="{name}"}} {counters[counter]}')
+        lines.append("# TYPE recommendation_phase_ms_total counter")
+        for name, phases in self.phase_totals_ms.items():
+            for phase, ms in phases.items():
+                lines.append(f'recommendation_phase_ms_total{{strategy="{name}",phase="{phase}"}} {ms}')
+        return "\n".join(lines) + "\n"
 
 @dataclass
 class RecommendationResult:
     films: List['Film']
     strategy_name: str
     score: Optional[float] = None
+    cursor: Optional[str] = None  # токен следующей страницы (RecommendationService.recommend_page)
     def __str__(self):
         titles = [f.title for f in self.films]
         return f"{self.strategy_name}: {', '.join(titles)}"
     def __len__(self):
         return len(self.films)
 
+def _iter_largest(items, key):
+    # Элементы по убыванию key лениво: heapify за O(n), затем O(log n) на каждый следующий.
+    # Равные идут в порядке items, как у heapq.nlargest; key должен возвращать кортеж чисел.
+    heap = [(tuple(-k for k in key(item)), i, item) for i, item in enumerate(items)]
+    heapq.heapify(heap)
+    while heap:
+        yield heapq.heappop(heap)[2]
+
+def _watched_rows_of(user):
+    # Строки каталога просмотренных фильмов за O(числа оценок)
+    return (film._row for film in user.watched_films)
+
 class GenreBasedStrategy(RecommendationStrategy):
     def __init__(self):
         super().__init__("По жанрам")
-    def __call__(self, data_manager, user):
+    def _tiers(self, data_manager, user):
+        # Строки по числу совпавших жанров без просмотренных
         preferred_genres = user.preferred_genres
         if not preferred_genres:
-            return [] 
-        matching_films = []
-        for film in data_manager._films.values():
-            if any(genre in preferred_genres for genre in film.genres):
-                if film not in user.watched_films:
-                    matching_films.append((film, len([g for g in film.genres if g in preferred_genres])))
-        matching_films.sort(key=lambda x: (x[1], x[0].rating), reverse=True)
-        return [film for film, _ in matching_films[:self.recommendation_count]]
+            return []
+        tiers = data_manager.match_genre_tiers(preferred_genres, _watched_rows_of(user))
+        if self._probe:
+            self._probe.phase("candidates")
+        return tiers
+    def __call__(self, data_manager, user):
+        # Ряды идут от большего числа совпадений, поэтому сортировать нужно только строки тех,
+        # из которых берутся рекомендации
+        films = data_manager._films
+        key = lambda row: (films._ratings[row], -films._ids[row])
+        best = []
+        for _, rows in self._tiers(data_manager, user):
+            if self._probe:
+                self._probe.scan(len(rows))
+            best += heapq.nlargest(self.recommendation_count - len(best), rows, key=key)
+            if len(best) == self.recommendation_count:
+                break
+        if self._probe:
+            self._probe.phase("sort")
+        return [films._film_at(row) for row in best]
+    def iter_films(self, data_manager, user):
+        films = data_manager._films
+        key = lambda row: (films._ratings[row], -films._ids[row])
+        tiers = self._tiers(data_manager, user)
+        return (films._film_at(row) for _, rows in tiers for row in _iter_largest(rows, key))
     def get_description(self):
         return "Рекомендует фильмы любимых жанров пользователя"
 
@@ -301,74 +2845,963 @@ class RatingBasedStrategy(RecommendationStrategy):
     def __init__(self):
         super().__init__("По популярности")
     def __call__(self, data_manager, user):
-        unwatched_films = [
-            film for film in data_manager._films.values() 
-            if film not in user.watched_films
-        ]
-        unwatched_films.sort(key=lambda f: f.rating, reverse=True)
-        return unwatched_films[:self.recommendation_count]
+        # Просмотренные отсекаются по номеру строки, Film создаётся только для рекомендованных
+        film_at = data_manager._films._film_at
+        watched = user.watched_rows
+        recommendations = []
+        scanned = 0
+        for scanned, row in enumerate(data_manager.iter_rows_by_rating(), 1):
+            if row not in watched:
+                recommendations.append(film_at(row))
+                if len(recommendations) == self.recommendation_count:
+                    break
+        if self._probe:
+            self._probe.phase("walk")
+            self._probe.scan(scanned)
+        return recommendations
+    def iter_films(self, data_manager, user):
+        film_at = data_manager._films._film_at
+        watched = user.watched_rows
+        for row in data_manager.iter_rows_by_rating():
+            if row not in watched:
+                yield film_at(row)
     def get_description(self):
         return "Рекомендует самые популярные непросмотренные фильмы"
 
 class SimilarUsersStrategy(RecommendationStrategy):  
-    def __init__(self):
+    uses_all_ratings = True
+    def __init__(self, exact_compat=False):
         super().__init__("Похожие пользователи")
+        self._exact_compat = exact_compat  # старая формула сходства, см. RatingMatrix.similarities
     def _calculate_similarity(self, user1: 'User', user2: 'User'):
-        common_films = set(user1.watched_films.keys()) & set(user2.watched_films.keys())
+        if user1._data_manager is not None and user1._data_manager is user2._data_manager:
+            # Пары без общих фильмов отсекаются пересечением сжатых множеств строк, без копий словарей
+            if not user1.watched_rows.overlap(user2.watched_rows):
+                return 0.0
+        watched1, watched2 = user1.watched_films, user2.watched_films
+        if len(watched1) > len(watched2):
+            watched1, watched2 = watched2, watched1
+        common_films = [film for film in watched1 if film in watched2]
         if not common_films:
             return 0.0  
-        ratings_diff = [
-            abs(user1.get_rating(film) or 0 - (user2.get_rating(film) or 0))
-            for film in common_films
-        ]
+        if self._exact_compat:
+            ratings_diff = [
+                abs(user1.get_rating(film) or 0 - (user2.get_rating(film) or 0))
+                for film in common_films
+            ]
+        else:
+            ratings_diff = [abs(user1.get_rating(film) - user2.get_rating(film)) for film in common_films]
         return 1.0 / (1.0 + statistics.mean(ratings_diff))
-    def __call__(self, data_manager, user):
-        all_users = [u for u in data_manager._users.values() if u.user_id != user.user_id]
-        if not all_users:
-            return []
-        similarities = [(other_user, self._calculate_similarity(user, other_user)) 
-                       for other_user in all_users if self._calculate_similarity(user, other_user) > 0]
+    def _ranked(self, data_manager, user):
+        probe = self._probe
+        similarities = data_manager.get_user_similarities(user, self._exact_compat)
+        if probe:
+            probe.phase("candidates")
+            probe.scan(len(similarities))
         if not similarities:
             return []
-        similarities.sort(key=lambda x: x[1], reverse=True)
-        most_similar_user, similarity_score = similarities[0]
+        most_similar_id, similarity_score = max(similarities, key=lambda x: x[1])
+        most_similar_user = data_manager._users[most_similar_id]
+        watched = user.watched_rows
         recommendations = [
             film for film, rating in most_similar_user.watched_films.items()
-            if film not in user.watched_films and rating >= 8.0
+            if rating >= 8.0 and film._row not in watched
         ]
+        if probe:
+            probe.phase("filter")
         recommendations.sort(key=lambda f: most_similar_user.get_rating(f) or 0, reverse=True)
-        return recommendations[:self.recommendation_count]
+        if probe:
+            probe.phase("sort")
+        return recommendations
+    def __call__(self, data_manager, user):
+        return self._ranked(data_manager, user)[:self.recommendation_count]
+    def iter_films(self, data_manager, user):
+        return iter(self._ranked(data_manager, user))
     def get_description(self):
         return "Рекомендует фильмы, которые понравились похожим пользователям"
 
-class RecommendationService:
+class SimilarFilmsStrategy(RecommendationStrategy):
+    uses_all_ratings = True
+    def __init__(self, min_rating=7.0, seed_count=20):
+        super().__init__("Похожие фильмы")
+        self._min_rating = min_rating  # какие оценки пользователя считаются высокими
+        self._seed_count = seed_count  # сколько лучших оценённых фильмов пользователя берётся за основу
+    def _candidates(self, data_manager, user):
+        probe = self._probe
+        watched = user.watched_films
+        seeds = heapq.nlargest(self._seed_count, ((rating, film) for film, rating in watched.items()
+                                                  if rating >= self._min_rating), key=lambda x: x[0])
+        if probe:
+            probe.phase("seeds")
+        films = data_manager._films
+        watched_ids = {film._id for film in watched}
+        scores = defaultdict(float)
+        for rating, film in seeds:
+            neighbours = data_manager.get_similar_films(film)
+            if probe:
+                probe.scan(len(neighbours))
+            for other_id, similarity in neighbours:
+                if other_id not in watched_ids:
+                    scores[films[other_id]] += similarity * rating
+        if probe:
+            probe.phase("merge")
+        return list(scores.items())
+    def __call__(self, data_manager, user):
+        best = heapq.nlargest(self.recommendation_count, self._candidates(data_manager, user),
+                              key=lambda x: (x[1], x[0].rating, -x[0].movie_id))
+        if self._probe:
+            self._probe.phase("sort")
+        return [film for film, _ in best]
+    def iter_films(self, data_manager, user):
+        candidates = self._candidates(data_manager, user)
+        return (film for film, _ in _iter_largest(candidates, lambda x: (x[1], x[0].rating, -x[0].movie_id)))
+    def get_description(self):
+        return "Рекомендует фильмы, похожие на те, что пользователь высоко оценил"
+
+class NearestNeighboursStrategy(RecommendationStrategy):
+    uses_all_ratings = True
     def __init__(self):
+        super().__init__("Ближайшие соседи")
+    def _candidates(self, data_manager, user):
+        if user.user_id not in data_manager._users:
+            return []
+        probe = self._probe
+        neighbours = data_manager.get_neighbours(user)
+        if probe:
+            probe.phase("candidates")
+        # Непросмотренные - разность множеств ключей на стороне C, а не проверка каждого фильма;
+        # порядок кандидатов не важен, суммы по фильму копятся в том же порядке соседей
+        watched = user.watched_films.keys()
+        weighted = defaultdict(float)
+        weights = defaultdict(float)
+        for other_id, similarity in neighbours:
+            watched_films = data_manager._users[other_id].watched_films
+            if probe:
+                probe.scan(len(watched_films))
+            for film in watched_films.keys() - watched:
+                weighted[film] += similarity * watched_films[film]
+                weights[film] += similarity
+        predicted = [(film, weighted[film] / weights[film]) for film in weighted]
+        if probe:
+            probe.phase("filter")
+        return predicted
+    def __call__(self, data_manager, user):
+        best = heapq.nlargest(self.recommendation_count, self._candidates(data_manager, user),
+                              key=lambda x: (x[1], x[0].rating, -x[0].movie_id))
+        if self._probe:
+            self._probe.phase("sort")
+        return [film for film, _ in best]
+    def iter_films(self, data_manager, user):
+        predicted = self._candidates(data_manager, user)
+        return (film for film, _ in _iter_largest(predicted, lambda x: (x[1], x[0].rating, -x[0].movie_id)))
+    def get_description(self):
+        return "Рекомендует фильмы по взвешенным оценкам K самых похожих пользователей"
+
+class CommunityRatingStrategy(RecommendationStrategy):
+    uses_all_ratings = True
+    def __init__(self, min_count=1):
+        super().__init__("Выбор зрителей")
+        self._min_count = min_count  # фильмы с меньшим числом оценок пропускаются
+    def __call__(self, data_manager, user):
+        film_at = data_manager._films._film_at
+        watched = user.watched_rows
+        recommendations = []
+        scanned = 0
+        for scanned, row in enumerate(data_manager.iter_rows_by_community(self._min_count), 1):
+            if row not in watched:
+                recommendations.append(film_at(row))
+                if len(recommendations) == self.recommendation_count:
+                    break
+        if self._probe:
+            self._probe.phase("walk")
+            self._probe.scan(scanned)
+        return recommendations
+    def iter_films(self, data_manager, user):
+        film_at = data_manager._films._film_at
+        watched = user.watched_rows
+        for row in data_manager.iter_rows_by_community(self._min_count):
+            if row not in watched:
+                yield film_at(row)
+    def get_description(self):
+        return "Рекомендует фильмы, которые выше всего оценивают пользователи системы"
+
+class MatrixFactorizationStrategy(RecommendationStrategy):
+    uses_all_ratings = True
+    def __init__(self, factors=16, iterations=10, regularization=0.1):
+        super().__init__("Скрытые факторы")
+        self._factors = factors
+        self._iterations = iterations
+        self._regularization = regularization
+        self._fallback = CommunityRatingStrategy()  # пока модель обучается
+    def _model(self, data_manager):
+        model = data_manager.get_factor_model(self._factors, self._iterations, self._regularization)
+        if model is None:
+            self._fallback.recommendation_count = self.recommendation_count
+        return model
+    def __call__(self, data_manager, user):
+        probe = self._probe
+        model = self._model(data_manager)
+        if model is None:
+            return self._fallback(data_manager, user)
+        vector = model.user_vector(data_manager, user)
+        if probe:
+            probe.phase("fold_in")
+        film_cols = data_manager._ratings._film_cols
+        exclude = {film_cols.get(film._id) for film in user.watched_films}
+        films, col_films = data_manager._films, data_manager._ratings._col_films
+        best, scanned = model.top(vector, self.recommendation_count, exclude)
+        if probe:
+            probe.phase("score")
+            probe.scan(scanned)
+        return [films[col_films[col]] for col, _ in best]
+    def iter_films(self, data_manager, user):
+        # Следующие страницы - тот же top с удвоенным count: перебор по норме всё равно останавливается рано
+        model = self._model(data_manager)
+        if model is None:
+            yield from self._fallback.iter_films(data_manager, user)
+            return
+        vector = model.user_vector(data_manager, user)
+        film_cols = data_manager._ratings._film_cols
+        exclude = {film_cols.get(film._id) for film in user.watched_films}
+        films, col_films = data_manager._films, data_manager._ratings._col_films
+        shown, count = 0, self.recommendation_count
+        while True:
+            best, _ = model.top(vector, count, exclude)
+            for col, _ in best[shown:]:
+                yield films[col_films[col]]
+            if len(best) < count:
+                return
+            shown, count = count, count * 2
+    def get_description(self):
+        return ("Рекомендует фильмы по скрытым факторам, найденным разложением матрицы оценок (ALS); "
+                "пока модель обучается - по оценкам зрителей")
+
+class HybridStrategy(RecommendationStrategy):
+    uses_all_ratings = True
+    DEFAULT_WEIGHTS = {"genre": 0.3, "rating": 0.2, "similar": 0.2, "knn": 0.3}
+    def __init__(self, weights=None, candidate_pool=50):
+        super().__init__("Смешанная")
+        self.weights = dict(self.DEFAULT_WEIGHTS if weights is None else weights)
+        self._candidate_pool = candidate_pool  # сколько фильмов из топа по рейтингу идёт в смесь
+        self._components = {
+            "genre": GenreBasedStrategy(),
+            "rating": RatingBasedStrategy(),
+            "similar": SimilarUsersStrategy(),
+            "knn": NearestNeighboursStrategy(),
+        }
+    def __call__(self, data_manager, user):
+        return self._blend(data_manager, user)[0]["hybrid"]
+    def run_all(self, data_manager, user, components=None):
+        return self._blend(data_manager, user, components)[0]
+    def iter_films(self, data_manager, user):
+        _, scores = self._blend(data_manager, user)
+        return _iter_largest(list(scores), lambda f: (scores[f], f.rating, -f.movie_id))
+    def _blend(self, data_manager, user, components=None):
+        # Все базовые стратегии и их смесь за один проход: фильтры применяются к каждому
+        # кандидату один раз, сходства пользователей считаются один раз и для similar, и для knn.
+        # components - стратегии, с которых берутся recommendation_count и exact_compat (по умолчанию свои).
+        # Возвращает {"genre": [...], "rating": [...], "similar": [...], "knn": [...], "hybrid": [...]}
+        components = components or self._components
+        count = lambda name: (components.get(name) or self._components[name]).recommendation_count
+        probe = self._probe
+        films = data_manager._films
+        watched = user.watched_rows
+        weights = self.weights
+        scores = defaultdict(float)  # фильм -> смешанная оценка
+        results = {}
+
+        genre_matches = []
+        preferred_genres = user.preferred_genres
+        if preferred_genres:
+            weight = weights.get("genre", 0.0) / len(preferred_genres)
+            for genre_count, rows in data_manager.match_genre_tiers(preferred_genres, _watched_rows_of(user)):
+                for row in rows:
+                    film = films._film_at(row)
+                    genre_matches.append((film, genre_count))
+                    scores[film] += weight * genre_count
+        results["genre"] = [film for film, _ in heapq.nlargest(
+            count("genre"), genre_matches, key=lambda x: (x[1], x[0].rating, -x[0].movie_id))]
+        if probe:
+            probe.phase("genre")
+            probe.scan(len(genre_matches))
+
+        top_rated = []
+        limit = max(count("rating"), self._candidate_pool)
+        for row in data_manager.iter_rows_by_rating():
+            if row not in watched:
+                top_rated.append(films._film_at(row))
+                if len(top_rated) == limit:
+                    break
+        results["rating"] = top_rated[:count("rating")]
+        for film in top_rated:
+            scores[film] += 0.0  # рейтинг добавится ниже всем кандидатам сразу
+        if probe:
+            probe.phase("rating")
+
+        exact_compat = getattr(components.get("similar"), "_exact_compat", False)
+        similarities = data_manager.get_user_similarities(user, exact_compat)
+        similar = []
+        if similarities:
+            most_similar_id, _ = max(similarities, key=lambda x: x[1])
+            most_similar = data_manager._users[most_similar_id].watched_films
+            similar = [film for film, rating in most_similar.items() if rating >= 8.0 and film._row not in watched]
+            similar.sort(key=lambda f: most_similar[f], reverse=True)
+            weight = weights.get("similar", 0.0) / 10
+            for film in similar:
+                scores[film] += weight * most_similar[film]
+        results["similar"] = similar[:count("similar")]
+        if probe:
+            probe.phase("similar")
+            probe.scan(len(similarities))
+
+        predicted = []
+        if user.user_id in data_manager._users:
+            # точные сходства совпадают с теми, из которых строится таблица соседей
+            neighbours = data_manager.get_neighbours(user, None if exact_compat else similarities)
+            weighted = defaultdict(float)
+            totals = defaultdict(float)
+            seen = user.watched_films.keys()  # как в NearestNeighboursStrategy - разностью множеств
+            for other_id, similarity in neighbours:
+                other_films = data_manager._users[other_id].watched_films
+                for film in other_films.keys() - seen:
+                    weighted[film] += similarity * other_films[film]
+                    totals[film] += similarity
+            weight = weights.get("knn", 0.0) / 10
+            for film, total in weighted.items():
+                predicted.append((film, total / totals[film]))
+                scores[film] += weight * total / totals[film]
+        results["knn"] = [film for film, _ in heapq.nlargest(
+            count("knn"), predicted, key=lambda x: (x[1], x[0].rating, -x[0].movie_id))]
+        if probe:
+            probe.phase("knn")
+
+        weight = weights.get("rating", 0.0) / 10
+        for film in scores:
+            scores[film] += weight * film.rating
+        results["hybrid"] = heapq.nlargest(self.recommendation_count, scores,
+                                           key=lambda f: (scores[f], f.rating, -f.movie_id))
+        if probe:
+            probe.phase("blend")
+            probe.scan(len(scores))
+        return results, scores
+    def get_description(self):
+        weights = ", ".join(f"{name} {weight:g}" for name, weight in self.weights.items())
+        return f"Смешивает оценки всех стратегий с весами ({weights})"
+
+def _recommend_chunk(context, user_ids):
+    # context - (сервис, data_manager, стратегии); в процессах-воркерах он достаётся
+    # через fork копией страниц памяти, без pickle каталога
+    service, data_manager, strategy_names = context
+    results = []
+    with data_manager.reading():
+        for user_id in user_ids:
+            user = data_manager._users[user_id]
+            results.append((user_id, {
+                name: [film.movie_id for film in service._strategies[name](data_manager, user)]
+                for name in strategy_names
+            }))
+    return results
+
+class RecommendationService:
+    def __init__(self, cache_size=1024, cache_ttl=300.0, metrics: Optional[Metrics] = None, cursor_ttl=120.0):
         self._strategies: Dict[str, RecommendationStrategy] = {}
         self._register_strategies()
+        self._cache = ResultCache(cache_size, cache_ttl) if cache_size else None
+        self._cursors = CursorStore(cursor_ttl)
+        self.metrics = metrics  # None - метрики выключены
     def _register_strategies(self):
         self._strategies["genre"] = GenreBasedStrategy()
         self._strategies["rating"] = RatingBasedStrategy()
         self._strategies["similar"] = SimilarUsersStrategy()
+        self._strategies["item"] = SimilarFilmsStrategy()
+        self._strategies["knn"] = NearestNeighboursStrategy()
+        self._strategies["community"] = CommunityRatingStrategy()
+        self._strategies["als"] = MatrixFactorizationStrategy()
+        self._strategies["hybrid"] = HybridStrategy()
     @property
     def available_strategies(self):
         return list(self._strategies.keys())
+    @property
+    def cache_stats(self):
+        return self._cache.stats if self._cache is not None else None
+    def _cache_key(self, strategy_name, strategy, data_manager, user):
+        return (strategy_name, id(data_manager), user.user_id, strategy.recommendation_count)
+    def _data_versions(self, strategy, data_manager, user):
+        ratings_version = data_manager._ratings_version if strategy.uses_all_ratings else None
+        return (data_manager, data_manager._catalog_version, user.version, ratings_version)
     def create_recommendation(self, strategy_name: str, data_manager, user):
         if strategy_name not in self._strategies:
             raise ValueError(f"Стратегия '{strategy_name}' не найдена. Доступны: {self.available_strategies}") 
         strategy = self._strategies[strategy_name]
-        films = strategy(data_manager, user)
-        return RecommendationResult(films, strategy.name)
-    def get_all_recommendations(self, data_manager, user):
+        # Версии и сами данные читаются под одной блокировкой, чтобы результат им соответствовал
+        with data_manager.reading():
+            if self._cache is None:
+                return RecommendationResult(self._run_strategy(strategy_name, data_manager, user), strategy.name)
+            key = self._cache_key(strategy_name, strategy, data_manager, user)
+            versions = self._data_versions(strategy, data_manager, user)
+            films = self._cache.get(key, versions)
+            if films is None:
+                films = self._run_strategy(strategy_name, data_manager, user)
+                self._cache.put(key, versions, films)
+            return RecommendationResult(list(films), strategy.name)
+    def _run_strategy(self, strategy_name, data_manager, user):
+        strategy = self._strategies[strategy_name]
+        if self.metrics is None:
+            return strategy(data_manager, user)
+        return self.metrics.observe(strategy_name, strategy, lambda: strategy(data_manager, user))
+    def recommend_page(self, strategy_name: str, data_manager, user, page_size=None, cursor=None):
+        # Страница рекомендаций из ленивого потока стратегии (iter_films). Следующую страницу
+        # даёт токен result.cursor предыдущей: поток продолжается с того же места, первые страницы
+        # не пересчитываются. Если данные с тех пор изменились, поток открывается заново, а уже
+        # выданные фильмы пропускаются. У последней страницы cursor - None.
+        if strategy_name not in self._strategies:
+            raise ValueError(f"Стратегия '{strategy_name}' не найдена. Доступны: {self.available_strategies}")
+        strategy = self._strategies[strategy_name]
+        page_size = page_size or strategy.recommendation_count
+        if page_size < 1:
+            raise ValueError("Размер страницы должен быть положительным")
+        key = (strategy_name, id(data_manager), user.user_id)
+        state = None
+        if cursor is not None:
+            state = self._cursors.take(cursor)
+            if state is None:
+                raise ValueError("Курсор не найден или истёк")
+            if state.key != key:
+                raise ValueError("Курсор выдан для другого запроса")
+        with data_manager.reading():
+            versions = self._data_versions(strategy, data_manager, user)
+            if state is None:
+                state = _PageCursor(key, versions, strategy.iter_films(data_manager, user), [], set())
+            elif state.versions != versions:
+                served = state.served
+                films = strategy.iter_films(data_manager, user)
+                state.versions, state.films, state.pending = versions, (f for f in films if f not in served), []
+            page = state.pending + list(islice(state.films, page_size + 1 - len(state.pending)))
+        state.pending = page[page_size:]
+        page = page[:page_size]
+        state.served.update(page)
+        token = self._cursors.put(state) if state.pending else None
+        return RecommendationResult(page, strategy.name, cursor=token)
+    @property
+    def cursor_stats(self):
+        return self._cursors.stats
+    def get_all_recommendations(self, data_manager, user, single_pass=True):
+        # single_pass - посчитать все стратегии, которые умеет HybridStrategy, одним проходом
+        # (режим "all"); остальные зарегистрированные стратегии считаются как обычно.
+        hybrid = self._strategies.get("hybrid")
+        if not single_pass or not isinstance(hybrid, HybridStrategy):
+            return {
+                name: self.create_recommendation(name, data_manager, user)
+                for name in self.available_strategies
+            }
+        with data_manager.reading():
+            return self._all_single_pass(hybrid, data_manager, user)
+    def _all_single_pass(self, hybrid, data_manager, user):
+        shared = [name for name in self.available_strategies if name in hybrid._components or name == "hybrid"]
+        lists = {}
+        if self._cache is not None:
+            for name in shared:
+                strategy = self._strategies[name]
+                films = self._cache.get(self._cache_key(name, strategy, data_manager, user),
+                                        self._data_versions(strategy, data_manager, user))
+                if films is not None:
+                    lists[name] = films
+        if len(lists) < len(shared):
+            call = lambda: hybrid.run_all(data_manager, user, components=self._strategies)
+            count = lambda computed: sum(map(len, computed.values()))  # все фильмы всех стратегий
+            computed = call() if self.metrics is None else self.metrics.observe("all", hybrid, call, count)
+            for name in shared:
+                if name not in lists:
+                    lists[name] = computed[name]
+                    if self._cache is not None:
+                        strategy = self._strategies[name]
+                        self._cache.put(self._cache_key(name, strategy, data_manager, user),
+                                        self._data_versions(strategy, data_manager, user), lists[name])
         return {
-            name: self.create_recommendation(name, data_manager, user)
+            name: RecommendationResult(list(lists[name]), self._strategies[name].name) if name in lists
+            else self.create_recommendation(name, data_manager, user)
             for name in self.available_strategies
         }
+    def recommend_batch(self, strategy_names, user_ids, data_manager, processes=None, chunk_size=256):
+        # Рекомендации для многих пользователей: пользователи режутся на пачки и раздаются пулу процессов.
+        # Возвращает генератор (user_id, {стратегия: RecommendationResult}) в порядке готовности.
+        strategy_names = list(strategy_names)
+        for name in strategy_names:
+            if name not in self._strategies:
+                raise ValueError(f"Стратегия '{name}' не найдена. Доступны: {self.available_strategies}")
+        if chunk_size < 1:
+            raise ValueError("Размер пачки должен быть положительным")
+        return self._iter_batch((self, data_manager, strategy_names), user_ids, processes, chunk_size)
+    def _iter_batch(self, context, user_ids, processes, chunk_size):
+        user_ids = iter(user_ids)
+        chunks = iter(lambda: list(islice(user_ids, chunk_size)), [])
+        data_manager = context[1]
+        for chunk in _run_forked(_recommend_chunk, context, chunks, processes, data_manager):
+            for user_id, film_ids in chunk:
+                yield user_id, {
+                    name: RecommendationResult([data_manager._films[i] for i in ids], self._strategies[name].name)
+                    for name, ids in film_ids.items()
+                }
     def __getitem__(self, strategy_name: str):
         return self._strategies[strategy_name]  
     def __str__(self):
         strategies = "\n".join([f"  - {s}" for s in self.available_strategies])
         return f"Сервис по рекомендациям со стратегиями:\n{strategies}"
 
+@dataclass
+class _StoredRecommendations:
+    user_version: int  # user.version, на которой посчитан результат
+    catalog_version: int  # DataManager._catalog_version на момент расчёта
+    computed_at: float  # time.monotonic() момента расчёта
+    results: dict  # стратегия -> RecommendationResult
+
+class RecommendationStore:
+    # Готовые результаты get_all_recommendations для активных пользователей. Запрос берёт результат
+    # отсюда, а при промахе считает его вживую и кладёт сюда же. Фоновый планировщик пересчитывает
+    # сначала пользователей, чьи оценки изменились (их отмечает DataManager), затем недавно активных
+    # без результата и, наконец, самые старые результаты и посчитанные до изменений каталога - такие
+    # не выдаются. Чужие оценки результат не сбрасывают: он стареет и уходит по max_staleness, иначе
+    # под потоком записей хранилище почти всегда промахивалось бы. Пересчёт занимает не больше доли
+    # budget времени, чтобы не отнимать процессор у запросов.
+    def __init__(self, service, data_manager, capacity=1000, max_staleness=60.0, refresh_after=None,
+                 interval=0.5, budget=0.25):
+        if capacity < 1:
+            raise ValueError("Размер хранилища должен быть положительным")
+        if not 0 < budget <= 1:
+            raise ValueError("budget должен быть в (0, 1]")
+        self._service = service
+        self._data_manager = data_manager
+        self._capacity = capacity  # сколько активных пользователей отслеживается и хранится
+        self._max_staleness = max_staleness  # секунды: более старый результат не выдаётся
+        self._refresh_after = max_staleness / 2 if refresh_after is None else refresh_after
+        self._interval = interval
+        self._budget = budget
+        self._entries = OrderedDict()  # user_id -> _StoredRecommendations, от старых расчётов к новым
+        self._activity = OrderedDict()  # user_id -> момент последнего запроса, от давних к недавним
+        self._missing = OrderedDict()  # активные пользователи без результата
+        self._dirty = OrderedDict()  # user_id -> момент первой необработанной отметки
+        self._lock = threading.Lock()
+        _register_fork_reset(self)
+        self._wakeup = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+        self.hits = 0
+        self.misses = 0
+        self.refreshes = 0
+        self.evictions = 0
+        self.refresh_seconds = 0.0
+        self._served_age_total = 0.0
+        self._served_age_max = 0.0
+        self._lags = deque(maxlen=1000)  # секунды от отметки dirty до готового результата
+        data_manager.add_rating_listener(self._mark_dirty)
+
+    def _after_fork(self):
+        # Фоновый поток остался в родителе
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _mark_dirty(self, user_id):
+        # Вызывается DataManager под блокировкой записи, поэтому только отмечает и будит планировщик.
+        # Оценка - не запрос: неотслеживаемого пользователя она активным не делает
+        with self._lock:
+            if user_id not in self._activity:
+                return
+            self._dirty.setdefault(user_id, time.monotonic())
+        self._wakeup.set()
+
+    def _track(self, user_id, now):
+        self._activity[user_id] = now
+        self._activity.move_to_end(user_id)
+        if user_id not in self._entries:
+            self._missing[user_id] = now
+        while len(self._activity) > self._capacity:
+            old_id, _ = self._activity.popitem(last=False)
+            self._missing.pop(old_id, None)
+            self._dirty.pop(old_id, None)
+            if self._entries.pop(old_id, None) is not None:
+                self.evictions += 1
+
+    def _store(self, user_id, versions, started, results):
+        now = time.monotonic()
+        with self._lock:
+            if user_id not in self._activity:
+                return  # пользователь вытеснен, пока шёл расчёт
+            self._entries[user_id] = _StoredRecommendations(*versions, now, results)
+            self._entries.move_to_end(user_id)
+            self._missing.pop(user_id, None)
+            marked_at = self._dirty.get(user_id)
+            if marked_at is not None and marked_at <= started:
+                # отметки после начала расчёта остаются: результат их уже может не учитывать
+                del self._dirty[user_id]
+                self._lags.append(now - marked_at)
+
+    def _compute(self, user):
+        started = time.monotonic()
+        data_manager = self._data_manager
+        with data_manager.reading():
+            versions = (user.version, data_manager._catalog_version)
+            results = self._service.get_all_recommendations(data_manager, user)
+        self._store(user.user_id, versions, started, results)
+        return results
+
+    def _current(self, entry):
+        return entry.catalog_version == self._data_manager._catalog_version
+
+    def _fresh(self, user, now):
+        entry = self._entries.get(user.user_id)
+        if (entry is None or entry.user_version != user.version or user.user_id in self._dirty
+                or now - entry.computed_at > self._max_staleness or not self._current(entry)):
+            return None
+        age = now - entry.computed_at
+        self._served_age_total += age
+        self._served_age_max = max(self._served_age_max, age)
+        return entry.results
+
+    def get_all_recommendations(self, user):
+        # {стратегия: RecommendationResult}, как у RecommendationService.get_all_recommendations
+        now = time.monotonic()
+        with self._lock:
+            self._track(user.user_id, now)
+            results = self._fresh(user, now)
+            if results is not None:
+                self.hits += 1
+            else:
+                self.misses += 1
+        if results is None:
+            results = self._compute(user)
+        return {name: RecommendationResult(list(result.films), result.strategy_name) for name, result in results.items()}
+
+    def create_recommendation(self, strategy_name, user):
+        # Одна стратегия из готового результата; при промахе считается только она, без записи сюда
+        now = time.monotonic()
+        with self._lock:
+            self._track(user.user_id, now)
+            results = self._fresh(user, now)
+            if results is not None and strategy_name in results:
+                self.hits += 1
+                result = results[strategy_name]
+                return RecommendationResult(list(result.films), result.strategy_name)
+            self.misses += 1
+        return self._service.create_recommendation(strategy_name, self._data_manager, user)
+
+    def _next_refresh(self, now):
+        # (user_id, момент отметки dirty или None): сначала изменившиеся, потом без результата, потом старые
+        with self._lock:
+            if self._dirty:
+                return next(iter(self._dirty.items()))
+            if self._missing:
+                user_id, _ = self._missing.popitem(last=True)  # недавно активные первыми
+                return user_id, None
+            if self._entries:
+                # Первый результат - самый старый, в том числе по версиям данных
+                user_id, entry = next(iter(self._entries.items()))
+                if now - entry.computed_at >= self._refresh_after or not self._current(entry):
+                    self._entries.move_to_end(user_id)  # не выбирать его снова, если расчёт упадёт
+                    return user_id, None
+        return None
+
+    def refresh(self, time_budget=None):
+        # Пересчитывает очередь, пока не кончится time_budget секунд (None - вся очередь).
+        # Возвращает число пересчитанных пользователей.
+        started = time.monotonic()
+        done = 0
+        while time_budget is None or time.monotonic() - started < time_budget:
+            item = self._next_refresh(time.monotonic())
+            if item is None:
+                break
+            user_id, marked_at = item
+            user = self._data_manager._users.get(user_id)
+            if user is None:
+                with self._lock:
+                    self._dirty.pop(user_id, None)
+                    self._activity.pop(user_id, None)
+                    self._entries.pop(user_id, None)
+                continue
+            try:
+                self._compute(user)
+            except Exception:
+                with self._lock:
+                    self._dirty.pop(user_id, None)  # иначе этот пользователь занял бы всю очередь
+                raise
+            done += 1
+        with self._lock:
+            self.refreshes += done
+            self.refresh_seconds += time.monotonic() - started
+        return done
+
+    def start(self):
+        if self._thread is None:
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="recommendation-store", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self):
+        while not self._stop.is_set():
+            started = time.monotonic()
+            try:
+                self.refresh(self._interval * self._budget)
+            except Exception as e:
+                print(f"Ошибка фонового пересчёта рекомендаций: {e!r}", file=sys.stderr)
+            busy = time.monotonic() - started
+            # Пауза после работы держит долю пересчёта не выше budget, даже если один расчёт вышел дольше
+            if self._stop.wait(busy * (1 - self._budget) / self._budget):
+                break
+            self._wakeup.wait(self._interval)
+            self._wakeup.clear()
+
+    @property
+    def stats(self):
+        now = time.monotonic()
+        with self._lock:
+            ages = [now - entry.computed_at for entry in self._entries.values()]
+            lags = sorted(self._lags)
+            pending_lag = now - next(iter(self._dirty.values())) if self._dirty else 0.0
+            requests = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "tracked": len(self._activity),
+                "capacity": self._capacity,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / requests if requests else 0.0,
+                "evictions": self.evictions,
+                "refreshes": self.refreshes,
+                "refresh_seconds": self.refresh_seconds,
+                "dirty": len(self._dirty),
+                "missing": len(self._missing),
+                "staleness_mean_s": sum(ages) / len(ages) if ages else 0.0,
+                "staleness_max_s": max(ages, default=0.0),
+                "served_age_mean_s": self._served_age_total / self.hits if self.hits else 0.0,
+                "served_age_max_s": self._served_age_max,
+                "refresh_lag_p50_s": lags[len(lags) // 2] if lags else 0.0,
+                "refresh_lag_p95_s": lags[int(len(lags) * 0.95)] if lags else 0.0,
+                "refresh_lag_max_s": lags[-1] if lags else 0.0,
+                "pending_lag_s": pending_lag,
+            }
+
+# Шарды: пользователи поделены по user_id % shard_count между процессами, каталог фильмов есть
+# в каждом процессе целиком. Процессы создаются через fork и общаются с родителем по Pipe
+# сообщениями (операция, аргументы) -> (успех, ответ или исключение).
+
+class _Shard:
+    # Обработчики запросов внутри процесса шарда; аргументы и ответы - простые типы, которые идут через Pipe
+    def __init__(self, data_manager):
+        self.data_manager = data_manager
+        self.service = RecommendationService(cache_size=0)
+    def add_film(self, film_id, title, genres, director, year, rating):
+        self.data_manager.add_film(Film(film_id, title, [Genres(g) for g in genres], director, year, rating))
+    def add_user(self, user_id, user_name, genres, ratings):
+        films = self.data_manager._films
+        watched = {films[film_id]: rating for film_id, rating in ratings}
+        self.data_manager.add_user(User(user_id, user_name, watched, [Genres(g) for g in genres]))
+    def rate(self, user_id, film_id, rating):
+        self.data_manager._users[user_id].add_watched_film(self.data_manager._films[film_id], rating)
+    def set_genres(self, user_id, genres):
+        self.data_manager._users[user_id].preferred_genres = [Genres(g) for g in genres]
+    def ratings(self, user_ids):
+        # {user_id: [(film_id, оценка)]} в порядке оценок пользователя
+        users = self.data_manager._users
+        return {user_id: [(film._id, rating) for film, rating in users[user_id].watched_films.items()]
+                for user_id in user_ids}
+    def neighbours(self, ratings, exclude_user_id, count):
+        # count самых похожих своих пользователей; при равном сходстве - с меньшим user_id
+        similarities = self.data_manager._ratings.similarities(dict(ratings), exclude_user_id)
+        return heapq.nlargest(count, similarities, key=_neighbour_order)
+    def recommend(self, strategy_name, user_id, count):
+        strategy = self.service[strategy_name]
+        strategy.recommendation_count = count
+        user = self.data_manager._users[user_id]
+        return [film._id for film in strategy(self.data_manager, user)]
+    def stats(self):
+        return {"users": len(self.data_manager._users),
+                "ratings": sum(len(row) for row in self.data_manager._ratings._rows)}
+
+def _shard_main(conn, shard, shard_count, data_manager, source):
+    # data_manager - копия каталога родителя, доставшаяся через fork; из source берутся только свои пользователи
+    if source is not None:
+        films = data_manager._films
+        for user_id, user in source._users.items():
+            if user_id % shard_count == shard:
+                watched = {films[film._id]: rating for film, rating in user.watched_films.items()}
+                data_manager.add_user(User(user_id, user.user_name, watched, list(user.preferred_genres)))
+    handler = _Shard(data_manager)
+    while True:
+        try:
+            op, args = conn.recv()
+        except EOFError:
+            return
+        if op == "stop":
+            conn.send((True, None))
+            return
+        try:
+            conn.send((True, getattr(handler, op)(*args)))
+        except Exception as e:
+            conn.send((False, e))
+
+class ShardedDataManager:
+    # Пользователи и их оценки живут в shard_count процессах-шардах, поэтому число пользователей
+    # ограничено памятью всех шардов, а не одного процесса. Изменения пользователя уходят в его шард,
+    # поиск похожих пользователей рассылается всем шардам сразу, и их топ-K сливается здесь.
+    # Стратегии без uses_all_ratings считаются целиком в шарде пользователя; similar и knn -
+    # рассылкой; остальным нужны оценки всех пользователей в одном процессе, и здесь их нет.
+    def __init__(self, shard_count=4, source: DataManager = None, neighbour_count=20):
+        # source - DataManager, из которого берутся каталог и пользователи; после запуска он не нужен
+        if shard_count < 1:
+            raise ValueError("Число шардов должно быть положительным")
+        self._shard_count = shard_count
+        self._neighbour_count = neighbour_count  # K для knn, как NeighbourTable.size
+        self._catalog = DataManager()  # каталог без пользователей: фильтры и объекты Film для ответов
+        self._strategies = RecommendationService(cache_size=0)  # только чтобы знать uses_all_ratings
+        if source is not None:
+            for film in source._films.values():
+                self._catalog.add_film(Film(film._id, film.title, film.genres, film.director, film.year, film.rating))
+        context = multiprocessing.get_context("fork")
+        self._connections = []
+        self._processes = []
+        self._locks = [threading.Lock() for _ in range(shard_count)]
+        with source.reading() if source is not None else nullcontext():
+            for shard in range(shard_count):
+                parent_conn, child_conn = context.Pipe()
+                process = context.Process(target=_shard_main, daemon=True,
+                                          args=(child_conn, shard, shard_count, self._catalog, source))
+                process.start()
+                child_conn.close()
+                self._connections.append(parent_conn)
+                self._processes.append(process)
+    @property
+    def shard_count(self):
+        return self._shard_count
+    def shard_of(self, user_id):
+        return user_id % self._shard_count
+    def _scatter(self, requests):
+        # {шард: (операция, аргументы)} -> {шард: ответ}. Сначала запросы уходят всем, потом
+        # собираются ответы, так что шарды работают параллельно. Блокировки берутся по порядку номеров.
+        shards = sorted(requests)
+        for shard in shards:
+            self._locks[shard].acquire()
+        try:
+            for shard in shards:
+                self._connections[shard].send(requests[shard])
+            replies = {shard: self._connections[shard].recv() for shard in shards}
+        finally:
+            for shard in shards:
+                self._locks[shard].release()
+        for ok, result in replies.values():
+            if not ok:
+                raise result
+        return {shard: result for shard, (_, result) in replies.items()}
+    def _call(self, shard, op, *args):
+        return self._scatter({shard: (op, args)})[shard]
+    def _broadcast(self, op, *args):
+        return self._scatter({shard: (op, args) for shard in range(self._shard_count)})
+    def add_film(self, film: Film):
+        if film._id in self._catalog._films:
+            print(f"Фильм с ID {film._id} уже существует.")
+            return
+        fields = (film._id, film.title, [genre.value for genre in film.genres], film.director, film.year, film.rating)
+        self._catalog.add_film(film)
+        self._broadcast("add_film", *fields)
+    def add_user(self, user: User):
+        ratings = [(film._id, rating) for film, rating in user.watched_films.items()]
+        self._call(self.shard_of(user._id), "add_user", user._id, user.user_name,
+                   [genre.value for genre in user.preferred_genres], ratings)
+    def add_watched_film(self, user_id, film_id, rating):
+        if film_id not in self._catalog._films:
+            raise ValueError(f"Фильм {film_id} не найден.")
+        self._call(self.shard_of(user_id), "rate", user_id, film_id, rating)
+    def set_preferred_genres(self, user_id, genres):
+        self._call(self.shard_of(user_id), "set_genres", user_id, [genre.value for genre in genres])
+    def get_film(self, film_id):
+        return self._catalog._films[film_id]
+    def _get_ratings(self, user_ids):
+        by_shard = defaultdict(list)
+        for user_id in user_ids:
+            by_shard[self.shard_of(user_id)].append(user_id)
+        ratings = {}
+        for reply in self._scatter({shard: ("ratings", (ids,)) for shard, ids in by_shard.items()}).values():
+            ratings.update(reply)
+        return ratings
+    def get_user_ratings(self, user_id):
+        return dict(self._get_ratings([user_id])[user_id])
+    def _neighbours(self, user_id, ratings, count):
+        replies = self._broadcast("neighbours", ratings, user_id, count)
+        return heapq.nlargest(count, (n for reply in replies.values() for n in reply), key=_neighbour_order)
+    def get_neighbours(self, user_id, count=None):
+        # [(user_id, сходство)] самых похожих пользователей всех шардов
+        ratings = self._get_ratings([user_id])[user_id]
+        return self._neighbours(user_id, ratings, count or self._neighbour_count)
+    def recommend(self, strategy_name, user_id, count=5):
+        # Фильмы каталога, как у одноимённой стратегии RecommendationService для одного DataManager
+        strategy = self._strategies[strategy_name]
+        if strategy_name == "similar":
+            film_ids = self._recommend_similar(user_id, count)
+        elif strategy_name == "knn":
+            film_ids = self._recommend_knn(user_id, count)
+        elif strategy.uses_all_ratings:
+            raise ValueError(f"Стратегии {strategy_name} нужны оценки всех пользователей, с шардами она недоступна")
+        else:
+            film_ids = self._call(self.shard_of(user_id), "recommend", strategy_name, user_id, count)
+        films = self._catalog._films
+        return [films[film_id] for film_id in film_ids]
+    def _recommend_similar(self, user_id, count):
+        # Как SimilarUsersStrategy: высокие оценки самого похожего пользователя
+        ratings = self._get_ratings([user_id])[user_id]
+        neighbours = self._neighbours(user_id, ratings, 1)
+        if not neighbours:
+            return []
+        other_id = neighbours[0][0]
+        watched = {film_id for film_id, _ in ratings}
+        ranked = [(film_id, rating) for film_id, rating in self._get_ratings([other_id])[other_id]
+                  if film_id not in watched and rating >= 8.0]
+        ranked.sort(key=lambda x: x[1], reverse=True)
+        return [film_id for film_id, _ in ranked[:count]]
+    def _recommend_knn(self, user_id, count):
+        # Как NearestNeighboursStrategy: соседи со всех шардов, их оценки - одним запросом на шард
+        ratings = self._get_ratings([user_id])[user_id]
+        neighbours = self._neighbours(user_id, ratings, self._neighbour_count)
+        neighbour_ratings = self._get_ratings([other_id for other_id, _ in neighbours])
+        watched = {film_id for film_id, _ in ratings}
+        weighted = defaultdict(float)
+        weights = defaultdict(float)
+        for other_id, similarity in neighbours:
+            for film_id, rating in neighbour_ratings[other_id]:
+                if film_id not in watched:
+                    weighted[film_id] += similarity * rating
+                    weights[film_id] += similarity
+        films = self._catalog._films
+        return heapq.nlargest(count, weighted, key=lambda f: (weighted[f] / weights[f], films[f].rating, -f))
+    def stats(self):
+        # [{"users": ..., "ratings": ...}] по шардам
+        replies = self._broadcast("stats")
+        return [replies[shard] for shard in range(self._shard_count)]
+    def close(self):
+        for shard, conn in enumerate(self._connections):
+            try:
+                self._call(shard, "stop")
+            except (EOFError, OSError):
+                pass
+            conn.close()
+        for process in self._processes:
+            process.join(5)
+            if process.is_alive():
+                process.terminate()
+        self._connections, self._processes = [], []
+    def __enter__(self):
+        return self
+    def __exit__(self, *exc):
+        self.close()
+
 # test
 # dm = DataManager()
 # dm.load_sample_data()
@@ -0,0 +1,42 @@
+import importlib.machinery
+import importlib.util
+import os
+import random
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+@pytest.fixture(scope="session")
+def gui():
+    # Консольное приложение лежит в файле без расширения .py, поэтому грузится по пути
+    loader = importlib.machinery.SourceFileLoader("gui_end_part", os.path.join(ROOT, "GUI(END PART)"))
+    spec = importlib.util.spec_from_loader(loader.name, loader)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[loader.name] = module  # функции для пула процессов сериализуются по имени модуля
+    loader.exec_module(module)
+    return module
+
+
+def build_data_manager(module, films=300, users=60, ratings_per_user=15, seed=0):
+    rnd = random.Random(seed)
+    genres = list(module.Genres)
+    data_manager = module.DataManager()
+    for film_id in range(1, films + 1):
+        data_manager.add_film(module.Film(film_id, f"Фильм {film_id}", rnd.sample(genres, rnd.randint(1, 3)),
+                                          f"Режиссёр {film_id % 40}", 1950 + film_id % 70, round(rnd.uniform(0, 10), 1)))
+    catalog = list(data_manager._films.values())
+    for user_id in range(1, users + 1):
+        user = module.User(user_id, f"user{user_id}", preferred_genres=rnd.sample(genres, rnd.randint(1, 3)))
+        data_manager.add_user(user)
+        for film in rnd.sample(catalog, ratings_per_user):
+            user.add_watched_film(film, float(rnd.randint(1, 10)))
+    return data_manager
+
+
+@pytest.fixture
+def make_data():
+    return build_data_manager
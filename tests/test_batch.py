@@ -0,0 +1,65 @@
+import threading
+
+import stepik_pandas
+from stepik_pandas import RecommendationService
+
+STRATEGIES = ["genre", "rating", "similar", "knn"]
+
+
+def film_ids(results):
+    return {user_id: {name: [film.movie_id for film in result.films] for name, result in lists.items()}
+            for user_id, lists in results}
+
+
+def test_pooled_batch_matches_single_requests(make_data):
+    data_manager = make_data(stepik_pandas)
+    service = RecommendationService(cache_size=0)
+    user_ids = list(data_manager._users)
+    pooled = film_ids(service.recommend_batch(STRATEGIES, user_ids, data_manager, processes=2, chunk_size=16))
+    serial = film_ids(service.recommend_batch(STRATEGIES, user_ids, data_manager, processes=1))
+    assert pooled == serial
+    with data_manager.reading():
+        for user_id in user_ids[:10]:
+            user = data_manager._users[user_id]
+            for name in STRATEGIES:
+                expected = service.create_recommendation(name, data_manager, user).films
+                assert pooled[user_id][name] == [film.movie_id for film in expected]
+
+
+def test_interleaved_batches_keep_their_own_context(make_data):
+    first, second = make_data(stepik_pandas, seed=1), make_data(stepik_pandas, seed=2)
+    service = RecommendationService(cache_size=0)
+    expected_first = film_ids(service.recommend_batch(["genre"], list(first._users), first, processes=1))
+    expected_second = film_ids(service.recommend_batch(["rating"], list(second._users), second, processes=1))
+    for processes in (1, 2):
+        a = service.recommend_batch(["genre"], list(first._users), first, processes=processes, chunk_size=8)
+        b = service.recommend_batch(["rating"], list(second._users), second, processes=processes, chunk_size=8)
+        got_first, got_second = [next(a)], [next(b)]
+        got_first.extend(a)
+        got_second.extend(b)
+        assert film_ids(got_first) == expected_first
+        assert film_ids(got_second) == expected_second
+
+
+def test_fork_while_another_thread_holds_lazy_lock(make_data):
+    data_manager = make_data(stepik_pandas)
+    service = RecommendationService(cache_size=0)
+    held, release = threading.Event(), threading.Event()
+
+    def hold():
+        with data_manager._lazy_lock:
+            held.set()
+            release.wait()
+
+    holder = threading.Thread(target=hold)
+    holder.start()
+    held.wait()
+    results = []
+    worker = threading.Thread(target=lambda: results.extend(
+        service.recommend_batch(["knn"], list(data_manager._users), data_manager, processes=2)))
+    worker.start()
+    worker.join(30)
+    release.set()
+    holder.join()
+    assert not worker.is_alive()
+    assert len(results) == len(data_manager._users)
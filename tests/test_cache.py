@@ -0,0 +1,67 @@
+import stepik_pandas
+from stepik_pandas import Film, Genres, RecommendationService
+
+
+def ids(result):
+    return [film.movie_id for film in result.films]
+
+
+def unwatched(data_manager, user):
+    return next(film for film in data_manager._films.values() if film not in user.watched_films)
+
+
+def test_versions_invalidate_exactly_the_affected_entries(make_data):
+    data_manager = make_data(stepik_pandas)
+    service, live = RecommendationService(), RecommendationService(cache_size=0)
+    user, other = data_manager._users[1], data_manager._users[2]
+
+    def check(name, hit):
+        before = service.cache_stats["hits"]
+        assert ids(service.create_recommendation(name, data_manager, user)) == \
+            ids(live.create_recommendation(name, data_manager, user))
+        assert service.cache_stats["hits"] - before == hit, name
+
+    for name in ("genre", "rating", "similar"):
+        check(name, 0)
+        check(name, 1)
+
+    other.add_watched_film(unwatched(data_manager, other), 9.0)  # чужая оценка: только стратегии по всем оценкам
+    check("genre", 1)
+    check("similar", 0)
+
+    changes = [
+        lambda: user.add_watched_film(unwatched(data_manager, user), 7.0),
+        lambda: setattr(user, "preferred_genres", [Genres.HORROR]),
+        lambda: data_manager.add_film(Film(999, "Новый", [Genres.HORROR], "Режиссёр", 2020, 9.9)),
+        lambda: setattr(data_manager._films[5], "rating", 9.8),
+        lambda: setattr(data_manager._films[6], "genres", [Genres.HORROR]),
+    ]
+    for change in changes:
+        change()
+        check("genre", 0)
+        check("rating", 0)
+        check("rating", 1)
+
+
+def test_lru_eviction_and_ttl(make_data):
+    data_manager = make_data(stepik_pandas)
+    service = RecommendationService(cache_size=2)
+    for user_id in (1, 2, 3, 1):
+        service.create_recommendation("rating", data_manager, data_manager._users[user_id])
+    assert service.cache_stats["evictions"] == 2 and service.cache_stats["size"] == 2
+    assert service.cache_stats["hits"] == 0
+
+    expired = RecommendationService(cache_ttl=0.0)
+    for _ in range(2):
+        expired.create_recommendation("rating", data_manager, data_manager._users[1])
+    assert expired.cache_stats["hits"] == 0 and expired.cache_stats["invalidations"] == 1
+
+
+def test_console_filters_are_part_of_the_key(gui, make_data):
+    data_manager = make_data(gui)
+    service, live = gui.RecommendationService(), gui.RecommendationService(cache_size=0)
+    user = data_manager._users[1]
+    for filters in [(0, 0, 2100), (7.0, 0, 2100), (0, 1990, 2000), (0, 0, 2100)]:
+        assert ids(service.create_recommendation("rating", data_manager, user, *filters)) == \
+            ids(live.create_recommendation("rating", data_manager, user, *filters))
+    assert service.cache_stats["hits"] == 1
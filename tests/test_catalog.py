@@ -0,0 +1,45 @@
+import pytest
+
+import stepik_pandas
+from stepik_pandas import DataManager, Film, Genres, genres_to_mask
+
+
+def test_film_is_a_view_over_catalog_columns():
+    data_manager = DataManager()
+    film = Film(7, "Фильм", [Genres.DRAMA, Genres.CRIME], "Режиссёр", 1999, 8.5)
+    assert film.genre_mask == genres_to_mask([Genres.DRAMA, Genres.CRIME])
+    data_manager.add_film(film)
+    catalog = data_manager._films
+    row = film._row
+    assert catalog[7] is film and 7 in catalog and list(catalog) == [7] and len(catalog) == 1
+    assert (catalog._ids[row], catalog._years[row], catalog._ratings[row]) == (7, 1999, 8.5)
+    assert film.genres == [genre for genre in Genres if genre in (Genres.DRAMA, Genres.CRIME)]  # порядок Genres
+    assert not hasattr(film, "__dict__")
+
+    film.rating, film.year, film.title = 9.0, 2001, "  Другое название "
+    film.genres = [Genres.COMEDY]
+    assert (catalog._ratings[row], catalog._years[row], catalog._titles[row]) == (9.0, 2001, "Другое название")
+    assert catalog._genre_masks[row] == genres_to_mask([Genres.COMEDY])
+    with pytest.raises(ValueError):
+        film.year = 1700
+    with pytest.raises(ValueError):
+        film.genres = []
+    assert film.year == 2001 and film.genres == [Genres.COMEDY]
+
+
+def test_titles_and_directors_are_interned(make_data):
+    data_manager = make_data(stepik_pandas, films=100, users=1, ratings_per_user=1)
+    directors = {id(director) for director in data_manager._films._directors}
+    assert len(directors) == len(set(data_manager._films._directors)) == 40
+
+
+def test_catalog_behaves_like_the_old_dict(make_data, tmp_path):
+    data_manager = make_data(stepik_pandas, films=50, users=1, ratings_per_user=1)
+    data_manager.save_snapshot(tmp_path / "catalog.snap")
+    opened = DataManager.open_snapshot(tmp_path / "catalog.snap")
+    for catalog in (data_manager._films, opened._films):
+        assert sorted(catalog) == list(range(1, 51))
+        assert catalog.get(51) is None and catalog[10].movie_id == 10 and catalog[10] is catalog[10]
+        assert [film.movie_id for film in catalog.values()] == list(catalog)
+        with pytest.raises(KeyError):
+            catalog[0]
@@ -0,0 +1,45 @@
+import random
+
+from stepik_pandas import CommunityRatings, DataManager, Film, Genres, RecommendationService, User
+
+
+def expected_ranking(community):
+    return sorted((-community._score(stats), film_id) for film_id, stats in community._stats.items())
+
+
+def test_ranking_follows_updates_and_removals():
+    rnd = random.Random(1)
+    community = CommunityRatings(prior_mean=6.0)
+    community.BLOCK_SIZE = 4
+    ratings = {}
+    for step in range(5000):
+        key = (rnd.randrange(30), rnd.randrange(200))
+        old = ratings.pop(key, None)
+        new = None if old is not None and rnd.random() < 0.2 else rnd.uniform(0, 10)
+        if new is not None:
+            ratings[key] = new
+        community.update(key[1], old, new)
+        if step % 3 == 0:
+            community.sync()
+            assert [(-score, film_id) for film_id, _, score in community.iter_ranking()] == expected_ranking(community)
+    assert all(len(block) <= 2 * community.BLOCK_SIZE for block in community._blocks)
+
+
+def test_community_strategy_skips_watched_films():
+    data_manager = DataManager()
+    for film_id in range(1, 21):
+        data_manager.add_film(Film(film_id, f"Фильм {film_id}", [Genres.DRAMA], "Режиссёр", 2000, 5.0))
+    users = [User(user_id, f"user{user_id}") for user_id in range(1, 6)]
+    for user in users:
+        data_manager.add_user(user)
+        for film_id in range(1, 21):
+            user.add_watched_film(data_manager._films[film_id], float(film_id % 10))
+    viewer = User(99, "viewer")
+    data_manager.add_user(viewer)
+    viewer.add_watched_film(data_manager._films[9], 1.0)
+    with data_manager.reading():
+        films = list(data_manager.iter_films_by_community())
+    assert films[0].movie_id == 19
+    result = RecommendationService(cache_size=0).create_recommendation("community", data_manager, viewer)
+    assert data_manager._films[9] not in result.films
+    assert [film.movie_id for film in result.films][:3] == [19, 8, 18]
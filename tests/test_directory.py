@@ -0,0 +1,58 @@
+import threading
+
+import stepik_pandas
+from stepik_pandas import DataManager, User
+
+
+def test_lookup_and_completion_follow_renames(make_data):
+    data_manager = make_data(stepik_pandas, users=20)
+    user = data_manager._users[7]
+    assert data_manager.get_user_by_name("  USER7 ") is user
+    assert data_manager.complete_user_names("user1", limit=3) == ["user1", "user10", "user11"]
+
+    user.user_name = "Алиса  Петрова"
+    assert data_manager.get_user_by_name("user7") is None
+    assert data_manager.get_user_by_name("алиса петрова") is user
+    assert data_manager.complete_user_names("али") == ["Алиса  Петрова"]
+    assert "user7" not in data_manager.complete_user_names("user")
+
+    # Имя, освобождённое переименованием, снова свободно; id не выдаются повторно
+    user_id = data_manager.allocate_user_id()
+    assert user_id == 21
+    data_manager.add_user(User(user_id, "user7"))
+    assert data_manager.get_user_by_name("user7").user_id == 21
+    assert data_manager.allocate_user_id() == 22
+
+
+def test_name_readers_wait_for_writers(make_data):
+    # Поиск и автодополнение идут под блокировкой чтения и не видят справочник посреди записи
+    data_manager = make_data(stepik_pandas, users=20)
+    user = data_manager._users[7]
+    results = []
+    reader = threading.Thread(target=lambda: results.append(
+        (data_manager.complete_user_names("user"), data_manager.get_user_by_name("Борис"))))
+    with data_manager.writing():
+        reader.start()
+        reader.join(0.2)
+        assert reader.is_alive() and not results
+        user.user_name = "Борис"
+    reader.join()
+    names, found = results[0]
+    assert found is user and "user7" not in names and len(names) == 10
+
+
+def test_directory_of_an_opened_snapshot(make_data, tmp_path):
+    data_manager = make_data(stepik_pandas, users=20)
+    data_manager._users[3].user_name = "Вера"
+    data_manager.save_snapshot(tmp_path / "users.snap")
+    opened = DataManager.open_snapshot(tmp_path / "users.snap")
+
+    # Справочник собирается из столбца имён, пользователи создаются только для ответа
+    assert opened.complete_user_names("user1", limit=3) == ["user1", "user10", "user11"]
+    assert sorted(opened._users._loaded) == [1, 10, 11]
+    assert opened.get_user_by_name("вера").user_id == 3 and opened.get_user_by_name("user3") is None
+    user = opened._users[15]
+    user.user_name = "Глеб"
+    assert opened.get_user_by_name("user15") is None and opened.get_user_by_name("ГЛЕБ") is user
+    assert opened.complete_user_names("г") == ["Глеб"]
+    assert opened.allocate_user_id() == 21
@@ -0,0 +1,52 @@
+import pytest
+
+import stepik_pandas
+from evaluate import evaluate, ranking_metrics, split_ratings
+from loader import BulkLoader, UNKNOWN_DIRECTOR
+
+
+def test_ranking_metrics():
+    precision, recall, ndcg = ranking_metrics([1, 2, 3, 4], {2, 9}, 4)
+    assert precision == 0.25
+    assert recall == 0.5
+    assert ndcg == pytest.approx((1 / 1.584962500721156) / (1 + 1 / 1.584962500721156))
+
+
+def test_leave_k_out_split_moves_ratings_to_test(make_data):
+    data_manager = make_data(stepik_pandas)
+    train, test = split_ratings(data_manager, "leave-k-out", holdout=3, seed=1)
+    assert set(test) == set(data_manager._users)
+    for user_id, held in test.items():
+        original = {film.movie_id: r for film, r in data_manager._users[user_id].watched_films.items()}
+        kept = {film.movie_id: r for film, r in train._users[user_id].watched_films.items()}
+        assert len(held) == 3
+        assert {**kept, **held} == original
+        assert not kept.keys() & held.keys()
+
+
+def test_pooled_evaluation_matches_serial(make_data):
+    train, test = split_ratings(make_data(stepik_pandas), "leave-k-out", holdout=3, seed=1)
+    strategies = ["genre", "rating", "knn"]
+    serial = evaluate(train, test, strategies, k=5, threshold=6, processes=1)
+    pooled = evaluate(train, test, strategies, k=5, threshold=6, processes=2, chunk_size=8)
+    for name in strategies:
+        for metric in ("users", "precision@5", "recall@5", "ndcg@5", "coverage"):
+            assert serial[name][metric] == pytest.approx(pooled[name][metric])
+
+
+def test_time_split_holds_out_latest_ratings(tmp_path):
+    films = tmp_path / "movies.csv"
+    films.write_text("movieId,title,genres\n" + "".join(f"{i},Фильм {i} (2000),Drama\n" for i in range(1, 9)),
+                     encoding="utf-8")
+    ratings = tmp_path / "ratings.csv"
+    # ratings.csv MovieLens отсортирован по movieId, а не по времени
+    rows = [(1, film_id, 4.0, 1000 - film_id * 10) for film_id in range(1, 9)]
+    ratings.write_text("userId,movieId,rating,timestamp\n" + "".join(f"{u},{f},{r},{t}\n" for u, f, r, t in rows),
+                       encoding="utf-8")
+    data_manager = stepik_pandas.DataManager()
+    loader = BulkLoader(data_manager, keep_timestamps=True, default_director=UNKNOWN_DIRECTOR)
+    loader.load(str(films), str(ratings))
+    _, test = split_ratings(data_manager, "time", holdout=2, timestamps=loader.timestamps)
+    assert set(test[1]) == {1, 2}
+    with pytest.raises(ValueError):
+        split_ratings(data_manager, "time", holdout=2)
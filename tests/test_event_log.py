@@ -0,0 +1,97 @@
+import os
+import time
+
+import pytest
+
+import stepik_pandas
+from stepik_pandas import Film, Genres, User, read_event_log
+
+
+def slow_fsync(monkeypatch, delay=0.05):
+    fsync = os.fsync
+
+    def wrapper(fd):
+        time.sleep(delay)
+        fsync(fd)
+
+    monkeypatch.setattr(os, "fsync", wrapper)
+
+
+def make_data_manager(module):
+    data_manager = module.DataManager()
+    for film_id in range(1, 6):
+        data_manager.add_film(module.Film(film_id, f"Фильм {film_id}", [module.Genres.DRAMA], "Режиссёр",
+                                          2000 + film_id, float(film_id)))
+    return data_manager
+
+
+def assert_durable(log):
+    assert log.last_lsn > 0
+    assert log._durable_lsn == log.last_lsn
+
+
+def test_replay_restores_changes(tmp_path):
+    data_manager = make_data_manager(stepik_pandas)
+    data_manager.open_log(str(tmp_path))
+    user = User(1, "alice", preferred_genres=[Genres.DRAMA])
+    data_manager.add_user(user)
+    user.add_watched_film(data_manager._films[2], 7.0)
+    user.add_watched_film(data_manager._films[2], 9.0)
+    user.preferred_genres = [Genres.COMEDY]
+    user.user_name = "alice2"
+    data_manager.add_film(Film(10, "Новый", [Genres.COMEDY], "Кто-то", 2020, 6.5))
+    data_manager.close_log()
+
+    restored = make_data_manager(stepik_pandas)
+    assert restored.open_log(str(tmp_path)) == 6
+    restored.close_log()
+    user = restored._users[1]
+    assert user.user_name == "alice2"
+    assert user.preferred_genres == [Genres.COMEDY]
+    assert {film.movie_id: r for film, r in user.watched_films.items()} == {2: 9.0}
+    assert restored._films[10].title == "Новый"
+    assert restored.get_user_by_name("alice2") is user
+
+
+def test_torn_tail_is_dropped(tmp_path):
+    data_manager = make_data_manager(stepik_pandas)
+    data_manager.open_log(str(tmp_path))
+    data_manager.add_user(User(1, "alice"))
+    data_manager.close_log()
+    segment = os.path.join(tmp_path, sorted(os.listdir(tmp_path))[-1])
+    with open(segment, "ab") as f:
+        f.write(b"\x10\x00\x00\x00garbage")
+    assert len(list(read_event_log(str(tmp_path)))) == 1
+
+
+def test_nested_write_is_durable_when_outer_lock_released(tmp_path, monkeypatch):
+    data_manager = make_data_manager(stepik_pandas)
+    data_manager.open_log(str(tmp_path), fsync="always")
+    slow_fsync(monkeypatch)
+    try:
+        with data_manager.writing():
+            user = User(1, "alice")
+            data_manager.add_user(user)
+            user.add_watched_film(data_manager._films[1], 8.0)
+        assert_durable(data_manager._event_log)
+    finally:
+        data_manager.close_log()
+
+
+def test_server_acknowledges_only_durable_writes(tmp_path, monkeypatch, gui):
+    data_manager = make_data_manager(gui)
+    data_manager.open_log(str(tmp_path), fsync="always")
+    server = gui.RecommendationServer(data_manager, workers=1)
+    slow_fsync(monkeypatch)
+    try:
+        user = server._register("alice", [gui.Genres.DRAMA])
+        assert_durable(data_manager._event_log)
+        server._rate_film(user, 3, 8.0)
+        assert_durable(data_manager._event_log)
+        with pytest.raises(ValueError):
+            server._rate_film(user, 999, 8.0)
+    finally:
+        data_manager.close_log()
+        server._executor.shutdown()
+    events = list(read_event_log(str(tmp_path)))
+    assert [event[0] for event in events] == ["user", "rate"]
@@ -0,0 +1,72 @@
+import multiprocessing
+import time
+
+import stepik_pandas
+from stepik_pandas import RecommendationService
+
+
+def test_pooled_training_matches_serial(make_data):
+    serial, pooled = make_data(stepik_pandas), make_data(stepik_pandas)
+    serial.train_factors(factors=4, iterations=3, processes=1)
+    pooled.train_factors(factors=4, iterations=3, processes=2)
+    assert serial._factor_model._user_vectors == pooled._factor_model._user_vectors
+    assert serial._factor_model._film_vectors == pooled._factor_model._film_vectors
+
+
+def test_strategy_ranks_by_predicted_rating(make_data):
+    data_manager = make_data(stepik_pandas)
+    data_manager.train_factors(factors=4, iterations=3, processes=1)
+    service = RecommendationService(cache_size=0)
+    model = data_manager._factor_model
+    with data_manager.reading():
+        user = data_manager._users[1]
+        films = service.create_recommendation("als", data_manager, user).films
+        predicted = [model.predict(data_manager, user, film) for film in films]
+    assert films and not set(films) & set(user.watched_films)
+    assert predicted == sorted(predicted, reverse=True)
+
+
+def test_first_request_serves_community_while_model_trains(make_data):
+    data_manager = make_data(stepik_pandas)
+    service = RecommendationService()
+    with data_manager.reading():
+        user = data_manager._users[1]
+        first = service.create_recommendation("als", data_manager, user).films
+        community = service.create_recommendation("community", data_manager, user).films
+    assert first == community
+    data_manager._factor_thread.join()
+    assert data_manager._factor_model is not None
+    with data_manager.reading():
+        trained = service.create_recommendation("als", data_manager, user).films
+    model = data_manager._factor_model
+    predicted = [model.predict(data_manager, user, film) for film in trained]
+    assert predicted == sorted(predicted, reverse=True)
+
+
+def test_stopped_training_closes_pool_and_keeps_old_model(make_data):
+    data_manager = make_data(stepik_pandas, users=400)
+    data_manager.start_factor_training(factors=4, iterations=1000, processes=2)
+    while not multiprocessing.active_children():
+        time.sleep(0.01)
+    data_manager.stop_factor_training()
+    assert not data_manager._factor_thread.is_alive()
+    assert data_manager._factor_model is None
+    assert not multiprocessing.active_children()
+
+
+def test_console_trains_only_after_first_als_request(gui, monkeypatch):
+    calls = []
+    train_factors = gui.DataManager.train_factors
+    monkeypatch.setattr(gui.DataManager, "train_factors",
+                        lambda self, *args: calls.append(args[3]) or train_factors(self, *args))
+    console = gui.ConsoleInterface()
+    data_manager = console.data_manager
+    assert data_manager._factor_thread is None
+    user = gui.User(data_manager.allocate_user_id(), "Зритель", preferred_genres=[gui.Genres.DRAMA])
+    data_manager.add_user(user)
+    user.add_watched_film(data_manager._films[1], 9.0)
+    with data_manager.reading():
+        console.recommendation_service.create_recommendation("als", data_manager, user)
+    data_manager._factor_thread.join()
+    assert calls == [2]  # небольшой пул по умолчанию, а не по процессу на ядро
+    assert data_manager._factor_model is not None
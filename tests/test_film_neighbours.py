@@ -0,0 +1,47 @@
+import stepik_pandas
+
+
+def neighbour_lists(data_manager):
+    with data_manager.reading():
+        return {film_id: data_manager.get_similar_films(data_manager._films[film_id])
+                for film_id in data_manager._ratings._col_films}
+
+
+def test_pooled_build_matches_lazy_lists(make_data):
+    lazy, built = make_data(stepik_pandas), make_data(stepik_pandas)
+    assert built.build_film_neighbours(processes=2, chunk_size=32) == len(built._ratings._col_films)
+    assert neighbour_lists(built) == neighbour_lists(lazy)
+
+
+def test_patched_lists_match_fresh_build(make_data):
+    patched, fresh = make_data(stepik_pandas, seed=4), make_data(stepik_pandas, seed=4)
+    neighbour_lists(patched)
+    with patched.reading():
+        users = {user_id: patched.get_neighbours(user) for user_id, user in patched._users.items()}
+    for data_manager in (patched, fresh):
+        for user_id, film_id, rating in [(1, 2, 9.0), (2, 2, 1.0), (3, 50, 5.0), (4, 7, 10.0), (1, 7, 2.0)]:
+            data_manager._users[user_id].add_watched_film(data_manager._films[film_id], rating)
+    assert neighbour_lists(patched) == neighbour_lists(fresh)
+    with patched.reading(), fresh.reading():
+        assert len(users) == len(patched._users)
+        assert all(patched.get_neighbours(patched._users[user_id]) == fresh.get_neighbours(fresh._users[user_id])
+                   for user_id in users)
+
+
+def test_ratings_defer_user_similarities_to_the_next_read(make_data, monkeypatch):
+    patched, fresh = make_data(stepik_pandas, seed=5), make_data(stepik_pandas, seed=5)
+    with patched.reading():
+        for user in patched._users.values():
+            patched.get_neighbours(user)
+    calls = []
+    similarity = stepik_pandas.RatingMatrix.similarity
+    monkeypatch.setattr(stepik_pandas.RatingMatrix, "similarity",
+                        lambda self, *args: calls.append(args) or similarity(self, *args))
+    for data_manager in (patched, fresh):
+        for user_id in range(1, 31):  # популярный фильм: у каждой оценки много оценивших его же
+            data_manager._users[user_id].add_watched_film(data_manager._films[3], float(user_id % 10))
+    assert not calls
+    with patched.reading(), fresh.reading():
+        assert all(patched.get_neighbours(user) == fresh.get_neighbours(fresh._users[user_id])
+                   for user_id, user in patched._users.items())
+    assert calls and not patched._neighbours._stale
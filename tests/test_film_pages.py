@@ -0,0 +1,43 @@
+import pytest
+
+import stepik_pandas
+from stepik_pandas import DataManager, Film, Genres
+
+
+def pages(data_manager, order, limit=7):
+    films, offset = [], 0
+    while True:
+        total, page = data_manager.get_films_page(offset, limit, order)
+        assert total == len(data_manager._films)
+        if not page:
+            return films
+        films += page
+        offset += limit
+
+
+def check_orders(data_manager):
+    films = list(data_manager._films.values())
+    assert pages(data_manager, "id") == sorted(films, key=lambda film: film.movie_id)
+    assert pages(data_manager, "rating") == sorted(films, key=lambda film: (-film.rating, film.movie_id))
+
+
+def test_pages_follow_id_and_rating_order(make_data, tmp_path):
+    data_manager = make_data(stepik_pandas, films=50, users=5, ratings_per_user=5)
+    data_manager.add_film(Film(0, "Первый по id", [Genres.DRAMA], "Режиссёр", 2000, 5.0))  # добавлен последним
+    check_orders(data_manager)
+    data_manager._films[10].rating = 10.0
+    check_orders(data_manager)
+
+    data_manager.save_snapshot(tmp_path / "films.snap")
+    opened = DataManager.open_snapshot(tmp_path / "films.snap")
+    _, page = opened.get_films_page(20, 5, "id")
+    assert [film.movie_id for film in page] == list(range(20, 25))
+    assert sum(film is not None for film in opened._films._films) == 5  # пропущенные строки без Film
+    check_orders(opened)
+    opened.add_film(Film(-1, "Ещё раньше", [Genres.DRAMA], "Режиссёр", 2000, 9.9))
+    check_orders(opened)
+
+
+def test_unknown_order_is_rejected(make_data):
+    with pytest.raises(ValueError):
+        make_data(stepik_pandas, films=5, users=1, ratings_per_user=1).get_films_page(order="year")
@@ -0,0 +1,41 @@
+import pytest
+
+import stepik_pandas
+
+
+def ids(results):
+    return {name: [film.movie_id for film in result.films] for name, result in results.items()}
+
+
+@pytest.mark.parametrize("exact_compat", [False, True])
+def test_single_pass_matches_per_strategy_calls(make_data, exact_compat):
+    data_manager = make_data(stepik_pandas, films=200, users=40, ratings_per_user=20)
+    service = stepik_pandas.RecommendationService(cache_size=0)
+    for similar in (service["similar"], service["hybrid"]._components["similar"]):
+        similar._exact_compat = exact_compat  # смешанная берёт формулу у своей компоненты
+    service["genre"].recommendation_count = 8  # число берётся у зарегистрированной стратегии
+    data_manager._users[5].preferred_genres = []
+    for user in data_manager._users.values():
+        single = ids(service.get_all_recommendations(data_manager, user))
+        assert single == ids(service.get_all_recommendations(data_manager, user, single_pass=False))
+        assert len(single["genre"]) == (8 if user.preferred_genres else 0)
+
+
+@pytest.mark.parametrize("filters", [(0, 0, 2100), (7.0, 0, 2100), (0, 1980, 2000)])
+def test_console_single_pass_applies_filters_like_each_strategy(gui, make_data, filters):
+    data_manager = make_data(gui, films=200, users=40, ratings_per_user=20)
+    service = gui.RecommendationService(cache_size=0)
+    for user in data_manager._users.values():
+        assert ids(service.get_all_recommendations(data_manager, user, *filters)) == \
+            ids(service.get_all_recommendations(data_manager, user, *filters, single_pass=False))
+
+
+def test_blend_ranks_unwatched_candidates_of_the_components(make_data):
+    data_manager = make_data(stepik_pandas, films=200, users=40, ratings_per_user=20)
+    hybrid = stepik_pandas.RecommendationService(cache_size=0)["hybrid"]
+    with data_manager.reading():
+        for user in data_manager._users.values():
+            lists = hybrid.run_all(data_manager, user)
+            assert lists["hybrid"] == hybrid(data_manager, user)
+            assert not set(lists["hybrid"]) & set(user.watched_films)
+            assert len(lists["hybrid"]) == hybrid.recommendation_count
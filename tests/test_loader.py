@@ -0,0 +1,31 @@
+import stepik_pandas
+from loader import BulkLoader, UNKNOWN_DIRECTOR
+
+
+def write_films(tmp_path):
+    films = tmp_path / "films.csv"
+    films.write_text("movieId,title,genres,director,year\n"
+                     "1,Фильм 1,Drama,Режиссёр,1999\n"
+                     "2,Фильм 2,Drama,Режиссёр,1700\n"  # год вне 1800-2100
+                     "3,Фильм 3,Drama,,2001\n"  # нет режиссёра
+                     "4,Фильм 4 (2005),Drama,Режиссёр,\n"  # год из названия
+                     "5,Фильм 5,Drama,Режиссёр,\n"  # года нет нигде
+                     "6,,Drama,Режиссёр,2000\n", encoding="utf-8")
+    return str(films)
+
+
+def test_films_go_through_film_validation(tmp_path):
+    data_manager = stepik_pandas.DataManager()
+    report = BulkLoader(data_manager).load(write_films(tmp_path))
+    assert sorted(data_manager._films) == [1, 4]
+    assert data_manager._films[4].year == 2005 and data_manager._films[4].title == "Фильм 4"
+    assert report.films_loaded == 2 and report.bad_rows == 4
+    assert [line_no for _, line_no, _ in report.bad_row_samples] == [3, 4, 6, 7]
+
+
+def test_default_director_fills_missing_column(tmp_path):
+    data_manager = stepik_pandas.DataManager()
+    report = BulkLoader(data_manager, default_director=UNKNOWN_DIRECTOR).load(write_films(tmp_path))
+    assert sorted(data_manager._films) == [1, 3, 4]
+    assert data_manager._films[3].director == UNKNOWN_DIRECTOR
+    assert report.bad_rows == 3
@@ -0,0 +1,41 @@
+import threading
+import tracemalloc
+from types import SimpleNamespace
+
+import stepik_pandas
+from stepik_pandas import MemorySink, Metrics, RecommendationService
+
+
+def test_all_mode_counts_returned_films(make_data):
+    data_manager = make_data(stepik_pandas)
+    sink = MemorySink()
+    service = RecommendationService(cache_size=0, metrics=Metrics(sink))
+    user = data_manager._users[1]
+    results = service.get_all_recommendations(data_manager, user)
+    shared = [name for name in service.available_strategies if name in service["hybrid"]._components or name == "hybrid"]
+    event, = [event for event in sink.events if event["strategy"] == "all"]
+    assert event["returned"] == sum(len(results[name].films) for name in shared) > len(shared)
+    assert service.metrics.counters["all"]["returned"] == event["returned"]
+
+
+def test_only_one_call_is_profiled_at_a_time():
+    metrics = Metrics(MemorySink(), profile_rate=1.0, trace_memory=True)
+    entered, release = threading.Event(), threading.Event()
+
+    def slow():
+        entered.set()
+        release.wait()
+        return [1]
+
+    thread = threading.Thread(target=metrics.observe, args=("slow", SimpleNamespace(), slow))
+    thread.start()
+    entered.wait()
+    metrics.observe("fast", SimpleNamespace(), lambda: [2])
+    assert tracemalloc.is_tracing()  # второй вызов не остановил трассировку первого
+    release.set()
+    thread.join()
+    assert not tracemalloc.is_tracing()
+    events = {event["strategy"]: event for event in metrics.sink.events}
+    assert "profile" in events["slow"] and events["slow"]["memory_peak_kb"] > 0
+    assert "profile" not in events["fast"]
+    assert metrics.counters["slow"]["profiled"] == 1 and metrics.counters["fast"]["profiled"] == 0
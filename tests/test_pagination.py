@@ -0,0 +1,43 @@
+import pytest
+
+import stepik_pandas
+from stepik_pandas import RecommendationService
+
+STRATEGIES = ["genre", "rating", "similar", "item", "knn", "community", "als", "hybrid"]
+
+
+def all_pages(service, name, data_manager, user, page_size):
+    pages, cursor = [], None
+    while True:
+        result = service.recommend_page(name, data_manager, user, page_size, cursor)
+        pages.append(result.films)
+        cursor = result.cursor
+        if cursor is None:
+            return pages
+
+
+@pytest.mark.parametrize("name", STRATEGIES)
+def test_pages_match_full_call(make_data, name):
+    data_manager = make_data(stepik_pandas, films=120, users=30, ratings_per_user=20)
+    data_manager.train_factors(factors=4, iterations=2, processes=1)
+    service = RecommendationService(cache_size=0)
+    for user_id in (1, 2, 3):
+        user = data_manager._users[user_id]
+        pages = all_pages(service, name, data_manager, user, page_size=7)
+        assert all(len(page) == 7 for page in pages[:-1]) and 0 < len(pages[-1]) <= 7
+        films = [film for page in pages for film in page]
+        service[name].recommendation_count = len(films)
+        with data_manager.reading():
+            assert films == service[name](data_manager, user)
+
+
+def test_changed_data_does_not_repeat_served_films(make_data):
+    data_manager = make_data(stepik_pandas)
+    service = RecommendationService(cache_size=0)
+    user = data_manager._users[1]
+    first = service.recommend_page("rating", data_manager, user, page_size=5)
+    user.add_watched_film(first.films[0], 9.0)
+    second = service.recommend_page("rating", data_manager, user, page_size=5, cursor=first.cursor)
+    assert not set(first.films) & set(second.films)
+    with pytest.raises(ValueError):
+        service.recommend_page("rating", data_manager, user, cursor=first.cursor)  # курсор одноразовый
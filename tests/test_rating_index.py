@@ -0,0 +1,53 @@
+import pytest
+
+import stepik_pandas
+from stepik_pandas import DataManager, Film, Genres
+
+
+def expected(data_manager, user, count, min_rating=0, min_year=0, max_year=2100):
+    films = [film for film in data_manager._films.values() if film not in user.watched_films
+             and film.rating >= min_rating and min_year <= film.year <= max_year]
+    return sorted(films, key=lambda film: (-film.rating, film.movie_id))[:count]
+
+
+def recommend(module, data_manager, user, count, *filters):
+    strategy = module.RecommendationService(cache_size=0)["rating"]
+    strategy.recommendation_count = count
+    with data_manager.reading():
+        return strategy(data_manager, user, *filters)
+
+
+def test_index_follows_added_films_and_rating_changes(make_data, tmp_path):
+    data_manager = make_data(stepik_pandas, films=200, users=5, ratings_per_user=30)
+    user = data_manager._users[1]
+    assert recommend(stepik_pandas, data_manager, user, 10) == expected(data_manager, user, 10)
+
+    data_manager.add_film(Film(1000, "Лучший", [Genres.DRAMA], "Режиссёр", 2020, 10.0))
+    data_manager._films[7].rating = 9.95
+    data_manager._films[recommend(stepik_pandas, data_manager, user, 1)[0].movie_id].rating = 0.0
+    assert recommend(stepik_pandas, data_manager, user, 10) == expected(data_manager, user, 10)
+
+    data_manager.save_snapshot(tmp_path / "rating.snap")
+    opened = DataManager.open_snapshot(tmp_path / "rating.snap")
+    user = opened._users[1]
+    assert recommend(stepik_pandas, opened, user, 10) == expected(opened, user, 10)
+    opened._films[12].rating = 9.99  # первое изменение после снимка собирает индекс из сохранённого порядка
+    opened.add_film(Film(1001, "Новый", [Genres.DRAMA], "Режиссёр", 2021, 9.97))
+    assert recommend(stepik_pandas, opened, user, 10) == expected(opened, user, 10)
+
+
+def test_walk_stops_after_k_unwatched_films(make_data):
+    data_manager = make_data(stepik_pandas, films=500, users=2, ratings_per_user=10)
+    walked = []
+    rows = data_manager.iter_rows_by_rating
+    data_manager.iter_rows_by_rating = lambda: (walked.append(row) or row for row in rows())
+    user = data_manager._users[1]
+    assert len(recommend(stepik_pandas, data_manager, user, 5)) == 5
+    assert 5 <= len(walked) <= 5 + len(user.watched_films)
+
+
+@pytest.mark.parametrize("filters", [(0, 0, 2100), (8.0, 0, 2100), (0, 1990, 2000), (5.0, 1960, 1970)])
+def test_console_filters_match_brute_force(gui, make_data, filters):
+    data_manager = make_data(gui, films=300, users=5, ratings_per_user=40)
+    for user in data_manager._users.values():
+        assert recommend(gui, data_manager, user, 10, *filters) == expected(data_manager, user, 10, *filters)
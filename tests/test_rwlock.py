@@ -0,0 +1,110 @@
+import random
+import threading
+import time
+
+import pytest
+
+import stepik_pandas
+from stepik_pandas import ReadWriteLock
+
+
+def wait_until(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "поток не дошёл до ожидания"
+        time.sleep(0.001)
+
+
+def start(target):
+    thread = threading.Thread(target=target, daemon=True)
+    thread.start()
+    return thread
+
+
+def test_readers_share_and_writer_excludes():
+    lock = ReadWriteLock()
+    both_inside = threading.Barrier(2, timeout=5)
+
+    def read():
+        with lock.reading():
+            both_inside.wait()  # не дождались бы друг друга, если бы чтение было исключающим
+
+    readers = [start(read) for _ in range(2)]
+    for reader in readers:
+        reader.join()
+
+    events = []
+    with lock.writing():
+        reader = start(lambda: lock.acquire_read() or events.append("read") or lock.release_read())
+        wait_until(lambda: lock._waiting_readers == 1)
+        events.append("write")
+    reader.join()
+    assert events == ["write", "read"]
+
+
+def test_reentry_and_read_inside_write():
+    lock = ReadWriteLock()
+    with lock.reading(), lock.reading():
+        with pytest.raises(RuntimeError):
+            lock.acquire_write()
+    with lock.writing(), lock.writing(), lock.reading():
+        assert lock._writer == threading.get_ident()
+    assert lock._writer is None and lock._readers == 0
+
+    writer = start(lambda: lock.acquire_write() or lock.release_write())
+    writer.join(5)
+    assert not writer.is_alive()
+
+
+def test_phases_alternate_between_writers_and_readers():
+    lock = ReadWriteLock()
+    events, release_reader, release_writer = [], threading.Event(), threading.Event()
+
+    def run(guard, name, hold=None):
+        with guard():
+            events.append(name)
+            if hold:
+                hold.wait(5)
+
+    threads = [start(lambda: run(lock.reading, "read 1", release_reader))]
+    wait_until(lambda: lock._readers == 1)
+    threads.append(start(lambda: run(lock.writing, "write 1", release_writer)))
+    wait_until(lambda: lock._waiting_writers == 1)
+    threads.append(start(lambda: run(lock.reading, "read 2")))  # писатель ждёт - читатель встаёт за ним
+    wait_until(lambda: lock._waiting_readers == 1)
+    release_reader.set()
+    wait_until(lambda: "write 1" in events)
+    threads.append(start(lambda: run(lock.writing, "write 2")))
+    wait_until(lambda: lock._waiting_writers == 1)
+    release_writer.set()
+    for thread in threads:
+        thread.join(5)
+    # после записи входят все дождавшиеся читатели, и только потом следующий писатель
+    assert events == ["read 1", "write 1", "read 2", "write 2"]
+
+
+def test_strategies_run_while_ratings_are_written(make_data):
+    data_manager = make_data(stepik_pandas, films=200, users=30, ratings_per_user=10)
+    service = stepik_pandas.RecommendationService(cache_size=0)
+    errors, done = [], threading.Event()
+
+    def recommend():
+        rnd = random.Random(threading.get_ident())
+        try:
+            while not done.is_set():
+                user = data_manager._users[rnd.randint(1, 30)]
+                with data_manager.reading():  # оценки не меняются между выдачей и проверкой
+                    for result in service.get_all_recommendations(data_manager, user).values():
+                        assert not set(result.films) & set(user.watched_films)
+        except Exception as error:
+            errors.append(error)
+
+    readers = [start(recommend) for _ in range(3)]
+    rnd = random.Random(1)
+    for _ in range(200):
+        user = data_manager._users[rnd.randint(1, 30)]
+        user.add_watched_film(data_manager._films[rnd.randint(1, 200)], rnd.randint(0, 10))
+    done.set()
+    for reader in readers:
+        reader.join()
+    assert errors == []
@@ -0,0 +1,93 @@
+import pytest
+
+import stepik_pandas
+from stepik_pandas import DataManager, Film, Genres, _trigrams
+
+FILMS = [
+    (1, "Матрица", "Лана Вачовски", 8.7),
+    (2, "Матрица: Перезагрузка", "Лана Вачовски", 7.2),
+    (3, "Начало", "Кристофер Нолан", 8.8),
+    (4, "Интерстеллар", "Кристофер Нолан", 8.6),
+    (5, "Нолан", "Режиссёр", 5.0),
+    (6, "Мастер и Маргарита", "Юрий Кара", 6.5),
+]
+
+
+def build(films=FILMS):
+    data_manager = DataManager()
+    for film_id, title, director, rating in films:
+        data_manager.add_film(Film(film_id, title, [Genres.DRAMA], director, 1990 + film_id, rating))
+    return data_manager
+
+
+def search(data_manager, query, **kwargs):
+    return [film.movie_id for film in data_manager.search_films(query, limit=1000, **kwargs)[1]]
+
+
+def brute_force(data_manager, query, threshold=0.5):
+    # Та же оценка перебором всего каталога, без триграммного индекса
+    grams = _trigrams(query, prefix=True)
+    scored = []
+    for film in data_manager._films.values():
+        best = (0.0, 0.0)
+        for text, weight in ((film.title, 1.0), (film.director, 0.9)):
+            text_grams = _trigrams(text)
+            shared = len(grams & text_grams)
+            if grams and shared >= threshold * len(grams):
+                best = max(best, (weight * shared / len(grams), shared / len(grams | text_grams)))
+        if best[0]:
+            scored.append((-best[0], -best[1], -film.rating, film.movie_id))
+    return [film_id for *_, film_id in sorted(scored)]
+
+
+def test_ranking_prefers_exact_titles_over_fuzzy_and_directors():
+    data_manager = build()
+    assert search(data_manager, "матрица") == [1, 2]  # лишние слова названия снижают сходство
+    assert search(data_manager, "нолан") == [5, 3, 4]  # название весит больше режиссёра
+    assert search(data_manager, "  МАТРИЦА ") == [1, 2]
+    assert search(data_manager, "нолан", fields=("director",)) == [3, 4]
+    assert search(data_manager, "чебурашка") == []
+
+
+def test_typos_and_unfinished_words_are_found():
+    data_manager = build()
+    assert search(data_manager, "матрца")[:1] == [1]
+    assert search(data_manager, "интерстелар") == [4]
+    assert search(data_manager, "интерс") == [4]
+    assert search(data_manager, "мастер и марг") == [6]
+
+
+@pytest.mark.parametrize("query", ["фильм 12", "режиссёр 7", "фильм", "ильм 3", "режисер 1", "фильм 1 режиссёр"])
+def test_index_matches_brute_force_and_pages_are_slices(make_data, query):
+    data_manager = make_data(stepik_pandas, films=300, users=1, ratings_per_user=1)
+    full = search(data_manager, query)
+    assert full == brute_force(data_manager, query)
+    pages = [data_manager.search_films(query, offset, 7) for offset in range(0, len(full) + 7, 7)]
+    assert all(total == len(full) for total, _ in pages)
+    assert [film.movie_id for _, page in pages for film in page] == full
+
+
+def test_results_follow_catalog_changes():
+    data_manager = build()
+    assert search(data_manager, "нолан") == [5, 3, 4]
+    data_manager._films[5].title = "Другое"
+    data_manager._films[6].director = "Кристофер Нолан"
+    data_manager.add_film(Film(7, "Нолан: документальный", [Genres.DRAMA], "Автор", 2020, 9.0))
+    assert search(data_manager, "нолан") == [7, 3, 4, 6]
+    assert search(data_manager, "нолан") == brute_force(data_manager, "нолан")
+    assert search(data_manager, "другое") == [5]
+
+
+def test_search_in_opened_snapshot(tmp_path):
+    build().save_snapshot(tmp_path / "search.snap")
+    opened = DataManager.open_snapshot(tmp_path / "search.snap")
+    assert search(opened, "нолан") == [5, 3, 4]
+
+
+def test_year_pages(make_data):
+    data_manager = make_data(stepik_pandas, films=100, users=1, ratings_per_user=1)
+    expected = sorted(data_manager._films.values(), key=lambda film: -film.year)
+    total, page = data_manager.get_films_page_by_year(10, 15)
+    assert total == 100 and [film.year for film in page] == [film.year for film in expected[10:25]]
+    data_manager._films[1].year = 2030
+    assert data_manager.get_films_page_by_year(0, 1)[1][0].movie_id == 1
@@ -0,0 +1,147 @@
+import asyncio
+import json
+import os
+import tempfile
+import threading
+import time
+
+
+class Client:
+    def __init__(self, reader, writer):
+        self.reader, self.writer, self.request_id = reader, writer, 0
+
+    async def __call__(self, op, **request):
+        self.request_id += 1
+        self.writer.write((json.dumps(dict(request, id=self.request_id, op=op)) + "\n").encode("utf-8"))
+        response = json.loads(await self.reader.readline())
+        assert response["id"] == self.request_id
+        return response
+
+    async def ok(self, op, **request):
+        response = await self(op, **request)
+        assert response["ok"], response
+        return response["result"]
+
+
+def serve(server, scenario):
+    # Сервер на Unix-сокете во временном каталоге; scenario(connect) получает фабрику клиентов
+    async def main(path):
+        task = asyncio.create_task(server.serve(path=path))
+        while not os.path.exists(path):
+            await asyncio.sleep(0.001)
+
+        async def connect():
+            return Client(*await asyncio.open_unix_connection(path))
+
+        try:
+            await scenario(connect)
+        finally:
+            task.cancel()
+            server._executor.shutdown()
+
+    with tempfile.TemporaryDirectory() as directory:
+        asyncio.run(main(os.path.join(directory, "server.sock")))
+
+
+def ids(films):
+    return [film["id"] for film in films]
+
+
+def test_batch_lets_waiting_writer_in_between_requests(gui, make_data):
+    data_manager = make_data(gui, films=50, users=5, ratings_per_user=5)
+    server = gui.RecommendationServer(data_manager, gui.RecommendationService(cache_size=0))
+    entered, release, written = threading.Event(), threading.Event(), threading.Event()
+    seen = []
+
+    class Gate(gui.RecommendationStrategy):
+        def __call__(self, data_manager, user, min_rating=0, min_year=0, max_year=2100):
+            seen.append(written.is_set())
+            entered.set()
+            release.wait()
+            return []
+
+        def get_description(self):
+            return "Ждёт сигнала"
+
+    server.recommendation_service._strategies["gate"] = Gate("gate")
+    user = data_manager._users[1]
+    batch = threading.Thread(target=server._recommend_batch, args=([(user, "gate", (0, 0, 2100))] * 2,))
+    batch.start()
+    entered.wait()
+
+    def write():
+        with data_manager.writing():
+            written.set()
+
+    writer = threading.Thread(target=write)
+    writer.start()
+    while not data_manager._lock._waiting_writers:
+        time.sleep(0.001)
+    release.set()
+    batch.join()
+    writer.join()
+    server._executor.shutdown()
+    assert seen == [False, True]  # второй запрос пачки начался после записи
+
+
+def test_round_trips_over_unix_socket(gui, make_data):
+    data_manager = make_data(gui, films=120, users=10, ratings_per_user=10)
+    service = gui.RecommendationService(cache_size=0)
+    server = gui.RecommendationServer(data_manager, gui.RecommendationService(cache_size=0))
+    drama = gui.Genres.DRAMA.value
+
+    async def scenario(connect):
+        client = await connect()
+        assert await client.ok("ping") == "pong"
+        assert not (await client("recommend", strategy="rating"))["ok"]  # без входа
+        assert not (await client("unknown"))["ok"]
+
+        user = await client.ok("register", user_name="Новый зритель", genres=[drama])
+        assert user["watched"] == 0 and user["preferred_genres"] == [drama]
+        assert not (await client("register", user_name="Новый зритель"))["ok"]
+        assert (await client.ok("rate_film", film_id=7, rating=9))["watched"] == 1
+        for bad in ({"film_id": 7, "rating": 11}, {"film_id": 10 ** 6, "rating": 5}):
+            assert not (await client("rate_film", **bad))["ok"]
+
+        other = await connect()
+        assert await other.ok("login", user_name="Новый зритель") == dict(user, watched=1)
+        assert not (await other("login", user_name="Никто"))["ok"]
+
+        for order in ("id", "rating"):
+            page = await other.ok("films", offset=10, limit=5, sort=order)
+            total, films = data_manager.get_films_page(10, 5, order)
+            assert page["total"] == total == 120 and ids(page["films"]) == [film.movie_id for film in films]
+        assert ids((await other.ok("films", offset=10, limit=5, sort="id"))["films"]) == list(range(11, 16))
+        assert not (await other("films", sort="year"))["ok"]
+
+        found = await other.ok("search", query="Фильм 42", limit=3)
+        total, films = data_manager.search_films("Фильм 42", 0, 3)
+        assert found["total"] == total and ids(found["films"]) == [film.movie_id for film in films]
+        assert found["films"][0]["id"] == 42
+        assert not (await other("search", query=" "))["ok"]
+
+        stored = data_manager.get_user_by_name("Новый зритель")
+        result = await client.ok("recommend", strategy="rating", min_rating=5)
+        expected = service.create_recommendation("rating", data_manager, stored, 5)
+        assert ids(result["rating"]["films"]) == [film.movie_id for film in expected.films]
+        assert 7 not in ids(result["rating"]["films"])
+        every = await client.ok("recommend", strategy="all")
+        assert set(every) == set(service.available_strategies)
+        assert not (await client("recommend", strategy="нет такой"))["ok"]
+
+        pages, cursor = [], None
+        while True:
+            page = await client.ok("recommend_page", strategy="rating", min_rating=9, page_size=4, cursor=cursor)
+            pages.append(ids(page["films"]))
+            cursor = page["cursor"]
+            if cursor is None:
+                break
+        best = sorted((film for film in data_manager._films.values() if film.rating >= 9 and film.movie_id != 7),
+                      key=lambda film: (-film.rating, film.movie_id))
+        assert sum(pages, []) == [film.movie_id for film in best]
+        assert all(len(page) == 4 for page in pages[:-1])
+
+        stats = await client.ok("stats")
+        assert stats["connections"] == 2 and stats["errors"] == 9
+
+    serve(server, scenario)
@@ -0,0 +1,43 @@
+import pytest
+
+import stepik_pandas
+from stepik_pandas import Film, Genres, RecommendationService, ShardedDataManager, User
+
+STRATEGIES = ["genre", "rating", "similar", "knn"]
+
+
+def assert_same(data_manager, sharded, user_ids):
+    service = RecommendationService(cache_size=0)
+    for user_id in user_ids:
+        with data_manager.reading():
+            user = data_manager._users[user_id]
+            neighbours = data_manager.get_neighbours(user)
+            expected = {name: [film.movie_id for film in service.create_recommendation(name, data_manager, user).films]
+                        for name in STRATEGIES}
+        assert sharded.get_neighbours(user_id) == neighbours
+        for name in STRATEGIES:
+            assert [film.movie_id for film in sharded.recommend(name, user_id)] == expected[name], name
+
+
+def test_sharded_engine_matches_single_data_manager(make_data):
+    data_manager = make_data(stepik_pandas, films=200, users=80, ratings_per_user=20)
+    with ShardedDataManager(3, source=data_manager) as sharded:
+        assert sum(shard["users"] for shard in sharded.stats()) == len(data_manager._users)
+        assert_same(data_manager, sharded, range(1, 21))
+
+        data_manager.add_film(Film(500, "Новый фильм", [Genres.DRAMA], "Режиссёр", 2020, 9.9))
+        sharded.add_film(Film(500, "Новый фильм", [Genres.DRAMA], "Режиссёр", 2020, 9.9))
+        data_manager.add_user(User(200, "user200", preferred_genres=[Genres.DRAMA]))
+        sharded.add_user(User(200, "user200", preferred_genres=[Genres.DRAMA]))
+        for user_id, film_id, rating in [(1, 500, 10.0), (2, 7, 3.0), (200, 500, 9.0), (200, 11, 8.0)]:
+            data_manager._users[user_id].add_watched_film(data_manager._films[film_id], rating)
+            sharded.add_watched_film(user_id, film_id, rating)
+        data_manager._users[3].preferred_genres = [Genres.HORROR, Genres.COMEDY]
+        sharded.set_preferred_genres(3, [Genres.HORROR, Genres.COMEDY])
+        assert_same(data_manager, sharded, [1, 2, 3, 4, 200])
+
+
+def test_strategies_needing_all_ratings_are_rejected(make_data):
+    with ShardedDataManager(2, source=make_data(stepik_pandas, users=10)) as sharded:
+        with pytest.raises(ValueError):
+            sharded.recommend("community", 1)
@@ -0,0 +1,51 @@
+import statistics
+
+import pytest
+
+import stepik_pandas
+from stepik_pandas import SimilarUsersStrategy
+
+
+def pairwise(user, other, exact_compat):
+    # Сходство пары перебором общих фильмов; exact_compat - формула исходной SimilarUsersStrategy
+    common = user.watched_films.keys() & other.watched_films.keys()
+    if not common:
+        return 0.0
+    if exact_compat:
+        diffs = [abs(user.get_rating(film) or 0 - (other.get_rating(film) or 0)) for film in common]
+    else:
+        diffs = [abs(user.get_rating(film) - other.get_rating(film)) for film in common]
+    return 1.0 / (1.0 + statistics.mean(diffs))
+
+
+def original_similar(data_manager, user, count):
+    others = [other for other in data_manager._users.values() if other.user_id != user.user_id]
+    similarities = [(other, pairwise(user, other, True)) for other in others if pairwise(user, other, True) > 0]
+    if not similarities:
+        return []
+    similarities.sort(key=lambda x: x[1], reverse=True)
+    best = similarities[0][0]
+    films = [film for film, rating in best.watched_films.items() if film not in user.watched_films and rating >= 8.0]
+    films.sort(key=lambda film: best.get_rating(film) or 0, reverse=True)
+    return films[:count]
+
+
+@pytest.mark.parametrize("exact_compat", [False, True])
+def test_one_pass_similarities_match_pairwise(make_data, exact_compat):
+    data_manager = make_data(stepik_pandas, films=80, users=30, ratings_per_user=10)
+    user = data_manager._users[1]
+    user.add_watched_film(data_manager._films[80], 0.0)  # оценка 0 отличает старую формулу
+    data_manager._users[2].add_watched_film(data_manager._films[80], 6.0)
+    data_manager._users[3].watched_films = {data_manager._films[film_id]: 4.0 for film_id in (1, 2, 3)}
+    for user in data_manager._users.values():
+        expected = [(other.user_id, pairwise(user, other, exact_compat)) for other in data_manager._users.values()
+                    if other is not user and pairwise(user, other, exact_compat) > 0]
+        assert sorted(data_manager.get_user_similarities(user, exact_compat)) == pytest.approx(sorted(expected))
+
+
+def test_exact_compat_reproduces_original_strategy(make_data):
+    data_manager = make_data(stepik_pandas, films=60, users=40, ratings_per_user=12, seed=2)
+    strategy = SimilarUsersStrategy(exact_compat=True)
+    with data_manager.reading():
+        for user in data_manager._users.values():
+            assert strategy(data_manager, user) == original_similar(data_manager, user, strategy.recommendation_count)
@@ -0,0 +1,46 @@
+import stepik_pandas
+from stepik_pandas import DataManager, Film, Genres, RecommendationService
+
+
+def dump(data_manager):
+    films = {film.movie_id: (film.title, film.genres, film.director, film.year, film.rating)
+             for film in data_manager._films.values()}
+    users = {user.user_id: (user.user_name, user.preferred_genres,
+                            {film.movie_id: rating for film, rating in user.watched_films.items()})
+             for user in data_manager._users.values()}
+    return films, users
+
+
+def recommendations(data_manager):
+    service = RecommendationService(cache_size=0)
+    names = [name for name in service.available_strategies if name != "als"]
+    with data_manager.reading():
+        return {(name, user.user_id): [film.movie_id for film in service[name](data_manager, user)]
+                for user in list(data_manager._users.values())[:20] for name in names}
+
+
+def test_snapshot_round_trip(make_data, tmp_path):
+    data_manager = make_data(stepik_pandas)
+    data_manager.save_snapshot(tmp_path / "first.snap")
+    opened = DataManager.open_snapshot(tmp_path / "first.snap")
+    assert dump(opened) == dump(data_manager)
+    assert recommendations(opened) == recommendations(data_manager)
+
+    opened.save_snapshot(tmp_path / "second.snap")
+    assert dump(DataManager.open_snapshot(tmp_path / "second.snap")) == dump(data_manager)
+
+
+def test_changes_after_open_survive_next_snapshot(make_data, tmp_path):
+    data_manager = make_data(stepik_pandas)
+    data_manager.save_snapshot(tmp_path / "first.snap")
+    opened = DataManager.open_snapshot(tmp_path / "first.snap")
+    for target in (data_manager, opened):
+        target.add_film(Film(1000, "Новый фильм", [Genres.DRAMA, Genres.COMEDY], "Режиссёр", 2020, 9.5))
+        target._films[5].genres = [Genres.HORROR]
+        user = target._users[3]
+        user.add_watched_film(target._films[1000], 8.0)
+        user.preferred_genres = [Genres.HORROR]
+    opened.save_snapshot(tmp_path / "second.snap")
+    reopened = DataManager.open_snapshot(tmp_path / "second.snap")
+    assert dump(reopened) == dump(data_manager)
+    assert recommendations(reopened) == recommendations(data_manager)
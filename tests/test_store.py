@@ -0,0 +1,66 @@
+import stepik_pandas
+from stepik_pandas import RecommendationService, RecommendationStore
+
+
+def film_ids(results):
+    return {name: [film.movie_id for film in result.films] for name, result in results.items()}
+
+
+def live(service, data_manager, user):
+    with data_manager.reading():
+        return film_ids(service.get_all_recommendations(data_manager, user))
+
+
+def test_other_users_ratings_do_not_evict_stored_results(make_data):
+    data_manager = make_data(stepik_pandas)
+    service = RecommendationService(cache_size=0)
+    store = RecommendationStore(service, data_manager, capacity=10, max_staleness=3600)
+    user, other = data_manager._users[1], data_manager._users[2]
+    stored = film_ids(store.get_all_recommendations(user))
+    store.get_all_recommendations(other)
+
+    unseen = next(film for film in data_manager._films.values() if film not in other.watched_films)
+    other.add_watched_film(unseen, 10.0)
+    assert film_ids(store.get_all_recommendations(user)) == stored
+    assert (store.hits, store.misses) == (1, 2)
+    assert store.stats["dirty"] == 1  # пересчитается только сам other
+    assert store.refresh() == 1
+    assert film_ids(store.get_all_recommendations(other)) == live(service, data_manager, other)
+    assert store.hits == 2
+
+
+def test_own_rating_and_staleness_invalidate_stored_results(make_data):
+    data_manager = make_data(stepik_pandas)
+    service = RecommendationService(cache_size=0)
+    store = RecommendationStore(service, data_manager, capacity=10, max_staleness=3600)
+    user = data_manager._users[1]
+    store.get_all_recommendations(user)
+    user.add_watched_film(next(film for film in data_manager._films.values() if film not in user.watched_films), 9.0)
+    assert film_ids(store.get_all_recommendations(user)) == live(service, data_manager, user)
+    assert (store.hits, store.misses) == (0, 2)
+
+    store._max_staleness = 0.0
+    store.get_all_recommendations(user)
+    assert (store.hits, store.misses) == (0, 3)
+
+
+def test_background_refresh_recomputes_outdated_entries(make_data):
+    data_manager = make_data(stepik_pandas)
+    service = RecommendationService(cache_size=0)
+    store = RecommendationStore(service, data_manager, capacity=10, refresh_after=3600)
+    user = data_manager._users[1]
+    store.get_all_recommendations(user)
+    assert store.refresh() == 0
+    data_manager.add_film(stepik_pandas.Film(10_000, "Новый", [stepik_pandas.Genres.DRAMA], "Кто-то", 2024, 9.9))
+    assert store.refresh() == 1
+    assert film_ids(store.get_all_recommendations(user)) == live(service, data_manager, user)
+    assert store.hits == 1
+
+
+def test_ratings_do_not_count_as_activity(make_data):
+    data_manager = make_data(stepik_pandas)
+    store = RecommendationStore(RecommendationService(cache_size=0), data_manager, capacity=10)
+    user = data_manager._users[3]
+    user.add_watched_film(next(film for film in data_manager._films.values() if film not in user.watched_films), 5.0)
+    assert store.stats["tracked"] == 0
+    assert store.stats["dirty"] == 0
@@ -0,0 +1,37 @@
+from itertools import islice
+
+import pytest
+
+import stepik_pandas
+
+
+def test_genre_tiers_match_brute_force(make_data):
+    data_manager = make_data(stepik_pandas, films=200, users=5, ratings_per_user=10)
+    films = list(data_manager._films.values())
+    data_manager.add_film(stepik_pandas.Film(500, "Новый", [stepik_pandas.Genres.DRAMA], "Режиссёр", 2020, 5.0))
+    films[0].genres = [stepik_pandas.Genres.DRAMA, stepik_pandas.Genres.COMEDY]
+    user = data_manager._users[1]
+    user.add_watched_film(films[1], 7.0)
+    for genres in ([stepik_pandas.Genres.DRAMA], [stepik_pandas.Genres.DRAMA, stepik_pandas.Genres.COMEDY],
+                   list(stepik_pandas.Genres)[:4]):
+        expected = {}
+        for film in data_manager._films.values():
+            count = len(set(film.genres) & set(genres))
+            if count and film not in user.watched_films:
+                expected.setdefault(count, set()).add(film._row)
+        watched = (film._row for film in user.watched_films)
+        tiers = list(data_manager.match_genre_tiers(genres, watched))
+        assert [count for count, _ in tiers] == sorted(expected, reverse=True)
+        assert {count: set(rows) for count, rows in tiers} == expected
+
+
+@pytest.mark.parametrize("name", ["genre", "rating", "similar", "knn", "community", "hybrid"])
+def test_strategies_skip_watched_films(make_data, name):
+    data_manager = make_data(stepik_pandas, films=200, users=40, ratings_per_user=30, seed=3)
+    strategy = stepik_pandas.RecommendationService(cache_size=0)[name]
+    strategy.recommendation_count = 50
+    with data_manager.reading():
+        for user in data_manager._users.values():
+            films = strategy(data_manager, user) + list(islice(strategy.iter_films(data_manager, user), 50))
+            assert films
+            assert not any(film in user.watched_films for film in films)